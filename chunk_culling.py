@@ -0,0 +1,127 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Per-frame culling of the chunk display lists drawn by MCRenderer.
+
+ChunkDrawSet is built whenever MCRenderer recreates its master lists. It records each chunk renderer's display lists
+by renderstate, and a bounding sphere around the sections that hold geometry. The chunks are grouped by region
+(32x32 chunks). Each frame, visibleLists tests the region spheres against the viewing frustum first, then the chunk
+spheres of the visible regions only. It then joins the display lists of the visible chunks into one array per
+renderstate. The arrays are kept while the set of visible chunks stays the same, so a frame in which no chunk
+enters or leaves the view costs only the frustum tests.
+
+Occlusion hint: each column is covered by its top run of plain opaque cubes (see ChunkCalculator.opaqueCover). A
+section lying under the cover of every column of its chunk and of the eight chunks around it cannot be seen from
+above those covers. While the camera is above all of them, such sections are left out. This covers most of the
+underground of a surface world. Overhangs and caves end a column's cover, so what lies below them stays drawn, and
+a camera below the top of any cover in the area, e.g. in a cave or a valley, turns the hint off for those chunks.
+"""
+
+from collections import defaultdict
+import math
+
+import numpy
+
+UNSECTIONED = 1 << 30  # section top of the renderers that are not tied to a section, e.g. entities
+
+
+class ChunkDrawSet(object):
+    """
+    :param chunkRenderers: {position: ChunkRenderer} of the renderer. Those with display lists are drawn; the others
+        only provide their surface heights to their neighbours.
+    :param origin: Offset the chunks are drawn at, as MCRenderer.origin
+    """
+
+    def __init__(self, chunkRenderers, origin=(0, 0, 0)):
+        drawn = [cr for cr in chunkRenderers.itervalues() if cr.renderstateLists]
+        self.count = len(drawn)
+        self._key = None
+        self._lists = {}
+        if not drawn:
+            return
+
+        ox, oy, oz = origin
+        chunkPositions = [cr.chunkPosition for cr in drawn]
+        positions = numpy.array(chunkPositions, dtype='int64').reshape(-1, 2)
+        ranges = numpy.array([cr.geometryRange for cr in drawn], dtype='float64').reshape(-1, 2)
+
+        centres = numpy.empty((len(drawn), 4))
+        centres[:, 0] = positions[:, 0] * 16 + 8 + ox
+        centres[:, 1] = (ranges[:, 0] + ranges[:, 1]) / 2 + oy
+        centres[:, 2] = positions[:, 1] * 16 + 8 + oz
+        centres[:, 3] = 1.0
+        halfHeights = (ranges[:, 1] - ranges[:, 0]) / 2 + 1  # geometry may reach a little past its sections
+        self.centres = centres
+        self.radii = numpy.sqrt(2 * 9 * 9 + halfHeights * halfHeights)
+
+        # Regions, each with the sphere around its chunks' spheres
+        regionKeys = [(cx >> 5, cz >> 5) for cx, cz in chunkPositions]
+        regionIndex = {}
+        self.chunkRegions = numpy.array([regionIndex.setdefault(k, len(regionIndex)) for k in regionKeys], 'int32')
+        regionCount = len(regionIndex)
+        self.regionCentres = numpy.empty((regionCount, 4))
+        self.regionRadii = numpy.empty(regionCount)
+        for r in xrange(regionCount):
+            members = self.chunkRegions == r
+            low = (centres[members, :3] - self.radii[members, numpy.newaxis]).min(axis=0)
+            high = (centres[members, :3] + self.radii[members, numpy.newaxis]).max(axis=0)
+            self.regionCentres[r, :3] = (low + high) / 2
+            self.regionCentres[r, 3] = 1.0
+            self.regionRadii[r] = math.sqrt(((high - low) ** 2).sum()) / 2
+
+        # Bottom and top of the covers around each chunk, for the occlusion hint
+        surfaces = dict((pos, (cr.surfaceMin, cr.surfaceMax)) for pos, cr in chunkRenderers.iteritems())
+        neighbourhoods = [[surfaces.get((cx + dx, cz + dz), (0, 0)) for dx in (-1, 0, 1) for dz in (-1, 0, 1)]
+                          for cx, cz in chunkPositions]
+        self.surfaceMin = numpy.array([min(s[0] for s in n) for n in neighbourhoods], 'int32')
+        self.surfaceMax = numpy.array([max(s[1] for s in n) for n in neighbourhoods], 'int32')
+
+        # (all lists, lists above the surface) of each renderstate of each chunk
+        self.chunkLists = []
+        for cr, surface in zip(drawn, self.surfaceMin):
+            chunkLists = {}
+            for rs, lists in cr.renderstateLists.iteritems():
+                lists = numpy.array(lists, dtype='uint32').ravel()
+                tops = numpy.array(cr.renderstateTops.get(rs, ()), dtype='int32')
+                if len(tops) == len(lists):
+                    above = lists[tops > surface]
+                else:
+                    above = lists
+                chunkLists[rs] = lists, above
+            self.chunkLists.append(chunkLists)
+
+    def visibleMask(self, frustum):
+        """ Boolean array of the chunks whose sphere is inside frustum, testing their regions first. """
+        if frustum is None:
+            return numpy.ones(self.count, bool)
+        regionVisible = frustum.visible(self.regionCentres, self.regionRadii[:, numpy.newaxis])
+        visible = regionVisible[self.chunkRegions]
+        candidates = visible.nonzero()[0]
+        if len(candidates):
+            visible[candidates] = frustum.visible(self.centres[candidates], self.radii[candidates, numpy.newaxis])
+        return visible
+
+    def visibleLists(self, frustum, cameraY):
+        """
+        Return {renderstate: array of display lists} for the chunks visible in frustum. cameraY is the height of the
+        camera in the chunks' coordinates, used for the occlusion hint.
+        """
+        if not self.count:
+            return self._lists
+        visible = self.visibleMask(frustum)
+        aboveSurface = self.surfaceMax <= cameraY
+        key = visible.tostring() + aboveSurface.tostring()
+        if key == self._key:
+            return self._lists
+
+        chunkLists = defaultdict(list)
+        for i in visible.nonzero()[0].tolist():
+            hint = int(aboveSurface[i])
+            for rs, lists in self.chunkLists[i].iteritems():
+                if len(lists[hint]):
+                    chunkLists[rs].append(lists[hint])
+
+        self._lists = dict((rs, numpy.concatenate(arrays)) for rs, arrays in chunkLists.iteritems())
+        self._key = key
+        return self._lists
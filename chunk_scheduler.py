@@ -0,0 +1,190 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Order in which MCRenderer meshes chunks, and which chunk renderers it discards when over its buffer budget.
+
+A chunk's priority is (hidden, distance). hidden is False when the chunk column is inside the viewing frustum.
+distance is measured horizontally from the camera to the chunk's centre. Every chunk column has the same size, so
+the closest visible chunk is also the one that covers the most of the screen. The pending and invalid chunks are
+kept in ChunkQueue heaps ordered by priority, and the loaded chunk renderers are kept in a heap ordered by
+decreasing distance for eviction.
+
+When the camera moves or turns far enough, setCamera starts a new epoch. The first time a heap is used in a new
+epoch, every entry is given a new priority, computed for all of them at once, and the heap is rebuilt with heapify
+in O(n). Every entry is then current, so the top of each heap is always the true closest or farthest chunk. Camera
+changes below the thresholds keep the old priorities. Hidden chunks are not handed out. They stay queued until a
+turn of the camera brings them into view.
+"""
+
+import heapq
+
+import numpy
+
+
+class ChunkQueue(object):
+    """ A set of chunk positions popped in order of priority, closest visible chunk first. """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.heap = []
+        self.members = set()
+        self.epoch = scheduler.epoch
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, cPos):
+        return cPos in self.members
+
+    def clear(self):
+        self.heap = []
+        self.members = set()
+
+    def reset(self, positions):
+        """ Replace the queue's contents with positions. """
+        positions = list(set(positions))
+        self.members = set(positions)
+        self.heap = self.scheduler.entries(positions)
+        heapq.heapify(self.heap)
+        self.epoch = self.scheduler.epoch
+
+    def push(self, cPos):
+        if cPos in self.members:
+            return
+        self.members.add(cPos)
+        if self.epoch != self.scheduler.epoch:
+            self.rekey()
+        heapq.heappush(self.heap, self.scheduler.entry(cPos))
+
+    def pop(self):
+        """ Remove and return the closest visible chunk, or None if every queued chunk is hidden. """
+        if self.epoch != self.scheduler.epoch:
+            self.rekey()
+        if not self.heap or self.heap[0][0]:
+            return None
+        cPos = heapq.heappop(self.heap)[2]
+        self.members.discard(cPos)
+        return cPos
+
+    def rekey(self):
+        """ Give every entry its priority in the scheduler's current epoch and rebuild the heap. """
+        self.heap = self.scheduler.entries([entry[2] for entry in self.heap])
+        heapq.heapify(self.heap)
+        self.epoch = self.scheduler.epoch
+
+
+class ChunkScheduler(object):
+    """
+    :ivar pending: Chunks to mesh or whose detail level may need updating, refilled by MCRenderer.loadNearbyChunks
+    :ivar invalid: Chunks with invalidated layers, meshed before the pending ones
+    """
+
+    moveThreshold = 4.0  # blocks the camera moves before priorities are recomputed
+    turnThreshold = 0.02  # change in the frustum planes before priorities are recomputed
+
+    def __init__(self, height=256):
+        self.height = height
+        self.epoch = 0
+        self.position = (0.0, 0.0)
+        self.frustum = None
+        self._planes = None
+        self.pending = ChunkQueue(self)
+        self.invalid = ChunkQueue(self)
+        self._loadedHeap = []
+        self._loadedEpoch = self.epoch
+        self._loaded = set()
+
+    def clear(self):
+        self.pending.clear()
+        self.invalid.clear()
+        self.clearLoaded()
+
+    def setCamera(self, position, frustum):
+        """
+        Update the camera. position is the (x, z) of the camera in the renderer's coordinates, frustum a
+        frustum.Frustum or None. Starts a new epoch if the camera moved or turned far enough.
+        """
+        planes = None if frustum is None else frustum.planes
+        moved = max(abs(a - b) for a, b in zip(position, self.position)) >= self.moveThreshold
+        if planes is None or self._planes is None:
+            turned = planes is not self._planes
+        else:
+            turned = numpy.abs(planes - self._planes).max() > self.turnThreshold
+        if moved or turned:
+            self.position = tuple(position)
+            self.frustum = frustum
+            self._planes = None if planes is None else numpy.array(planes)
+            self.epoch += 1
+
+    def priorities(self, positions):
+        """ Return (hidden, distance) arrays for a sequence of chunk positions. """
+        chunks = numpy.array(positions, dtype='float64').reshape(-1, 2)
+        centres = chunks * 16 + 8
+        distance = numpy.hypot(centres[:, 0] - self.position[0], centres[:, 1] - self.position[1])
+        if self.frustum is None:
+            hidden = numpy.zeros(len(chunks), bool)
+        else:
+            halfHeight = self.height / 2
+            points = numpy.empty((len(chunks), 4))
+            points[:, 0] = centres[:, 0]
+            points[:, 1] = halfHeight
+            points[:, 2] = centres[:, 1]
+            points[:, 3] = 1.0
+            hidden = ~self.frustum.visible(points, halfHeight)
+        return hidden, distance
+
+    def entry(self, cPos):
+        hidden, distance = self.priorities([cPos])
+        return bool(hidden[0]), float(distance[0]), cPos
+
+    def entries(self, positions):
+        """ ChunkQueue heap entries for positions, in the order given. """
+        if not positions:
+            return []
+        hidden, distance = self.priorities(positions)
+        return zip(hidden.tolist(), distance.tolist(), positions)
+
+    def distance(self, cPos):
+        return self.entry(cPos)[1]
+
+    # --- Eviction ---
+
+    def addLoaded(self, cPos):
+        """ Track a chunk renderer as a candidate for eviction. """
+        if cPos in self._loaded:
+            return
+        self._loaded.add(cPos)
+        if self._loadedEpoch != self.epoch:
+            self._rekeyLoaded()
+        heapq.heappush(self._loadedHeap, (-self.distance(cPos), cPos))
+
+    def forgetLoaded(self, cPos):
+        self._loaded.discard(cPos)
+
+    def clearLoaded(self):
+        self._loadedHeap = []
+        self._loaded = set()
+
+    def _rekeyLoaded(self):
+        """ Rebuild the eviction heap from the tracked chunks' distances in the current epoch. """
+        positions = list(self._loaded)
+        self._loadedHeap = []
+        if positions:
+            distance = self.priorities(positions)[1]
+            self._loadedHeap = zip((-distance).tolist(), positions)
+            heapq.heapify(self._loadedHeap)
+        self._loadedEpoch = self.epoch
+
+    def farthestLoaded(self):
+        """ Return (position, distance) of the farthest tracked chunk renderer, or None. It stays tracked. """
+        if self._loadedEpoch != self.epoch:
+            self._rekeyLoaded()
+        heap = self._loadedHeap
+        while heap:
+            negDistance, cPos = heap[0]
+            if cPos not in self._loaded:
+                heapq.heappop(heap)
+                continue
+            return cPos, -negDistance
+        return None
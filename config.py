@@ -499,6 +499,8 @@ definitions = {
         ] + [
         ("fastLeaves", "fast leaves", True),
         ("roughGraphics", "rough graphics", False),
+        ("greedyMeshing", "greedy meshing", True),
+        ("drawFarTerrain", "draw far terrain", True),
         ("showChunkRedraw", "show chunk redraw", True),
         ("drawSky", "draw sky", True),
         ("drawFog", "draw fog", True),
@@ -517,6 +519,8 @@ definitions = {
         ("recentWorlds", "Recent Worlds", ['']),
         ("resourcePack", "Resource Pack", u"Default"),
         ("maxCopies", "Copy stack size", 32),
+        ("clipboardMemoryLimit", "Clipboard memory limit", 256),
+        ("autosaveInterval", "Autosave interval", 120),
         ("superSecretSettings", "Super Secret Settings", False),
         ("compassToggle", "Compass Toggle", True),
         ("compassSize", "Compass Size", 60),
@@ -567,11 +567,11 @@ class BrushTool(CloneTool):
             self.showPanel()
             self.setupPreview()
         if getattr(self.brushMode, 'addPasteButton', False):
-            stack = self.editor.copyStack
-            if len(stack) == 0:
+            schematic = self.editor.getLastCopiedSchematic()
+            if schematic is None:
                 self.importPaste()
             else:
-                self.loadLevel(stack[0])
+                self.loadLevel(schematic)
 
     def saveBrushPreset(self, name):
         """
@@ -37,6 +37,7 @@ from albow.dialogs import wrapped_label, alert, Dialog
 import pymclevel
 # from pymclevel import BoundingBox, MCEDIT_DEFS, MCEDIT_IDS
 from pymclevel import BoundingBox
+from pymclevel import chunk_pipeline
 from pymclevel.id_definitions import version_defs_ids
 import json
 import directories
@@ -894,6 +895,15 @@ class FilterToolPanel(Panel):
             self.filterOptionsPanel.confirm(self.tool)
 
 
+def performChunkFilters(level, box, filters):
+    """ Run filters defining performChunk over box in one pipelined pass. filters is a list of
+    (module, options) pairs. """
+    if box.chunkCount > 25:
+        showProgress("Applying filters...", chunk_pipeline.performChunkFiltersIter(level, box, filters))
+    else:
+        chunk_pipeline.performChunkFilters(level, box, filters)
+
+
 class FilterOperation(Operation):
     def __init__(self, editor, level, box, filter, options):
         super(FilterOperation, self).__init__(editor, level)
@@ -917,7 +927,10 @@ class FilterOperation(Operation):
 #         from pymclevel import MCEDIT_DEFS, MCEDIT_IDS 
         self.filter.MCEDIT_DEFS = self.level.defsIds.mcedit_defs
         self.filter.MCEDIT_IDS = self.level.defsIds.mcedit_ids
-        self.filter.perform(self.level, BoundingBox(self.box), self.options)
+        if chunk_pipeline.supportsChunkPipeline(self.filter):
+            performChunkFilters(self.level, BoundingBox(self.box), [(self.filter, self.options)])
+        else:
+            self.filter.perform(self.level, BoundingBox(self.box), self.options)
 
         self.canUndo = True
 
@@ -939,8 +952,18 @@ class MacroOperation(Operation):
         if recordUndo:
             self.undoLevel = self.extractUndo(self.level, self._box)
 
+        # Consecutive filters that define performChunk are run together in a single pass over the chunks.
+        chunkFilters = []
         for o, f in zip(self.options, self.filters):
+            if chunk_pipeline.supportsChunkPipeline(f):
+                chunkFilters.append((f, o))
+                continue
+            if chunkFilters:
+                performChunkFilters(self.level, BoundingBox(self._box), chunkFilters)
+                chunkFilters = []
             f.perform(self.level, BoundingBox(self._box), o)
+        if chunkFilters:
+            performChunkFilters(self.level, BoundingBox(self._box), chunkFilters)
         self.canUndo = True
 
     def dirtyBox(self):
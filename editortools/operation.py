@@ -3,9 +3,12 @@
 
 #-# Modified by D.C.-G. for translation purpose
 import atexit
+import logging
 import os
 import shutil
 import tempfile
+import threading
+import weakref
 import albow
 from albow.translate import _
 from pymclevel import BoundingBox
@@ -13,7 +16,9 @@ import numpy
 from albow.root import Cancel
 import pymclevel
 from albow import showProgress
-from pymclevel.mclevelbase import exhaust
+from pymclevel.mclevelbase import exhaust, ChunkNotPresent
+
+log = logging.getLogger(__name__)
 
 undo_folder = os.path.join(tempfile.gettempdir(), "mcedit_undo", str(os.getpid()))
 
@@ -28,6 +33,108 @@ def mkundotemp():
 atexit.register(shutil.rmtree, undo_folder, True)
 
 
+class SnapshotUndoLevel(object):
+    """ Undo record for chunked levels made of chunk snapshots (see MCInfdevOldLevel.snapshotChunk). A loaded chunk
+    shares its block arrays copy-on-write and has its entities copied; a chunk that is not loaded is kept as its
+    compressed bytes. When the snapshots of all live undo records exceed memoryLimit, the oldest records are written
+    out to a temporary world by a background thread. Arrays still shared with the live chunk do not count towards
+    the limit, since they cost nothing until the chunk is edited. """
+
+    memoryLimit = 256 * 1024 * 1024
+    _records = []
+    _recordsLock = threading.Lock()
+
+    def __init__(self, level):
+        self.level = level
+        self._snapshots = {}
+        self._chunks = []
+        self._spillLevel = None
+        self._spillThread = None
+        self._lock = threading.RLock()
+        with self._recordsLock:
+            self._records.append(weakref.ref(self))
+
+    def captureChunk(self, cx, cz):
+        if not self.level.containsChunk(cx, cz):
+            return
+        try:
+            snapshot = self.level.snapshotChunk(cx, cz)
+        except ChunkNotPresent:
+            return
+        with self._lock:
+            if (cx, cz) not in self._snapshots:
+                self._chunks.append((cx, cz))
+            self._snapshots[cx, cz] = snapshot
+
+    @property
+    def allChunks(self):
+        return iter(self._chunks)
+
+    @property
+    def chunkCount(self):
+        return len(self._chunks)
+
+    @property
+    def memoryUsed(self):
+        with self._lock:
+            return sum(s.copiedBytes for s in self._snapshots.itervalues())
+
+    def copyChunkTo(self, level, cx, cz):
+        with self._lock:
+            snapshot = self._snapshots.get((cx, cz))
+            if snapshot is not None:
+                level.restoreChunkSnapshot(snapshot)
+            elif self._spillLevel is not None:
+                level.copyChunkFrom(self._spillLevel, cx, cz)
+
+    def spill(self):
+        """ Start writing this record's snapshots to disk in the background. """
+        with self._lock:
+            if self._spillThread is not None or not self._snapshots:
+                return
+            self._spillThread = threading.Thread(target=self._spill, name="SnapshotUndoLevel spill")
+            self._spillThread.daemon = True
+            self._spillThread.start()
+
+    def _spill(self):
+        try:
+            with self._lock:
+                if self._spillLevel is None:
+                    # A scratch folder like the other temporary worlds: no fsyncs on its region header commits.
+                    path = mkundotemp()
+                    self._spillLevel = pymclevel.MCInfdevOldLevel(
+                        path, create=True, worldFolder=pymclevel.infiniteworld.AnvilWorldFolder(path, durable=False))
+                    self._spillLevel.Height = self.level.Height
+                spillLevel = self._spillLevel
+            for cPos in list(self._chunks):
+                with self._lock:
+                    snapshot = self._snapshots.get(cPos)
+                    if snapshot is None:
+                        continue
+                    spillLevel.worldFolder.saveChunk(cPos[0], cPos[1], snapshot.savedTagData())
+                    del self._snapshots[cPos]
+        except Exception as e:
+            log.warning(u"Could not write undo snapshots to disk: {0!r}".format(e))
+        finally:
+            with self._lock:
+                self._spillThread = None
+
+    @classmethod
+    def checkMemoryPressure(cls):
+        """ Spill the oldest undo records until the snapshots still in memory fit in memoryLimit. """
+        with cls._recordsLock:
+            cls._records[:] = [r for r in cls._records if r() is not None]
+            records = [r() for r in cls._records]
+        records = [r for r in records if r is not None]
+
+        used = sum(r.memoryUsed for r in records)
+        for record in records[:-1]:
+            if used <= cls.memoryLimit:
+                break
+            used -= record.memoryUsed
+            record.spill()
+
+
 class Operation(object):
     changedLevel = True
     undoLevel = None
@@ -52,6 +159,13 @@ class Operation(object):
 
             return self.extractUndoSchematic(level, box)
 
+        if hasattr(level, "snapshotChunk") and not level.readonly:
+            undoLevel = SnapshotUndoLevel(level)
+            for cx, cz in chunks:
+                undoLevel.captureChunk(cx, cz)
+            SnapshotUndoLevel.checkMemoryPressure()
+            return undoLevel
+
         undoLevel = pymclevel.MCInfdevOldLevel(mkundotemp(), create=True)
         if not chunkCount:
             try:
@@ -104,7 +218,11 @@ class Operation(object):
 
             def _undo():
                 yield 0, 0, "Undoing..."
-                if hasattr(self.level, 'copyChunkFrom'):
+                if isinstance(self.undoLevel, SnapshotUndoLevel):
+                    for i, (cx, cz) in enumerate(self.undoLevel.allChunks):
+                        self.undoLevel.copyChunkTo(self.level, cx, cz)
+                        yield i, self.undoLevel.chunkCount, "Copying chunk %s..." % ((cx, cz),)
+                elif hasattr(self.level, 'copyChunkFrom'):
                     for i, (cx, cz) in enumerate(self.undoLevel.allChunks):
                         self.level.copyChunkFrom(self.undoLevel, cx, cz)
                         yield i, self.undoLevel.chunkCount, "Copying chunk %s..." % ((cx, cz),)
@@ -124,7 +242,11 @@ class Operation(object):
         if self.redoLevel:
             def _redo():
                 yield 0, 0, "Redoing..."
-                if hasattr(self.level, 'copyChunkFrom'):
+                if isinstance(self.redoLevel, SnapshotUndoLevel):
+                    for i, (cx, cz) in enumerate(self.redoLevel.allChunks):
+                        self.redoLevel.copyChunkTo(self.level, cx, cz)
+                        yield i, self.redoLevel.chunkCount, "Copying chunk %s..." % ((cx, cz),)
+                elif hasattr(self.level, 'copyChunkFrom'):
                     for i, (cx, cz) in enumerate(self.redoLevel.allChunks):
                         self.level.copyChunkFrom(self.redoLevel, cx, cz)
                         yield i, self.redoLevel.chunkCount, "Copying chunk %s..." % ((cx, cz),)
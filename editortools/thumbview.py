@@ -11,7 +11,11 @@ from renderer import PreviewRenderer
 
 
 class ThumbView(GLPerspective):
-    def __init__(self, sch, **kw):
+    def __init__(self, sch, releaseSchematic=False, **kw):
+        """
+        :param releaseSchematic: Drop the schematic and the renderer's chunks once the thumbnail has been drawn
+            into its texture.
+        """
         GLPerspective.__init__(self, **kw)  # self, xmin= -32, xmax=32, ymin= -32, ymax=32, near= -1000, far=1000)
         self.p_margin = 0
         self.p_spacing = 0
@@ -19,6 +23,7 @@ class ThumbView(GLPerspective):
         self.set_position_modifiers()
         self.far = 16000
         self.schematic = sch
+        self.releaseSchematic = releaseSchematic
         self.renderer = PreviewRenderer(sch)
         self.fboSize = (128, 128)
         self.root = self.get_root()
@@ -50,12 +55,15 @@ class ThumbView(GLPerspective):
         GL.glClear(GL.GL_DEPTH_BUFFER_BIT | GL.GL_COLOR_BUFFER_BIT)
 
     def gl_draw(self):
-        if self.schematic.chunkCount > len(self.renderer.chunkRenderers):
+        if self.fbo is None and self.schematic.chunkCount > len(self.renderer.chunkRenderers):
             self.gl_draw_thumb()
         else:
             if self.fbo is None:
                 w, h = self.fboSize
                 self.fbo = FramebufferTexture(w, h, self.gl_draw_tex)
+                if self.releaseSchematic:
+                    self.renderer.level = None
+                    self.schematic = None
             GL.glMatrixMode(GL.GL_PROJECTION)
             GL.glLoadIdentity()
             GL.glMatrixMode(GL.GL_MODELVIEW)
@@ -3,8 +3,8 @@
 
 import ftputil
 import os
-import shutil
 from ftputil.error import PermanentError
+from pymclevel.world_sync import WorldSync
 
 class CouldNotFindPropertiesException(Exception):
     """
@@ -29,18 +29,20 @@ class FTPClient:
     Wrapper client to download and upload worlds to a FTP Server
     """
     
+    connections = 4
+
     def download(self):
         """
-        Downloads all files in the current FTP directory with their corresponding paths
+        Downloads the files of the world that changed since the last download or upload
         """
-        for root, directory, files in self._host.walk(self._host.curdir):
-            try:
-                os.makedirs(os.path.join('ftp', self._worldname, root[2:]))
-            except OSError:
-                pass
-            for f in files:
-                self._host.download(self._host.path.join(root, f), os.path.join('ftp', self._worldname, root, f))
-                
+        self._sync.pull()
+
+    def download_iter(self):
+        """
+        Same as download, yielding (files done, file count) tuples
+        """
+        return self._sync.pullIter()
+
     def upload_new_world(self, world):
         """
         Uploads a new world to the current FTP server connection
@@ -72,54 +74,45 @@ class FTPClient:
                     else:
                         print "Error: {0}".format(e.message)
                 
-    def upload(self):
+    def upload(self, overwrite=False):
         """
-        Uploads an edited world to the current FTP server connection
+        Uploads the files of the edited world that changed since they were downloaded. Raises
+        pymclevel.world_sync.RemoteChanged if some of them also changed on the server, unless overwrite is True
         """
-        for root, directory, files in os.walk(os.path.join('ftp', self._worldname)):
-            for folder in directory:
-                target = self._host.path.join(root, folder).replace("ftp"+os.path.sep+self._worldname+"/", "").replace("\\", "", 1).replace("\\", "/")
-                target = target.replace("ftp"+self._worldname, "")
-                if not "##MCEDIT.TEMP##" in target:
-                    if not self._host.path.exists(target):
-                        self._host.makedirs(target)
-        for root, directory, files in os.walk(os.path.join('ftp', self._worldname)):
-            for f in files:
-                if self._host.path.join(root, f).replace("ftp"+os.path.sep+self._worldname, "").startswith("\\"):
-                    target = self._host.path.join(root, f).replace("ftp"+os.path.sep+self._worldname, "").replace("\\", "", 1)
-                else :
-                    target = self._host.path.join(root, f).replace("ftp"+os.path.sep+self._worldname, "")
-                    
-                if "\\" in target:
-                    target = target.replace("\\", "/")
-                try:
-                    self._host.upload(os.path.join(root, f), target)
-                except Exception as e:
-                    if "226" in e.message:
-                        pass
-        
+        self._sync.push(overwrite)
+
+    def upload_iter(self, overwrite=False):
+        """
+        Same as upload, yielding (files done, file count) tuples
+        """
+        return self._sync.pushIter(overwrite)
+
+    def upload_conflicts(self):
+        """
+        Gets the files an upload would overwrite that changed on the server since they were downloaded
+        """
+        return self._sync.pushConflicts()
+
     def cleanup(self):
         """
-        Closes the FTP connection and removes all leftover files from the 'ftp' directory
+        Closes the FTP connection. The local copy of the world is kept so the next download only fetches changes
         """
         if hasattr(self, '_host'):
             self._host.close()
-        shutil.rmtree('ftp')
-        
+        if os.path.exists(os.path.join('ftp', 'server.properties')):
+            os.remove(os.path.join('ftp', 'server.properties'))
+
     def safe_download(self):
         """
-        Changes the FTP client's working directory, downloads the world, then switches back to the original working directory
+        Downloads the world
         """
-        old_dir = self._host.curdir
-        self._host.chdir(self._worldname)
         self.download()
-        self._host.chdir(old_dir)
-            
+
     def get_level_path(self):
         """
         Gets the local path to the downloaded FTP world
         """
-        return os.path.join('ftp', self._worldname)
+        return self._sync.localRoot
                 
     def __init__(self, ip, username='anonymous', password=''):
         """
@@ -140,6 +133,7 @@ class FTPClient:
             self._host = ftputil.FTPHost(ip, username, password)
         except PermanentError:
             raise InvalidCreditdentialsException("Incorrect username or password")
+        self._host_factory = lambda: ftputil.FTPHost(ip, username, password)
             
         self._worldname = None
         if 'server.properties' in self._host.listdir(self._host.curdir):
@@ -157,9 +151,13 @@ class FTPClient:
         else:
             raise CouldNotFindPropertiesException("Could not find the server.properties file! The FTP client will not be able to download the world unless the server.properties file is in the default FTP directory")
         if self._worldname in self._host.listdir(self._host.curdir):
-            try:
-                os.mkdir(os.path.join('ftp', self._worldname))
-            except OSError:
-                pass
+            # One local copy per server, kept between sessions.
+            server_folder = os.path.join('ftp', "".join(c if c.isalnum() else "_" for c in "%s@%s" % (username, ip)))
+            local_root = os.path.join(server_folder, self._worldname)
+            if not os.path.exists(local_root):
+                os.makedirs(local_root)
+            self._sync = WorldSync(self._host_factory, self._worldname, local_root,
+                                   os.path.join(server_folder, self._worldname + ".sync.json"),
+                                   connections=self.connections)
         else:
             raise CouldNotFindWorldFolderException("Could not find the world folder from the server.properties file")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Greedy meshing for the untextured low detail terrain drawn by LowDetailBlockRenderer.
+
+The low detail renderer makes one top quad per column of a chunk, coloured with the block's flat colour, plus two
+side quads that reach down to the lowest neighbouring column. mergeGridQuads joins neighbouring top quads with the
+same height and colour into rectangles, so a flat ocean or desert chunk is drawn with a handful of quads instead of
+256. exposedColumns finds the columns whose side quads are enclosed by their neighbours and can be left out.
+
+The high detail block renderers are not merged: their faces are textured from the terrain atlas, and a quad larger
+than one block would stretch its tile instead of repeating it.
+"""
+
+import numpy
+
+
+def greedyRectangles(keys, mask):
+    """
+    Cover the cells of the 2D array keys where mask is True with rectangles of equal keys, largest first along the
+    second axis.
+
+    :return: A list of (x, z, width, length) tuples
+    """
+    width, length = keys.shape
+    keys = keys.tolist()
+    free = mask.tolist()
+    rects = []
+    for x in xrange(width):
+        row = free[x]
+        for z in xrange(length):
+            if not row[z]:
+                continue
+            key = keys[x][z]
+            l = 1
+            while z + l < length and row[z + l] and keys[x][z + l] == key:
+                l += 1
+            w = 1
+            while x + w < width and all(free[x + w][k] and keys[x + w][k] == key for k in xrange(z, z + l)):
+                w += 1
+            for i in xrange(x, x + w):
+                free[i][z:z + l] = [False] * l
+            rects.append((x, z, w, l))
+    return rects
+
+
+def mergeGridQuads(quads, cellX, cellZ, keys, shape):
+    """
+    Merge horizontal quads laid out on a grid into larger ones.
+
+    :param quads: Array of quads, (n, 4, elements). The first and third elements of each vertex are x and z, and each
+        quad covers one cell of the grid.
+    :param cellX, cellZ: The grid cell of each quad
+    :param keys: Integer key of each quad. Only quads with equal keys are merged.
+    :param shape: Shape of the grid
+    :return: An array of merged quads, each a copy of the quad in its first cell stretched over the rectangle
+    """
+    if not len(quads):
+        return quads
+    index = numpy.empty(shape, 'int32')
+    index.fill(-1)
+    index[cellX, cellZ] = numpy.arange(len(quads))
+    keyGrid = numpy.zeros(shape, keys.dtype)
+    keyGrid[cellX, cellZ] = keys
+
+    rects = numpy.array(greedyRectangles(keyGrid, index >= 0), 'int32').reshape(-1, 4)
+    merged = quads[index[rects[:, 0], rects[:, 1]]]
+    for axis, size in ((0, rects[:, 2]), (2, rects[:, 3])):
+        coords = merged[..., axis]
+        origin = coords.min(axis=1)[:, numpy.newaxis]
+        coords -= origin
+        coords *= size[:, numpy.newaxis]
+        coords += origin
+    return merged
+
+
+def exposedColumns(heights, depths):
+    """
+    Return a mask of the columns whose low detail side quads can be seen: those reaching below their own top block.
+    heights is the y of each column's top block and depths the lowest top block among its neighbours.
+    """
+    return depths < heights
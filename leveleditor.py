@@ -17,6 +17,10 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE."""
 # Moving this here to get log entries ASAP -- D.C.-G.
 import logging
 from pymclevel.schematic import StructureNBT
+from pymclevel.clipboard import ClipboardStore
+from pymclevel import level_analysis
+from pymclevel import autosave
+from pymclevel.instrumentation import instruments
 log = logging.getLogger(__name__)
 
 #-# Modified by D.C.-G. for translation purpose
@@ -52,6 +56,7 @@ import os
 import csv
 #import copy
 import time
+import weakref
 import numpy
 from config import config
 #from config import DEF_ENC
@@ -73,7 +78,7 @@ import shutil
 
 from os.path import dirname, isdir
 from datetime import datetime, timedelta
-from collections import defaultdict, deque
+from collections import deque
 
 from OpenGL import GL
 
@@ -156,6 +161,7 @@ class LevelEditor(GLViewport):
 
         self.debug = 0
         self.debugString = ""
+        self.timingString = ""
 
         self.testBoardKey = 0
         self.world_from_ftp = False
@@ -166,7 +172,9 @@ class LevelEditor(GLViewport):
         self.unsavedEdits = 0
         self.undoStack = []
         self.redoStack = []
-        self.copyStack = []
+        self.copyStack = ClipboardStore(self.clipboardMemoryLimit)
+        self.autosave = None
+        self._journalLevel = None  # weakref to the level whose change journal the renderer reads
 
         self.nbtCopyBuffer = mcedit.nbtCopyBuffer
 
@@ -515,26 +523,18 @@ class LevelEditor(GLViewport):
             config.settings.viewMode.set("Chunk")
 
     def addCopiedSchematic(self, sch):
-        self.copyStack.insert(0, sch)
+        self.copyStack.memoryLimit = self.clipboardMemoryLimit
+        self.copyStack.add(sch)
         if len(self.copyStack) > self.maxCopies:
             self.deleteCopiedSchematic(self.copyStack[-1])
         self.updateCopyPanel()
 
-    @staticmethod
-    def _deleteSchematic(sch):
-        if hasattr(sch, 'close'):
-            sch.close()
-        if sch.filename and os.path.exists(sch.filename):
-            os.remove(sch.filename)
-
-    def deleteCopiedSchematic(self, sch):
-        self._deleteSchematic(sch)
-        self.copyStack = [s for s in self.copyStack if s is not sch]
+    def deleteCopiedSchematic(self, entry):
+        self.copyStack.remove(entry)
         self.updateCopyPanel()
 
     def deleteAllCopiedSchematics(self):
-        for s in self.copyStack:
-            self._deleteSchematic(s)
+        self.copyStack.clear()
 
     copyPanel = None
 
@@ -564,13 +564,17 @@ class LevelEditor(GLViewport):
 
     maxCopies = property(__getMaxCopies, __setMaxCopies, __delMaxCopies, "Copy stack size.")
 
+    @property
+    def clipboardMemoryLimit(self):
+        return config.settings.clipboardMemoryLimit.get() << 20
+
     def createCopyPanel(self):
         panel = GLBackground()
         panel.bg_color = (0.0, 0.0, 0.0, 0.5)
         panel.pages = []
         if len(self.copyStack) > self.maxCopies:
-            for sch in self.copyStack[self.maxCopies:]:
-                self.deleteCopiedSchematic(sch)
+            for entry in self.copyStack[self.maxCopies:]:
+                self.deleteCopiedSchematic(entry)
 
         prevButton = Button("Previous Page")
 
@@ -585,21 +589,22 @@ class LevelEditor(GLViewport):
         fixedwidth = 0 + itemNo.width
         del itemNo
 
-        def createOneCopyPanel(sch, i):
+        def createOneCopyPanel(entry, i):
             p = GLBackground()
             p.bg_color = (0.0, 0.0, 0.0, 0.4)
             itemNo = Label("#%s%s" % ("  " * (len("%s" % self.maxCopies) - len("%s" % (i + 1))), (i + 1)),
                            doNotTranslate=True)
-            thumb = thumbCache.get(sch)
+            thumb = thumbCache.get(entry)
             if thumb is None:
-                thumb = ThumbView(sch)
-                thumb.mouse_down = lambda e: self.pasteSchematic(sch)
+                # The thumbnail lets go of the schematic once it is drawn, so the entry can be spilled to disk.
+                thumb = ThumbView(entry.peekSchematic(), releaseSchematic=True)
+                thumb.mouse_down = lambda e: self.pasteSchematic(entry.schematic)
                 thumb.tooltipText = "Click to import this item."
-                thumbCache[sch] = thumb
+                thumbCache[entry] = thumb
             self.addWorker(thumb.renderer)
-            deleteButton = Button("Delete", action=lambda: (self.deleteCopiedSchematic(sch)))
-            saveButton = Button("Save", action=lambda: (self.exportSchematic(sch)))
-            sizeLabel = Label("{0} x {1} x {2}".format(sch.Length, sch.Width, sch.Height))
+            deleteButton = Button("Delete", action=lambda: (self.deleteCopiedSchematic(entry)))
+            saveButton = Button("Save", action=lambda: (self.exportSchematic(entry.schematic)))
+            sizeLabel = Label("{0} x {1} x {2}".format(entry.Length, entry.Width, entry.Height))
 
             r = Row((itemNo, thumb, Column((sizeLabel, Row((deleteButton, saveButton))), spacing=5)))
             p.add(r)
@@ -609,8 +614,8 @@ class LevelEditor(GLViewport):
 
         page = []
         for i in xrange(len(self.copyStack)):
-            sch = self.copyStack[i]
-            p = createOneCopyPanel(sch, i)
+            entry = self.copyStack[i]
+            p = createOneCopyPanel(entry, i)
             if self.netherPanel is None:
                 bottom = pygame.display.get_surface().get_height() - 60
             else:
@@ -697,43 +702,19 @@ class LevelEditor(GLViewport):
         self.analyzeBox(schematic, schematic.bounds)
 
     def analyzeBox(self, level, box):
-        entityCounts = defaultdict(int)
-        tileEntityCounts = defaultdict(int)
-        types = numpy.zeros(65536, dtype='uint32')
-
-        def _analyzeBox():
-            i = 0
-            for (chunk, slices, point) in level.getChunkSlices(box):
-                i += 1
-                yield i, box.chunkCount
-                blocks = numpy.array(chunk.Blocks[slices], dtype='uint16')
-                blocks |= (numpy.array(chunk.Data[slices], dtype='uint16') << 12)
-                b = numpy.bincount(blocks.ravel())
-                types[:b.shape[0]] = types[:b.shape[0]].astype(int) + b
-
-                for ent in chunk.getEntitiesInBox(box):
-                    entID = level.__class__.entityClass.getId(ent["id"].value)
-                    if ent["id"].value == "Item":
-                        try:
-                            v = pymclevel.items.items.findItem(ent["Item"]["id"].value,
-                                                               ent["Item"]["Damage"].value).name
-                            v += " (Item)"
-                        except pymclevel.items.ItemNotFound:
-                            v = "Unknown Item"
-                    else:
-                        v = ent["id"].value
-                    entityCounts[(entID, v)] += 1
-                for ent in chunk.getTileEntitiesInBox(box):
-                    tileEntityCounts[ent["id"].value] += 1
-
         with mceutils.setWindowCaption("ANALYZING - "):
-            showProgress(_("Analyzing {0} blocks...").format(box.volume), _analyzeBox(), cancel=True)
+            result = showProgress(_("Analyzing {0} blocks...").format(box.volume),
+                                  level_analysis.analyzerFor(level).analyzeIter(box), cancel=True)
+        if not isinstance(result, level_analysis.AnalysisResult):
+            return
 
+        entityCounts = result.entityCounts
+        tileEntityCounts = result.tileEntityCounts
         entitySum = numpy.sum(entityCounts.values())
         tileEntitySum = numpy.sum(tileEntityCounts.values())
-        presentTypes = types.nonzero()
 
-        blockCounts = sorted([(level.materials[t & 0xfff, t >> 12], types[t]) for t in presentTypes[0]])
+        blockCounts = sorted([(level.materials[blockID, blockData], count)
+                              for blockID, blockData, count in result.presentBlocks()])
 
         rows = blockRows = [("", "", ""), (box.volume, "<%s>" % _("Blocks"), "")]
         #rows = list(blockRows)
@@ -865,7 +846,7 @@ class LevelEditor(GLViewport):
     def getLastCopiedSchematic(self):
         if len(self.copyStack) == 0:
             return None
-        return self.copyStack[0]
+        return self.copyStack[0].schematic
 
     toolbar = None
 
@@ -1094,7 +1075,8 @@ class LevelEditor(GLViewport):
 
     is_gl_container = True
 
-    maxDebug = 1
+    maxDebug = 2  # 1 shows the debug panel, 2 adds the stage timings
+    timingLines = 16
     allBlend = False
     onscreen = True
     mouseEntered = True
@@ -1199,6 +1181,7 @@ class LevelEditor(GLViewport):
         self.freezeStatus(_("Loading ") + filename)
         if self.level:
             self.selectionTool.endSelection()
+            self.stopAutosave()
             self.level.close()
 
         try:
@@ -1213,6 +1196,7 @@ class LevelEditor(GLViewport):
 
         assert level
         log.debug("Loaded world is %s" % repr(level))
+        recovered = self.startAutosave(level)
 
         if hasattr(level, 'materials'):
             level.materials.addJSONBlocksFromVersion(level.gameVersion)
@@ -1260,10 +1244,38 @@ class LevelEditor(GLViewport):
             buildResources(gameVersion, getLang())
 
         self.loadLevel(level)
+        if recovered:
+            self.addUnsavedEdit()
 
         self.renderer.position = self.currentViewport.cameraPosition
         self.renderer.loadNearbyChunks()
 
+    def startAutosave(self, level):
+        """
+        Start snapshotting the unsaved edits of a newly opened world, first offering to recover the ones left by a
+        session that did not close properly. Returns True if edits were recovered.
+        """
+        if not isinstance(level, pymclevel.MCInfdevOldLevel) or isinstance(level, pymclevel.ZipSchematic) \
+                or level.readonly:
+            return False
+
+        recovered = False
+        if autosave.hasUnsavedChunks(level):
+            answer = ask("This world has edits that were not saved when MCEdit last closed it. Recover them?",
+                         ["Recover", "Discard"], default=0, cancel=1)
+            if answer == "Recover":
+                recovered = autosave.recoverUnsavedChunks(level) > 0
+            else:
+                autosave.discardUnsavedChunks(level)
+
+        self.autosave = autosave.AutosaveService(level, config.settings.autosaveInterval.get())
+        return recovered
+
+    def stopAutosave(self):
+        if self.autosave is not None:
+            self.autosave.stop()
+            self.autosave = None
+
     def loadLevel(self, level, saveChanges=False):
         """
         Called to load a level, world, or dimension into the editor and display it in the viewport.
@@ -1435,33 +1447,15 @@ class LevelEditor(GLViewport):
                         alert(_(e.message) + _("\n\nYour changes cannot be saved."))
                         return
 
+                # Relit chunks are marked dirty; invalidateJournaledChunks redraws them on the next frame.
                 if hasattr(level, 'dimensions'):
                     for level in itertools.chain(level.dimensions.itervalues(), [level]):
-
                         if "Canceled" == showProgress("Lighting chunks", level.generateLightsIter(), cancel=True):
                             return
-
-                        if self.level == level:
-                            if isinstance(level, pymclevel.MCInfdevOldLevel):
-                                needsRefresh = [c.chunkPosition for c in level._loadedChunkData.itervalues() if c.dirty]
-                                needsRefresh.extend(level.unsavedWorkFolder.listChunks())
-                            else:
-                                needsRefresh = [c for c in level.allChunks if level.getChunk(*c).dirty]
-                            #xxx change MCInfdevOldLevel to monitor changes since last call
-                            self.invalidateChunks(needsRefresh)
                 else:
                     if "Canceled" == showProgress("Lighting chunks", level.generateLightsIter(), cancel=True):
                         return
 
-                    if self.level == level:
-                        if isinstance(level, pymclevel.MCInfdevOldLevel):
-                            needsRefresh = [c.chunkPosition for c in level._loadedChunkData.itervalues() if c.dirty]
-                            needsRefresh.extend(level.unsavedWorkFolder.listChunks())
-                        else:
-                            needsRefresh = [c for c in level.allChunks if level.getChunk(*c).dirty]
-                        #xxx change MCInfdevOldLevel to monitor changes since last call
-                        self.invalidateChunks(needsRefresh)
-
             self.freezeStatus("Saving...")
             chunks = self.level.chunkCount
             count = [0]
@@ -1477,6 +1471,8 @@ class LevelEditor(GLViewport):
         self.recordUndo = True
         self.clearUnsavedEdits(True)
         self.toolbar.tools[6].nonSavedPlayers = []
+        if self.autosave is not None:
+            self.autosave.saved()
 
     @mceutils.alertException
     def saveAs(self):
@@ -1486,6 +1482,7 @@ class LevelEditor(GLViewport):
         if filename is None:
             return
         shutil.copytree(self.level.worldFolder.filename, filename)
+        shutil.rmtree(os.path.join(filename, autosave.RECOVERY_FOLDER), True)
         self.level.worldFolder = AnvilWorldFolder(filename)
         self.level.filename = os.path.join(self.level.worldFolder.filename, "level.dat")
         if hasattr(self.level, "acquireSessionLock"):
@@ -1591,6 +1588,12 @@ class LevelEditor(GLViewport):
         if self.renderer.needsImmediateRedraw:
             self.invalidate()
 
+        self.invalidateJournaledChunks()
+
+        if self.autosave is not None:
+            self.autosave.interval = config.settings.autosaveInterval.get()
+            self.autosave.tick()
+
         if not self.root.bonus_draw_time:
             frameDuration = self.getFrameDuration()
 
@@ -1630,16 +1633,21 @@ class LevelEditor(GLViewport):
         if self.debug > self.maxDebug:
             self.debug = 0
 
+        if self.debug != 1:
+            self.hideDebugPanel()
         if self.debug:
             self.showDebugPanel()
-        else:
-            self.hideDebugPanel()
 
     def showDebugPanel(self):
         dp = GLBackground()
         debugLabel = ValueDisplay(width=1100, ref=AttrRef(self, "debugString"))
         inspectLabel = ValueDisplay(width=1100, ref=AttrRef(self, "inspectionString"))
-        dp.add(Column((debugLabel, inspectLabel)))
+        labels = [debugLabel, inspectLabel]
+        if self.debug > 1:
+            timingLabel = ValueDisplay(width=1100, ref=AttrRef(self, "timingString"))
+            timingLabel.set_size_for_text(1100, self.timingLines)
+            labels.append(timingLabel)
+        dp.add(Column(labels))
         dp.shrink_wrap()
         dp.bg_color = (0, 0, 0, 0.6)
         self.add(dp)
@@ -2081,6 +2089,7 @@ class LevelEditor(GLViewport):
         self.selectionTool.endSelection()
         self.mainViewport.mouseLookOff()
         if self.level:
+            self.stopAutosave()
             self.level.close()
             self.level = None
         self.renderer.stopWork()
@@ -2125,7 +2134,7 @@ class LevelEditor(GLViewport):
                 except ftp_client.InvalidCreditdentialsException as e:
                     alert(e.message)
                     return
-            self._ftp_client.safe_download()
+            showProgress("Downloading world...", self._ftp_client.download_iter())
             self.mcedit.loadFile(os.path.join(self._ftp_client.get_level_path(), 'level.dat'), addToRecent=False)
             self.world_from_ftp = True
 
@@ -2139,7 +2148,15 @@ class LevelEditor(GLViewport):
                     self.saveFile()
                 if answer == "Cancel":
                     return
-            self._ftp_client.upload()
+            conflicts = self._ftp_client.upload_conflicts()
+            if conflicts:
+                answer = ask(_("{0} of the files to upload were changed on the server since the world was downloaded, "
+                               "e.g. by the running server. Uploading replaces them.").format(len(conflicts)),
+                             ["Cancel", "Overwrite"], default=0, cancel=0)
+                self.root.fix_sticky_ctrl()
+                if answer != "Overwrite":
+                    return
+            showProgress("Uploading changes...", self._ftp_client.upload_iter(overwrite=bool(conflicts)))
             self.clearUnsavedEdits()
             self.unsavedEdits = 0
             self.root.RemoveEditFiles()
@@ -2147,6 +2164,7 @@ class LevelEditor(GLViewport):
             self.selectionTool.endSelection()
             self.mainViewport.mouseLookOff()
             if self.level:
+                self.stopAutosave()
                 self.level.close()
                 self.level = None
             self.renderer.stopWork()
@@ -2840,6 +2858,20 @@ class LevelEditor(GLViewport):
     def invalidateChunks(self, c):
         self.renderer.invalidateChunks(c)
 
+    def invalidateJournaledChunks(self):
+        """
+        Redraw the chunks the level's change journal lists since the last frame, such as chunks relit on saving or
+        written by a chunk transplant. The renderer is the journal reader, so the level prunes what it has read.
+        """
+        journalLevel = self._journalLevel and self._journalLevel()
+        if journalLevel is not self.level:
+            if journalLevel is not None:
+                journalLevel.removeJournalReader(self.renderer)
+            self._journalLevel = weakref.ref(self.level) if self.level is not None else None
+        if self.level is None:
+            return
+        self.renderer.invalidateChangedChunks(self.level.readChanges(self.renderer))
+
     def invalidateAllChunks(self):
         self.renderer.invalidateAllChunks()
 
@@ -2920,6 +2952,9 @@ class LevelEditor(GLViewport):
             if self.renderer:
                 self.renderer.addDebugInfo(self.addDebugString)
 
+        if self.debug > 1:
+            self.timingString = "\n".join(instruments.summary()[:self.timingLines])
+
     def doWorkUnit(self, onMenu=False):
         if len(self.workers):
             try:
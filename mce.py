@@ -5,11 +5,12 @@ import pymclevel.mclevelbase
 import pymclevel.mclevel
 import pymclevel.materials
 import pymclevel.infiniteworld
+from pymclevel import level_analysis
+from pymclevel.instrumentation import instruments
 import sys
 import os
 from pymclevel.box import BoundingBox, Vector
 import numpy
-from numpy import zeros, bincount
 import logging
 import itertools
 import traceback
@@ -90,6 +91,7 @@ class mce(object):
     Informational:
        {commandPrefix}blocks [ <block name> | <block ID> ]
        {commandPrefix}help [ <command> ]
+       {commandPrefix}timings [ reset | trace | save <filename> ]
 
     **IMPORTANT**
        {commandPrefix}box
@@ -152,6 +154,7 @@ class mce(object):
 
         "debug",
         "log",
+        "timings",
         "box",
     ]
     debug = False
@@ -349,6 +352,32 @@ class mce(object):
         else:
             print "Log level: {0}".format(logging.getLogger().level)
 
+    @staticmethod
+    def _timings(command):
+        """
+    timings [ reset | trace | save <filename> ]
+
+    Print how long each stage of loading, lighting and saving chunks took.
+    Type 'timings reset' to clear them, 'timings trace' to start recording a trace
+    and 'timings save <filename>' to write it as a Chrome trace JSON file, which
+    chrome://tracing and Perfetto can open.
+    """
+        if not len(command):
+            for line in instruments.summary() or ["No timings recorded."]:
+                print line
+        elif command[0] == "reset":
+            instruments.reset()
+        elif command[0] == "trace":
+            instruments.startTrace()
+            print "Recording a trace."
+        elif command[0] == "save" and len(command) == 2:
+            if not instruments.tracing:
+                raise UsageError("No trace is being recorded. Start one with 'timings trace'.")
+            count = instruments.saveTrace(command[1])
+            print "Wrote {0} events to {1}".format(count, command[1])
+        else:
+            raise UsageError
+
     def _clone(self, command):
         """
     clone <sourceBox> <destPoint> [noair] [nowater]
@@ -456,22 +485,12 @@ class mce(object):
 
         Counts all of the block types in every chunk of the world.
         """
-        blockCounts = zeros((65536,), 'uint64')
-
         print "Analyzing {0} chunks...".format(self.level.chunkCount)
-        # for input to bincount, create an array of uint16s by
-        # shifting the data left and adding the blocks
-
-        for i, cPos in enumerate(self.level.allChunks, 1):
-            ch = self.level.getChunk(*cPos)
-            btypes = numpy.array(ch.Data.ravel(), dtype='uint16')
-            btypes <<= 12
-            btypes += ch.Blocks.ravel()
-            counts = bincount(btypes)
-
-            blockCounts[:counts.shape[0]] += counts
-            if i % 100 == 0:
-                logging.info("Chunk {0}...".format(i))
+        result = None
+        for result in level_analysis.analyzerFor(self.level).analyzeIter():
+            if isinstance(result, tuple) and result[0] % 100 == 0:
+                logging.info("Chunk {0}...".format(result[0]))
+        blockCounts = result.blockCounts
 
         for blockID in range(materials.id_limit):
             for data in range(16):
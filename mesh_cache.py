@@ -0,0 +1,302 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of the high detail chunk geometry built by ChunkCalculator, so a world that was viewed before fills
+the view without meshing every chunk again.
+
+Each chunk is kept in its own file in <cache dir>/mesh-cache/<world hash>/. A file starts with MAGIC, the length of
+a JSON header and the header itself. The header holds the chunk's key and, for each block renderer, its class name,
+section y and the offset, dtype ("packed" for vertex_format.packedVertex) and shape of its vertex arrays. The arrays
+follow, each aligned to 16 bytes, and are mapped copy-on-write with numpy.memmap when the chunk is loaded, so they
+are only read from disk as they are drawn.
+
+A chunk's geometry depends on its own blocks and lights and on the border blocks of its four neighbours. The key
+holds the region timestamp and sector offset of all five chunks, which change every time one of them is written,
+together with the resource pack's atlas cache key (see resource_packs.IResourcePack.cache_key) and the renderer
+settings that change the geometry. Chunks with unsaved edits have no key and are neither loaded nor stored. An entry
+whose key does not match is replaced the next time the chunk is meshed.
+
+Entries are written by a background thread, so storing a chunk costs the meshing loop only building its header.
+When the thread falls more than MAX_PENDING_WRITES entries behind, further entries are not stored.
+
+Set the MCEDIT_MESH_CACHE environment variable to use another folder, or to an empty string to disable the cache.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import Queue
+import struct
+import threading
+
+import numpy
+
+import directories
+import pymclevel
+from pymclevel.schematic import ZipSchematic
+from resource_packs import ResourcePackHandler
+import vertex_format
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+MAGIC = "MCEMESH\x01"
+ALIGNMENT = 16
+MAX_WORLDS = 32  # world folders kept in the cache, least recently opened ones are removed
+MAX_PENDING_WRITES = 64
+
+_cacheDir = None
+
+
+def cacheDir():
+    global _cacheDir
+    if _cacheDir is None:
+        _cacheDir = os.environ.get("MCEDIT_MESH_CACHE")
+        if _cacheDir is None:
+            _cacheDir = os.path.join(directories.getCacheDir(), "mesh-cache")
+        if _cacheDir and not os.path.exists(_cacheDir):
+            try:
+                os.makedirs(_cacheDir)
+            except OSError as e:
+                log.warning(u"Cannot create mesh cache folder {0}: {1!r}".format(_cacheDir, e))
+                _cacheDir = ""
+    return _cacheDir
+
+
+def pruneWorlds(folder, keep=MAX_WORLDS):
+    """ Remove all but the keep most recently used world folders in folder. """
+    try:
+        worlds = [os.path.join(folder, name) for name in os.listdir(folder)]
+        worlds = sorted((w for w in worlds if os.path.isdir(w)), key=os.path.getmtime, reverse=True)
+    except OSError:
+        return
+    for path in worlds[keep:]:
+        log.debug(u"Removing mesh cache folder {0}".format(path))
+        for name in os.listdir(path):
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+
+def _aligned(n):
+    return (n + ALIGNMENT - 1) & ~(ALIGNMENT - 1)
+
+
+def resourcePackKey():
+    """ The atlas cache key of the selected resource pack, or its name if it is not known. """
+    handler = ResourcePackHandler.Instance()
+    name = handler.get_selected_resource_pack_name()
+    pack = handler.resource_packs.get(name)
+    if pack is None:
+        return name
+    try:
+        return pack.cache_key
+    except EnvironmentError as e:
+        log.debug(u"Cannot find the atlas cache key of {0}: {1!r}".format(name, e))
+        return name
+
+
+_writeQueue = Queue.Queue(MAX_PENDING_WRITES)
+_writer = None
+_writerLock = threading.Lock()
+
+
+def _queueWrite(entry):
+    global _writer
+    with _writerLock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writeEntries, name="MeshCacheWriter")
+            _writer.daemon = True
+            _writer.start()
+    try:
+        _writeQueue.put_nowait(entry)
+    except Queue.Full:
+        log.debug(u"Mesh cache writes are behind, not storing {0}".format(entry[0]))
+
+
+def _writeEntries():
+    while True:
+        entry = _writeQueue.get()
+        try:
+            _writeEntry(*entry)
+        finally:
+            _writeQueue.task_done()
+
+
+def flushWrites():
+    """ Wait until the entries queued so far are written. """
+    if _writer is not None:
+        _writeQueue.join()
+
+
+atexit.register(flushWrites)
+
+
+def _writeEntry(path, header, arrays):
+    headerEnd = len(MAGIC) + 4 + len(header)
+    dataOffset = _aligned(headerEnd)
+    tempPath = path + ".tmp"
+    try:
+        with open(tempPath, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack(">I", len(header)))
+            f.write(header)
+            f.write("\0" * (dataOffset - headerEnd))
+            for arrayOffset, a in arrays:
+                f.seek(dataOffset + arrayOffset)
+                f.write(a.tostring())
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tempPath, path)
+    except EnvironmentError as e:
+        # On Windows, an entry that is still mapped by a chunk renderer cannot be replaced.
+        log.debug(u"Cannot write mesh cache entry {0}: {1!r}".format(path, e))
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+
+
+class MeshCache(object):
+    """
+    The cached geometry of one level's chunks. Only MCInfdevOldLevel worlds and dimensions are cached; for other
+    levels, and when the cache folder is not available, load returns None and save does nothing.
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self.path = None
+        if not isinstance(level, pymclevel.infiniteworld.MCInfdevOldLevel) or isinstance(level, ZipSchematic):
+            return
+        folder = cacheDir()
+        if not folder:
+            return
+
+        worldPath = os.path.abspath(level.worldFolder.filename)
+        if isinstance(worldPath, unicode):
+            worldPath = worldPath.encode("utf-8")
+        self.path = os.path.join(folder, hashlib.sha1(worldPath).hexdigest())
+        try:
+            if os.path.exists(self.path):
+                os.utime(self.path, None)
+            else:
+                os.makedirs(self.path)
+                pruneWorlds(folder)
+        except OSError as e:
+            log.warning(u"Cannot use mesh cache folder {0}: {1!r}".format(self.path, e))
+            self.path = None
+
+    def chunkStamp(self, cx, cz):
+        """ (timestamp, offset) of the chunk in the world's region file, or None if it has unsaved edits. """
+        level = self.level
+        chunkData = level._loadedChunkData.get((cx, cz))
+        if chunkData is not None and chunkData.dirty:
+            return None
+        if level.unsavedWorkFolder.containsChunk(cx, cz):
+            return None
+        if not level.worldFolder.containsChunk(cx, cz):
+            return 0, 0
+        regionFile = level.worldFolder.getRegionForChunk(cx, cz)
+        return int(regionFile.getTimestamp(cx, cz)), int(regionFile.getOffset(cx, cz))
+
+    def chunkKey(self, cr, calculator):
+        """ The key of the chunk renderer cr's geometry as a string, or None if it cannot be cached. """
+        cx, cz = cr.chunkPosition
+        stamps = []
+        for dx, dz in ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)):
+            stamp = self.chunkStamp(cx + dx, cz + dz)
+            if stamp is None:
+                return None
+            stamps.append(stamp)
+
+        level = self.level
+        return json.dumps([CACHE_VERSION, cx, cz, stamps, resourcePackKey(), level.materials.name,
+                           level.Height, bool(calculator.fastLeaves), bool(calculator.roughGraphics),
+                           bool(cr.renderer.showHiddenOres)])
+
+    def chunkPath(self, cx, cz):
+        return os.path.join(self.path, "c.%d.%d.mesh" % (cx, cz))
+
+    def load(self, cr, calculator):
+        """
+        Return the cached high detail block renderers of the chunk renderer cr, or None if they are not cached or
+        the chunk changed since they were stored.
+        """
+        if self.path is None:
+            return None
+        path = self.chunkPath(*cr.chunkPosition)
+        if not os.path.exists(path):
+            return None
+        key = self.chunkKey(cr, calculator)
+        if key is None:
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError("Not a mesh cache file")
+                headerLength, = struct.unpack(">I", f.read(4))
+                header = json.loads(f.read(headerLength))
+            if header["key"] != key:
+                return None
+
+            dataOffset = _aligned(len(MAGIC) + 4 + headerLength)
+            data = None
+            if os.path.getsize(path) > dataOffset:
+                data = numpy.memmap(path, dtype='uint8', mode='c', offset=dataOffset)
+
+            classes = dict((cls.__name__, cls) for cls in calculator.blockRendererClasses)
+            blockRenderers = []
+            for className, y, arrays in header["renderers"]:
+                blockRenderer = classes[className](calculator)
+                blockRenderer.y = y
+                blockRenderer.materials = self.level.materials
+                vertexArrays = []
+                for offset, dtype, shape in arrays:
+                    dtype = vertex_format.packedVertex if dtype == "packed" else numpy.dtype(str(dtype))
+                    size = int(numpy.prod(shape)) * dtype.itemsize
+                    vertexArrays.append(data[offset:offset + size].view(dtype).reshape(shape))
+                blockRenderer.vertexArrays = vertexArrays
+                blockRenderers.append(blockRenderer)
+            return blockRenderers
+
+        except Exception as e:
+            log.debug(u"Discarding mesh cache entry {0}: {1!r}".format(path, e))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def save(self, cr, calculator, blockRenderers):
+        """ Queue the high detail block renderers computed for the chunk renderer cr to be stored. The vertex
+        arrays are written as they are when the writer gets to them; block renderers do not change them once built.
+        """
+        if self.path is None:
+            return
+        key = self.chunkKey(cr, calculator)
+        if key is None:
+            return
+
+        renderers = []
+        arrays = []
+        offset = 0
+        for blockRenderer in blockRenderers:
+            entries = []
+            for a in blockRenderer.vertexArrays:
+                a = numpy.ascontiguousarray(a)
+                entries.append([offset, "packed" if vertex_format.isPacked(a) else a.dtype.str, list(a.shape)])
+                arrays.append((offset, a))
+                offset = _aligned(offset + a.nbytes)
+            renderers.append([type(blockRenderer).__name__, blockRenderer.y, entries])
+
+        header = json.dumps({"key": key, "renderers": renderers})
+        _queueWrite((self.chunkPath(*cr.chunkPosition), header, arrays))
@@ -23,6 +23,8 @@ class GraphicsPanel(Dialog):
             config.settings.vertexBufferLimit: config.settings.vertexBufferLimit.get(),
             config.settings.fastLeaves: config.settings.fastLeaves.get(),
             config.settings.roughGraphics: config.settings.roughGraphics.get(),
+            config.settings.greedyMeshing: config.settings.greedyMeshing.get(),
+            config.settings.drawFarTerrain: config.settings.drawFarTerrain.get(),
             config.settings.enableMouseLag: config.settings.enableMouseLag.get(),
             config.settings.maxViewDistance: config.settings.maxViewDistance.get()
         }
@@ -46,6 +48,15 @@ class GraphicsPanel(Dialog):
                                                 ref=config.settings.roughGraphics,
                                                 tooltipText="All blocks are drawn the same way (overrides 'Fast Leaves')")
 
+        greedyMeshingRow = albow.CheckBoxLabel("Merge Distant Terrain",
+                                                ref=config.settings.greedyMeshing,
+                                                tooltipText="Draw low detail terrain with fewer, larger faces")
+
+        drawFarTerrainRow = albow.CheckBoxLabel("Draw Far Terrain",
+                                                ref=config.settings.drawFarTerrain,
+                                                tooltipText="Draw the terrain past the view distance from a map of "
+                                                            "the world, kept in the world's folder")
+
         enableMouseLagRow = albow.CheckBoxLabel("Enable Mouse Lag",
                                                 ref=config.settings.enableMouseLag,
                                                 tooltipText="Enable choppy mouse movement for faster loading.")
@@ -69,6 +80,8 @@ class GraphicsPanel(Dialog):
 
         settingsColumn = albow.Column((fastLeavesRow,
                                        roughGraphicsRow,
+                                       greedyMeshingRow,
+                                       drawFarTerrainRow,
                                        enableMouseLagRow,
                                        #                                  texturePackRow,
                                        self.fieldOfViewRow,
@@ -39,6 +39,8 @@ class OptionsPanel(Dialog):
             config.controls.mouseSpeed:                       config.controls.mouseSpeed.get(),
             config.settings.undoLimit:                        config.settings.undoLimit.get(),
             config.settings.maxCopies:                        config.settings.maxCopies.get(),
+            config.settings.clipboardMemoryLimit:             config.settings.clipboardMemoryLimit.get(),
+            config.settings.autosaveInterval:                 config.settings.autosaveInterval.get(),
             config.controls.invertMousePitch:                 config.controls.invertMousePitch.get(),
             config.settings.spaceHeight:                      config.settings.spaceHeight.get(),
             albow.AttrRef(self, 'blockBuffer'):               albow.AttrRef(self, 'blockBuffer').get(),
@@ -96,6 +98,14 @@ class OptionsPanel(Dialog):
                                             ref=config.settings.maxCopies, width=100, min=0,
                                             tooltipText="Maximum number of copied objects.")
 
+        clipboardMemoryRow = albow.IntInputRow("Copy Stack Memory (MB): ",
+                                            ref=config.settings.clipboardMemoryLimit, width=100, min=0,
+                                            tooltipText="Copied objects beyond this much memory are kept on disk until used.")
+
+        autosaveIntervalRow = albow.IntInputRow("Recovery Snapshot Interval (s): ",
+                                            ref=config.settings.autosaveInterval, width=100, min=0,
+                                            tooltipText="Seconds between copies of unsaved edits kept for crash recovery. 0 turns this off.")
+
         compassSizeRow = albow.IntInputRow("Compass Size (%): ",
                                             ref=config.settings.compassSize, width=100, min=0, max=100)
 
@@ -188,6 +198,8 @@ class OptionsPanel(Dialog):
             mouseSpeedRow,
             undoLimitRow,
             maxCopiesRow,
+            clipboardMemoryRow,
+            autosaveIntervalRow,
             compassSizeRow,
             fontProportion,
             fogIntensityRow,
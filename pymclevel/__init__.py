@@ -14,7 +14,7 @@ from indev import MCIndevLevel
 from infiniteworld import ChunkedLevelMixin, AnvilChunk, MCAlphaDimension, MCInfdevOldLevel, ZeroChunk
 import items
 from javalevel import MCJavaLevel
-from level import ChunkBase, computeChunkHeightMap, EntityLevel, FakeChunk, LightedChunk, MCLevel
+from level import ChunkBase, ChunkSnapshot, computeChunkHeightMap, EntityLevel, FakeChunk, LightedChunk, MCLevel
 from materials import alphaMaterials, classicMaterials, indevMaterials, MCMaterials, namedMaterials, pocketMaterials
 from mclevelbase import ChunkNotPresent, PlayerNotFound
 from leveldbpocket import PocketLeveldbWorld
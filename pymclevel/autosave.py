@@ -0,0 +1,283 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Background snapshots of a world's unsaved edits, and their recovery after a crash.
+
+Edits are only written into the world when it is saved. Until then, changed chunks are held in memory or in the
+##MCEDIT.TEMP## work folder, which is deleted the next time the world is opened. AutosaveService copies the chunks
+changed since its last pass into a RecoveryStore in each level's ##MCEDIT.RECOVERY## folder. The region files there
+are written with durable header commits (see MCRegionFile), so a crash leaves every stored chunk readable.
+
+The service is driven by tick(), called from the thread that edits the world. A pass starts every interval seconds
+and lists the chunks changed since the previous one from the level's change journal. Each tick then takes
+copy-on-write snapshots of a few of those chunks, stopping once frameBudget seconds are spent, and queues them for
+a background thread that serializes them with savedTagData, compresses them and writes them to the store. Chunks
+that were moved to the work folder are queued as their stored compressed bytes.
+
+When the world is saved or closed on purpose, the stores are cleared. A store that still holds chunks when the world
+is opened again means the last session ended without either; recoverUnsavedChunks moves those chunks into the work
+folder, where they are loaded as unsaved edits.
+"""
+
+import collections
+import itertools
+import logging
+import os
+import Queue
+import shutil
+import threading
+import time
+
+from infiniteworld import AnvilWorldFolder
+from mclevelbase import ChunkNotPresent
+from regionfile import MCRegionFile, deflate
+
+log = logging.getLogger(__name__)
+
+RECOVERY_FOLDER = "##MCEDIT.RECOVERY##"
+
+
+def _regionPos(cPos):
+    cx, cz = cPos
+    return cx >> 5, cz >> 5
+
+
+def _payloadRegion(payload):
+    return _regionPos(payload[:2])
+
+
+def worldLevels(world):
+    """ The world followed by the dimensions loaded from it so far. """
+    return itertools.chain([world], world.dimensions.itervalues())
+
+
+class RecoveryStore(object):
+    """ The chunks of one level saved by the autosave service, kept in <level folder>/##MCEDIT.RECOVERY##. """
+
+    def __init__(self, level):
+        self.path = os.path.join(level.worldFolder.filename, RECOVERY_FOLDER)
+        self._folder = None
+        self._lock = threading.Lock()
+
+    @property
+    def folder(self):
+        """ The store's world folder, created on first use. """
+        if self._folder is None:
+            self._folder = AnvilWorldFolder(self.path)
+        return self._folder
+
+    def chunkPositions(self):
+        if not os.path.isdir(self.path):
+            return set()
+        with self._lock:
+            return self.folder.listChunks()
+
+    def writeChunks(self, payloads):
+        """ Store compressed chunks. payloads is a list of (cx, cz, data, format) tuples. """
+        with self._lock:
+            for rPos, group in itertools.groupby(sorted(payloads, key=_payloadRegion), _payloadRegion):
+                self.folder.getRegionFile(*rPos).saveChunks(list(group))
+
+    def recoverInto(self, level):
+        """
+        Copy the stored chunks into level's unsaved work folder, so they are loaded as unsaved edits. The store keeps
+        them until it is cleared.
+
+        :return: The number of chunks recovered
+        """
+        positions = self.chunkPositions()
+        with self._lock:
+            for rPos, group in itertools.groupby(sorted(positions, key=_regionPos), _regionPos):
+                source = self.folder.getRegionFile(*rPos)
+                payloads = []
+                for cx, cz in group:
+                    try:
+                        data, format = source._readChunk(cx, cz)
+                    except ChunkNotPresent:
+                        continue
+                    payloads.append((cx, cz, data, format))
+                    if (cx, cz) not in level._loadedChunks:
+                        level._loadedChunkData.pop((cx, cz), None)
+                level.unsavedWorkFolder.getRegionFile(*rPos).saveChunks(payloads)
+
+        if level._allChunks is not None:
+            level._allChunks.update(positions)
+        for cPos in positions:
+            level.markChunkChanged(cPos)
+        log.info(u"Recovered {0} unsaved chunks in {1}".format(len(positions), self.path))
+        return len(positions)
+
+    def clear(self):
+        with self._lock:
+            if self._folder is not None:
+                self._folder.closeRegions()
+                self._folder = None
+            shutil.rmtree(self.path, True)
+
+
+def hasUnsavedChunks(world):
+    """ Return True if an earlier session left autosaved chunks for world or its dimensions. """
+    if world.readonly:
+        return False
+    return any(RecoveryStore(level).chunkPositions() for level in worldLevels(world))
+
+
+def recoverUnsavedChunks(world):
+    """ Move the autosaved chunks of world and its dimensions into their work folders. Returns the chunk count. """
+    return sum(RecoveryStore(level).recoverInto(level) for level in worldLevels(world))
+
+
+def discardUnsavedChunks(world):
+    for level in worldLevels(world):
+        RecoveryStore(level).clear()
+
+
+class AutosaveService(object):
+    """
+    Keeps the RecoveryStores of an MCInfdevOldLevel and its dimensions up to date with the chunks edited in them.
+
+    :param interval: Seconds between the start of two passes. 0 disables the service.
+    :param frameBudget: Seconds each tick may spend taking snapshots.
+    """
+
+    def __init__(self, world, interval=120, frameBudget=0.002):
+        self.world = world
+        self.interval = interval
+        self.frameBudget = frameBudget
+        self.lastPass = time.time()
+        self.stores = {}
+        self._generations = {}  # dimNo -> changeGeneration covered by the store, also our place in its journal
+        self._passGenerations = None
+        self._pending = collections.deque()  # (level, cPos) still to snapshot in the current pass
+        self._queue = Queue.Queue()
+        self._thread = None
+        self.reset()
+
+    def store(self, level):
+        store = self.stores.get(level.dimNo)
+        if store is None:
+            store = self.stores[level.dimNo] = RecoveryStore(level)
+        return store
+
+    def reset(self):
+        """ Forget the current pass and treat every change made so far as stored, e.g. after saving. """
+        self._pending.clear()
+        self._passGenerations = None
+        for level in worldLevels(self.world):
+            self._cover(level, level.changeGeneration)
+        self.lastPass = time.time()
+
+    def _cover(self, level, generation):
+        self._generations[level.dimNo] = generation
+        level.advanceJournalReader(self, generation)
+
+    def tick(self):
+        if not self.interval or self.world.readonly:
+            return
+        if not self._pending:
+            if self._passGenerations is not None:
+                # Every chunk of the last pass is queued; changes made after its start are picked up by the next one.
+                for level in worldLevels(self.world):
+                    if level.dimNo in self._passGenerations:
+                        self._cover(level, self._passGenerations[level.dimNo])
+                self._passGenerations = None
+            if time.time() - self.lastPass < self.interval:
+                return
+            self._startPass()
+
+        deadline = time.time() + self.frameBudget
+        jobs = []
+        while self._pending and time.time() < deadline:
+            job = self._snapshotJob(*self._pending.popleft())
+            if job is not None:
+                jobs.append(job)
+        if jobs:
+            self._submit(jobs)
+
+    def _startPass(self):
+        self.lastPass = time.time()
+        self._passGenerations = {}
+        for level in worldLevels(self.world):
+            if level.dimNo not in self._generations:
+                # A dimension loaded since the last pass; its journal is kept from here on.
+                self._cover(level, 0)
+            self._passGenerations[level.dimNo] = level.changeGeneration
+            changed = level.chunksChangedSince(self._generations.get(level.dimNo, 0))
+            self._pending.extend((level, cPos) for cPos in changed)
+        if self._pending:
+            log.debug(u"Autosave pass started with {0} changed chunks".format(len(self._pending)))
+
+    def _snapshotJob(self, level, cPos):
+        self.store(level)
+        chunkData = level._loadedChunkData.get(cPos)
+        if chunkData is not None:
+            if not chunkData.dirty:
+                return None
+            return level, cPos, chunkData.snapshot(), None
+
+        workFolder = level.unsavedWorkFolder
+        if not workFolder.containsChunk(*cPos):
+            return None
+        try:
+            payload = workFolder.getRegionForChunk(*cPos)._readChunk(*cPos)
+        except ChunkNotPresent:
+            return None
+        return level, cPos, None, payload
+
+    def _submit(self, jobs):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="AutosaveService")
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(jobs)
+
+    def _run(self):
+        while True:
+            jobs = self._queue.get()
+            try:
+                if jobs is None:
+                    return
+                self._write(jobs)
+            except Exception:
+                log.exception(u"Autosave failed")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, jobs):
+        payloads = collections.defaultdict(list)
+        for level, (cx, cz), snapshot, payload in jobs:
+            if snapshot is not None:
+                payload = deflate(snapshot.savedTagData()), MCRegionFile.VERSION_DEFLATE
+            payloads[level.dimNo].append((cx, cz) + tuple(payload))
+        for dimNo, levelPayloads in payloads.iteritems():
+            self.stores[dimNo].writeChunks(levelPayloads)
+
+    def _clearStores(self):
+        for level in worldLevels(self.world):
+            self.store(level).clear()
+        # Made again on the next pass, in case the world was saved to another folder.
+        self.stores = {}
+
+    def waitIdle(self):
+        """ Block until every queued snapshot is written. """
+        if self._thread is not None:
+            self._queue.join()
+
+    def saved(self):
+        """ Call after the world is saved. Its stores are cleared, since the world folder holds every edit now. """
+        self.waitIdle()
+        self._clearStores()
+        self.reset()
+
+    def stop(self, discard=True):
+        """ Stop the background thread. If discard is True, also clear the stores, e.g. when the world is closed. """
+        self._pending.clear()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for level in worldLevels(self.world):
+            level.removeJournalReader(self)
+        if discard:
+            self._clearStores()
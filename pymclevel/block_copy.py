@@ -10,6 +10,7 @@ import numpy
 from box import BoundingBox
 from mclevelbase import exhaust
 import materials
+import chunk_transplant
 from entity import Entity, TileEntity
 from copy import deepcopy
 
@@ -58,6 +59,16 @@ def copyBlocksFromIter(destLevel, sourceLevel, sourceBox, destinationPoint, bloc
     (lx, ly, lz) = sourceBox.size
 
     sourceBox, destinationPoint = adjustCopyParameters(destLevel, sourceLevel, sourceBox, destinationPoint)
+
+    if chunk_transplant.canTransplant(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy, entities,
+                                      biomes, tileTicks):
+        log.info(u"Transplanting chunks from {0} to {1}".format(sourceBox, destinationPoint))
+        for i in chunk_transplant.transplantChunksIter(destLevel, sourceLevel, sourceBox, destinationPoint, create,
+                                                       staticCommands, moveSpawnerPos, regenerateUUID, first,
+                                                       cancelCommandBlockOffset, biomes):
+            yield i
+        return
+
     # needs work xxx
     log.info(u"Copying {0} blocks from {1} to {2}".format(ly * lz * lx, sourceBox, destinationPoint))
     startTime = datetime.now()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Runs per-chunk filter functions over a box, several chunks at a time.
+
+A filter opts in by defining
+
+    def performChunk(level, chunk, slices, point, options):
+
+and, optionally,
+
+    def reduceChunks(level, box, options, results):
+
+performChunk receives a ChunkCopy holding private copies of the chunk's Blocks, Data, BlockLight and SkyLight
+arrays, plus the same slices and point that level.getChunkSlices(box) would yield. It may modify those arrays
+freely. It runs on a worker thread, so it must not load chunks or edit entities through level; do that in
+reduceChunks, which runs on the calling thread once all chunks are done and receives the performChunk return
+values in chunk order.
+
+While the workers run, the calling thread loads the next chunks and merges finished copies back into the level in
+the order the chunks were read.
+"""
+
+import collections
+import logging
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from level import FakeChunk
+from mclevelbase import exhaust
+
+log = logging.getLogger(__name__)
+
+arrayNames = ("Blocks", "Data", "BlockLight", "SkyLight")
+
+
+def supportsChunkPipeline(filterModule):
+    return hasattr(filterModule, "performChunk")
+
+
+class ChunkCopy(FakeChunk):
+    """ A detached copy of a chunk's block and light arrays, handed to performChunk. """
+
+    def __init__(self, chunk):
+        self.world = chunk.world
+        self.chunkPosition = chunk.chunkPosition
+        self.Blocks = chunk.Blocks.copy()
+        self.Data = chunk.Data.copy()
+        self.BlockLight = chunk.BlockLight.copy()
+        self.SkyLight = chunk.SkyLight.copy()
+
+    def mergeInto(self, chunk, slices):
+        """ Copy the arrays back into chunk inside slices. Returns True if any block or light value changed. """
+        changed = False
+        for name in arrayNames:
+            new = getattr(self, name)[slices]
+            old = getattr(chunk, name)[slices]
+            if (new != old).any():
+                old[:] = new
+                changed = True
+        return changed
+
+
+def _performChunkFilters(level, filters, chunk, slices, point):
+    results = []
+    for module, options in filters:
+        results.append(module.performChunk(level, chunk, slices, point, options))
+    return results
+
+
+def performChunkFilters(level, box, filters, threads=None):
+    return exhaust(performChunkFiltersIter(level, box, filters, threads))
+
+
+def performChunkFiltersIter(level, box, filters, threads=None):
+    """
+    Run one or more chunk filters over box in a single pass over its chunks.
+
+    :param filters: A list of (filterModule, options) pairs. Each module must define performChunk.
+    :param threads: Number of worker threads. Defaults to the number of CPUs.
+    """
+    if threads is None:
+        threads = cpu_count()
+    threads = max(1, threads)
+    window = threads * 2
+
+    chunkCount = box.chunkCount
+    results = [[] for _ in filters]
+    pending = collections.deque()
+    pool = ThreadPool(threads)
+
+    def finishOne():
+        chunk, chunkCopy, slices, asyncResult = pending.popleft()
+        for i, r in enumerate(asyncResult.get()):
+            results[i].append(r)
+        if chunkCopy.mergeInto(chunk, slices):
+            chunk.chunkChanged()
+
+    done = 0
+    try:
+        for chunk, slices, point in level.getChunkSlices(box):
+            chunkCopy = ChunkCopy(chunk)
+            asyncResult = pool.apply_async(_performChunkFilters, (level, filters, chunkCopy, slices, point))
+            pending.append((chunk, chunkCopy, slices, asyncResult))
+
+            while len(pending) >= window:
+                finishOne()
+                done += 1
+                yield done, chunkCount
+
+        while pending:
+            finishOne()
+            done += 1
+            yield done, chunkCount
+    finally:
+        pool.close()
+        pool.join()
+
+    for (module, options), moduleResults in zip(filters, results):
+        reduceChunks = getattr(module, "reduceChunks", None)
+        if reduceChunks is not None:
+            reduceChunks(level, box, options, moduleResults)
+
+    log.info(u"Ran {0} chunk filters over {1} chunks".format(len(filters), done))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Moves whole chunks between two Java worlds without loading them into AnvilChunkData.
+
+When a copy covers whole chunk columns and moves them by a whole number of chunks, every destination chunk is an
+exact copy of one source chunk. transplantChunksIter reads the compressed chunk payloads straight out of the source
+region files, groups them by destination region, and writes each destination region once into the destination's
+unsaved work folder. Chunks that stay at the same position are copied byte for byte. Chunks that move only have
+their xPos/zPos and the positions of their entities, tile entities and tile ticks rewritten; blocks, lighting and
+biomes are never decoded. A copy without biomes keeps the destination chunk's Biomes tag, as a block copy does, which
+means reading the destination chunk's tags too.
+
+copyBlocksFromIter uses this path automatically when canTransplant says the copy qualifies.
+"""
+
+from datetime import datetime
+import logging
+import zlib
+
+from entity import Entity, TileEntity
+from mclevelbase import ChunkNotPresent, ChunkAccessDenied
+import nbt
+from numpy import array, zeros
+from regionfile import MCRegionFile, deflate
+
+log = logging.getLogger(__name__)
+
+
+def canTransplant(destLevel, sourceLevel, sourceBox, destinationPoint, blocksToCopy=None, entities=True,
+                  biomes=False, tileTicks=True):
+    """
+    Return True if copying sourceBox from sourceLevel to destinationPoint in destLevel replaces whole destination
+    chunks with unmodified source chunks, so transplantChunksIter gives the same result as a block copy. Copies with or
+    without biomes both qualify; pass biomes on to transplantChunksIter.
+    """
+    from infiniteworld import MCInfdevOldLevel
+
+    if not (isinstance(destLevel, MCInfdevOldLevel) and isinstance(sourceLevel, MCInfdevOldLevel)):
+        return False
+    if destLevel is sourceLevel or destLevel.readonly:
+        return False
+    if blocksToCopy is not None or not (entities and tileTicks):
+        return False
+    if destLevel.materials is not sourceLevel.materials or destLevel.Height != sourceLevel.Height:
+        return False
+
+    x, y, z = destinationPoint
+    if (sourceBox.minx | sourceBox.minz | sourceBox.maxx | sourceBox.maxz | x | z) & 0xf:
+        return False
+    return sourceBox.miny == 0 and y == 0 and sourceBox.maxy >= sourceLevel.Height
+
+
+def _readPayload(level, cx, cz):
+    """ Return (compressedData, format, uncompressedData or None) for the chunk as level would save it now. """
+    chunkData = level._loadedChunkData.get((cx, cz))
+    if chunkData is not None and chunkData.dirty:
+        # savedTagData sanitizes the blocks it saves; a snapshot keeps that from changing the source chunk.
+        data = chunkData.snapshot().savedTagData()
+        return deflate(data), MCRegionFile.VERSION_DEFLATE, data
+
+    if not level.readonly and level.unsavedWorkFolder.containsChunk(cx, cz):
+        folder = level.unsavedWorkFolder
+    elif level.worldFolder.containsChunk(cx, cz):
+        folder = level.worldFolder
+    else:
+        raise ChunkNotPresent((cx, cz))
+
+    data, format = folder.getRegionForChunk(cx, cz)._readChunk(cx, cz)
+    return data, format, None
+
+
+def _biomesTag(level, cx, cz):
+    """ The chunk's Biomes tag in level, or the one a newly created chunk gets if level has no such chunk. """
+    chunkData = level._loadedChunkData.get((cx, cz))
+    if chunkData is not None:
+        levelTag = chunkData.root_tag["Level"]
+    elif level.containsChunk(cx, cz):
+        data, format, uncompressed = _readPayload(level, cx, cz)
+        levelTag = nbt.load(buf=uncompressed or _uncompress(data, format))["Level"]
+    else:
+        levelTag = {}
+    if "Biomes" in levelTag:
+        return nbt.TAG_Byte_Array(array(levelTag["Biomes"].value))
+    biomes = nbt.TAG_Byte_Array(zeros((16, 16), 'uint8'))
+    biomes.value[:] = -1
+    return biomes
+
+
+def _uncompress(data, format):
+    if format == MCRegionFile.VERSION_GZIP:
+        return nbt.gunzip(data)
+    if format == MCRegionFile.VERSION_DEFLATE:
+        return zlib.decompress(data)
+    raise IOError("Unknown compress format: {0}".format(format))
+
+
+def _moveChunkTag(root_tag, copyOffset, staticCommands, moveSpawnerPos, regenerateUUID, first,
+                  cancelCommandBlockOffset):
+    levelTag = root_tag["Level"]
+    levelTag["xPos"].value += copyOffset[0] >> 4
+    levelTag["zPos"].value += copyOffset[2] >> 4
+
+    if "Entities" in levelTag:
+        levelTag["Entities"] = nbt.TAG_List([Entity.copyWithOffset(e, copyOffset, regenerateUUID)
+                                             for e in levelTag["Entities"]])
+    if "TileEntities" in levelTag:
+        levelTag["TileEntities"] = nbt.TAG_List([
+            TileEntity.copyWithOffset(t, copyOffset, staticCommands, moveSpawnerPos, first, cancelCommandBlockOffset)
+            for t in levelTag["TileEntities"]])
+    for tick in levelTag.get("TileTicks", ()):
+        tick["x"].value += copyOffset[0]
+        tick["z"].value += copyOffset[2]
+
+
+def transplantChunks(destLevel, sourceLevel, sourceBox, destinationPoint, create=False, **kw):
+    for _ in transplantChunksIter(destLevel, sourceLevel, sourceBox, destinationPoint, create, **kw):
+        pass
+
+
+def transplantChunksIter(destLevel, sourceLevel, sourceBox, destinationPoint, create=False, staticCommands=False,
+                         moveSpawnerPos=False, regenerateUUID=False, first=False, cancelCommandBlockOffset=False,
+                         biomes=True):
+    """
+    Copy the chunks in sourceBox to destinationPoint as compressed payloads. canTransplant must be True for these
+    arguments. The remaining keyword arguments have the same meaning as for copyBlocksFromIter.
+
+    :param create: If False, only chunks already present in destLevel are replaced.
+    :param biomes: If False, each destination chunk keeps its own biomes.
+    :return: An iterator yielding (chunksDone, chunkCount) progress tuples
+    """
+    from infiniteworld import AnvilChunkData
+    from schematic import ZipSchematic
+
+    if destLevel.readonly:
+        raise IOError("World is opened read only.")
+    if destLevel.saving or sourceLevel.saving:
+        raise ChunkAccessDenied
+    destLevel.checkSessionLock()
+
+    startTime = datetime.now()
+    copyOffset = (destinationPoint[0] - sourceBox.minx, 0, destinationPoint[2] - sourceBox.minz)
+    dcx = copyOffset[0] >> 4
+    dcz = copyOffset[2] >> 4
+    # Tile entities go through copyWithOffset whenever it could change them, even for an offset of zero. Zip
+    # schematics hold command block coordinates annotated by the first=True copy that extracted them.
+    rewrite = dcx or dcz or regenerateUUID or first or isinstance(sourceLevel, ZipSchematic)
+
+    regions = {}
+    for cx, cz in sourceBox.chunkPositions:
+        if not sourceLevel.containsChunk(cx, cz):
+            continue
+        destPos = (cx + dcx, cz + dcz)
+        if not (create or destLevel.containsChunk(*destPos)):
+            continue
+        regions.setdefault((destPos[0] >> 5, destPos[1] >> 5), []).append(((cx, cz), destPos))
+
+    chunkCount = sum(len(c) for c in regions.itervalues())
+    done = 0
+    for rPos in sorted(regions):
+        payloads = []
+        for sourcePos, destPos in regions[rPos]:
+            done += 1
+            yield done, chunkCount
+            try:
+                data, format, uncompressed = _readPayload(sourceLevel, *sourcePos)
+            except ChunkNotPresent:
+                continue
+
+            root_tag = None
+            if rewrite or not biomes:
+                root_tag = nbt.load(buf=uncompressed or _uncompress(data, format))
+                if rewrite:
+                    _moveChunkTag(root_tag, copyOffset, staticCommands, moveSpawnerPos, regenerateUUID, first,
+                                  cancelCommandBlockOffset)
+                if not biomes:
+                    root_tag["Level"]["Biomes"] = _biomesTag(destLevel, *destPos)
+                data, format = deflate(root_tag.save(compressed=False)), MCRegionFile.VERSION_DEFLATE
+
+            destChunk = destLevel._loadedChunks.get(destPos)
+            if destChunk is not None:
+                # Another object holds this chunk; replace its contents in place so it stays valid.
+                if root_tag is None:
+                    root_tag = nbt.load(buf=uncompressed or _uncompress(data, format))
+                destChunk.chunkData.restore(AnvilChunkData(destLevel, destPos, root_tag))
+                continue
+
+            destLevel._loadedChunkData.pop(destPos, None)
+            payloads.append((destPos[0], destPos[1], data, format))
+
+        if payloads:
+            destLevel.unsavedWorkFolder.getRegionFile(*rPos).saveChunks(payloads)
+            # Journal the chunks written behind the level's back, so autosave and the renderer pick them up.
+            for pcx, pcz, data, format in payloads:
+                destLevel.markChunkChanged((pcx, pcz))
+        if destLevel._allChunks is not None:
+            destLevel._allChunks.update(destPos for sourcePos, destPos in regions[rPos])
+
+    destLevel._bounds = None
+    log.info(u"Transplanted {0} chunks in {1} regions. Duration: {2}".format(chunkCount, len(regions),
+                                                                             datetime.now() - startTime))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Disk-backed store for the editor's copy stack.
+
+Each ClipboardEntry wraps one copied schematic. MCSchematic copies stay in memory while the total size of the
+block arrays held by the store fits in memoryLimit. Past that, the least recently used entries are spilled to a
+folder holding a small JSON header, one zlib-compressed file per non-empty 16x16x16 section, and a gzipped NBT file
+with the entities, tile entities, tile ticks and biomes. A spilled entry keeps its size and materials from the
+header and only reads its sections back when its schematic is asked for again, e.g. to paste it.
+
+ZipSchematic copies are already backed by a world folder on disk. The store counts the chunk data they have loaded
+against the same limit, and spills such an entry by unloading that chunk data; the entry keeps its schematic.
+"""
+
+import atexit
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zlib
+
+from numpy import fromstring, uint8, uint16
+
+from infiniteworld import MCInfdevOldLevel
+from materials import namedMaterials
+import nbt
+from schematic import MCSchematic
+
+log = logging.getLogger(__name__)
+
+SECTION_SIZE = 16
+HEADER_VERSION = 1
+headerName = "header.json"
+extraName = "extra.dat"
+
+
+def _sectionName(sx, sy, sz):
+    return "{0}.{1}.{2}.sec".format(sx, sy, sz)
+
+
+class ClipboardEntry(object):
+    def __init__(self, store, schematic, folder):
+        self.store = store
+        self.folder = folder
+        self._schematic = schematic
+        self.spillable = isinstance(schematic, MCSchematic)
+        self.header = None
+
+    @property
+    def resident(self):
+        return self._schematic is not None
+
+    @property
+    def size(self):
+        if self._schematic is not None:
+            return self._schematic.size
+        return tuple(self.header["size"])
+
+    @property
+    def Width(self):
+        return self.size[0]
+
+    @property
+    def Height(self):
+        return self.size[1]
+
+    @property
+    def Length(self):
+        return self.size[2]
+
+    @property
+    def residentBytes(self):
+        """ Memory held by the block, data and biome arrays of the schematic while it is loaded, or by the chunk data
+        a ZipSchematic has loaded. """
+        sch = self._schematic
+        if sch is None:
+            return 0
+        if not self.spillable:
+            return sch.loadedChunkBytes if isinstance(sch, MCInfdevOldLevel) else 0
+        total = sch._Blocks.nbytes + sch.root_tag["Data"].value.nbytes
+        if "Biomes" in sch.root_tag:
+            total += sch.root_tag["Biomes"].value.nbytes
+        return total
+
+    @property
+    def schematic(self):
+        """ The copied schematic, read back from disk if it was spilled. """
+        if self._schematic is None:
+            self._schematic = self._load()
+        self.store.touch(self)
+        return self._schematic
+
+    def peekSchematic(self):
+        """ The copied schematic for display, e.g. as a thumbnail, without counting as a use of the entry. A spilled
+        entry is read into a copy that is not kept, so the entry stays spilled and the store's order is unchanged. """
+        if self._schematic is not None:
+            return self._schematic
+        return self._load()
+
+    def spill(self):
+        """ Write the schematic to the entry folder and drop the in-memory copy. A ZipSchematic only unloads its
+        chunk data. """
+        if self._schematic is None:
+            return
+        if not self.spillable:
+            if isinstance(self._schematic, MCInfdevOldLevel):
+                self._schematic.unloadChunkData()
+            return
+        self._save(self._schematic)
+        self._schematic = None
+
+    def _save(self, sch):
+        # The schematic may have been rotated or flipped in place since it was loaded, so always rewrite.
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+        os.makedirs(self.folder)
+
+        blocks = sch._Blocks  # y, z, x
+        data = sch.root_tag["Data"].value
+        h, l, w = blocks.shape
+        sections = []
+        for y in xrange(0, h, SECTION_SIZE):
+            for z in xrange(0, l, SECTION_SIZE):
+                for x in xrange(0, w, SECTION_SIZE):
+                    slices = slice(y, y + SECTION_SIZE), slice(z, z + SECTION_SIZE), slice(x, x + SECTION_SIZE)
+                    sectionBlocks = blocks[slices]
+                    sectionData = data[slices]
+                    if not (sectionBlocks.any() or sectionData.any()):
+                        continue
+                    pos = x // SECTION_SIZE, y // SECTION_SIZE, z // SECTION_SIZE
+                    payload = sectionBlocks.astype(uint16).tostring() + sectionData.astype(uint8).tostring()
+                    with open(os.path.join(self.folder, _sectionName(*pos)), "wb") as f:
+                        f.write(zlib.compress(payload, 1))
+                    sections.append(pos)
+
+        extra = nbt.TAG_Compound(name="Schematic")
+        for name in "Entities", "TileEntities", "TileTicks", "Biomes":
+            if name in sch.root_tag:
+                extra[name] = sch.root_tag[name]
+        extra.save(os.path.join(self.folder, extraName))
+
+        self.header = {
+            "version": HEADER_VERSION,
+            "size": list(sch.size),
+            "materials": sch.materials.name,
+            "sections": sections,
+        }
+        with open(os.path.join(self.folder, headerName), "wb") as f:
+            json.dump(self.header, f)
+
+    def _load(self):
+        header = self.header
+        sch = MCSchematic(shape=tuple(header["size"]), mats=namedMaterials[header["materials"]])
+        blocks = sch._Blocks
+        data = sch.root_tag["Data"].value
+
+        for pos in header["sections"]:
+            x, y, z = (p * SECTION_SIZE for p in pos)
+            slices = slice(y, y + SECTION_SIZE), slice(z, z + SECTION_SIZE), slice(x, x + SECTION_SIZE)
+            shape = blocks[slices].shape
+            count = shape[0] * shape[1] * shape[2]
+            with open(os.path.join(self.folder, _sectionName(*pos)), "rb") as f:
+                payload = zlib.decompress(f.read())
+            blocks[slices] = fromstring(payload[:count * 2], uint16).reshape(shape)
+            data[slices] = fromstring(payload[count * 2:], uint8).reshape(shape)
+
+        extra = nbt.load(os.path.join(self.folder, extraName))
+        for name in "Entities", "TileEntities", "TileTicks", "Biomes":
+            if name in extra:
+                sch.root_tag[name] = extra[name]
+        if "Biomes" in sch.root_tag:
+            sch.root_tag["Biomes"].value = sch.root_tag["Biomes"].value.reshape(sch.Length, sch.Width)
+
+        log.debug(u"Loaded clipboard entry {0} ({1} sections)".format(self.folder, len(header["sections"])))
+        return sch
+
+    def delete(self):
+        sch = self._schematic
+        self._schematic = None
+        if sch is not None and not self.spillable:
+            if hasattr(sch, 'close'):
+                sch.close()
+            if sch.filename and os.path.exists(sch.filename):
+                os.remove(sch.filename)
+        shutil.rmtree(self.folder, True)
+
+
+class ClipboardStore(object):
+    """
+    The copy stack, newest entry first. Supports len(), iteration, indexing and `in` like the list it replaces.
+
+    :param memoryLimit: Bytes of block arrays and loaded chunk data to keep in memory across all entries. The most
+        recently used entry is always kept.
+    """
+
+    def __init__(self, memoryLimit=256 << 20, folder=None):
+        if folder is None:
+            folder = tempfile.mkdtemp("", "mceditclipboard")
+            atexit.register(shutil.rmtree, folder, True)
+        self.folder = folder
+        self.memoryLimit = memoryLimit
+        self.entries = []
+        self._recent = []  # least recently used first
+        self._counter = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def __contains__(self, entry):
+        return entry in self.entries
+
+    @property
+    def residentBytes(self):
+        return sum(e.residentBytes for e in self.entries)
+
+    def add(self, schematic):
+        """ Put schematic on top of the stack and return its entry. """
+        self._counter += 1
+        entry = ClipboardEntry(self, schematic, os.path.join(self.folder, "copy%d" % self._counter))
+        self.entries.insert(0, entry)
+        self.touch(entry)
+        return entry
+
+    def remove(self, entry):
+        if entry in self._recent:
+            self._recent.remove(entry)
+        self.entries = [e for e in self.entries if e is not entry]
+        entry.delete()
+
+    def clear(self):
+        for entry in self.entries:
+            entry.delete()
+        self.entries = []
+        self._recent = []
+
+    def touch(self, entry):
+        if entry in self._recent:
+            self._recent.remove(entry)
+        self._recent.append(entry)
+        self.enforceLimit()
+
+    def enforceLimit(self):
+        """ Spill the least recently used entries until the resident ones fit in memoryLimit. """
+        total = self.residentBytes
+        for entry in self._recent[:-1]:
+            if total <= self.memoryLimit:
+                break
+            size = entry.residentBytes
+            if size:
+                entry.spill()
+                total -= size - entry.residentBytes
+                log.debug(u"Spilled clipboard entry {0} to disk, {1} bytes resident".format(entry.folder, total))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Precompiled cache for the block and ID definition files read when pymclevel is imported or a level is opened.
+
+Entries are pickles named after a hash of CACHE_VERSION and the contents of the source files they were built from, so
+editing a definition file (or bumping CACHE_VERSION when the cached structures change) simply leads to a new entry.
+Two kinds of entries are stored:
+
+- loadJSON() keeps the parsed form of a JSON file.
+- MCMaterials keeps its whole state after each addJSONBlocks() step, keyed by the chain of sources loaded so far,
+  so the Block objects and lookup tables do not have to be rebuilt on the next start.
+
+The cache lives in <cache dir>/defs-cache. Set the PYMCLEVEL_DEFS_CACHE environment variable to use another folder,
+or to an empty string to disable the cache.
+"""
+
+import cPickle
+import hashlib
+import json
+import logging
+import os
+
+import directories
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+
+_cacheDir = None
+
+
+def cacheDir():
+    global _cacheDir
+    if _cacheDir is None:
+        _cacheDir = os.environ.get("PYMCLEVEL_DEFS_CACHE")
+        if _cacheDir is None:
+            _cacheDir = os.path.join(directories.getCacheDir(), "defs-cache")
+        if _cacheDir and not os.path.exists(_cacheDir):
+            try:
+                os.makedirs(_cacheDir)
+            except OSError as e:
+                log.warning(u"Cannot create definitions cache folder {0}: {1!r}".format(_cacheDir, e))
+                _cacheDir = ""
+    return _cacheDir
+
+
+def sourceHash(*parts):
+    """ Hash of CACHE_VERSION and the given byte strings. """
+    h = hashlib.sha1("pymclevel-defs-%d" % CACHE_VERSION)
+    for part in parts:
+        h.update(hashlib.sha1(part).digest())
+    return h.hexdigest()
+
+
+def load(key):
+    """ Return the object cached under key, or None. """
+    folder = cacheDir()
+    if not folder:
+        return None
+    path = os.path.join(folder, key + ".pickle")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return cPickle.load(f)
+    except Exception as e:
+        log.warning(u"Discarding unreadable definitions cache entry {0}: {1!r}".format(path, e))
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+
+def save(key, value):
+    folder = cacheDir()
+    if not folder:
+        return
+    path = os.path.join(folder, key + ".pickle")
+    tempPath = path + ".%d.tmp" % os.getpid()
+    try:
+        with open(tempPath, "wb") as f:
+            cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tempPath, path)
+    except (IOError, OSError, cPickle.PicklingError) as e:
+        log.warning(u"Could not write definitions cache entry {0}: {1!r}".format(path, e))
+
+
+def loadJSON(f):
+    """
+    Parse the JSON in the file object or byte string f, using the cached result if the same content was parsed
+    before.
+
+    :return: A (data, key) tuple. key identifies the content and can be chained into other cache keys.
+    """
+    text = f if isinstance(f, str) else f.read()
+    key = sourceHash("json", text)
+    data = load(key)
+    if data is None:
+        data = json.loads(text)
+        save(key, data)
+    return data, key
@@ -43,6 +43,7 @@ import json
 from logging import getLogger
 from pymclevel import MCEDIT_DEFS, MCEDIT_IDS
 import pymclevel
+import defs_cache
 import re
 import collections
 import sys
@@ -121,9 +122,8 @@ def _parse_data(data, prefix, namespace, defs_dict, ids_dict, ignore_load=False)
 def _get_data(file_name):
     data = {}
     try:
-        fp = open(file_name)
-        data = json.loads(fp.read())
-        fp.close()
+        with open(file_name, 'rb') as fp:
+            data = defs_cache.loadJSON(fp)[0]
     except Exception as e:
         log.error("Could not load data from %s" % file_name)
         log.error("Error is: %s" % e)
@@ -7,7 +7,7 @@ Created on Jul 22, 2011
 @author: Rio
 '''
 import collections
-
+import copy
 from datetime import datetime
 import itertools
 from logging import getLogger
@@ -16,6 +16,7 @@ import os
 import random
 import shutil
 import struct
+import threading
 import time
 import traceback
 import weakref
@@ -25,12 +26,14 @@ import sys
 from box import BoundingBox
 from entity import Entity, TileEntity, TileTick
 from faces import FaceXDecreasing, FaceXIncreasing, FaceZDecreasing, FaceZIncreasing
-from level import LightedChunk, EntityLevel, computeChunkHeightMap, MCLevel, ChunkBase
+from level import LightedChunk, EntityLevel, computeChunkHeightMap, MCLevel, ChunkBase, ChunkSnapshot, nextGeneration
 from materials import alphaMaterials
 from mclevelbase import ChunkMalformed, ChunkNotPresent, ChunkAccessDenied,ChunkConcurrentException,exhaust, PlayerNotFound
 import nbt
 from numpy import array, clip, maximum, zeros
-from regionfile import MCRegionFile
+from regionfile import MCRegionFile, inflate
+import save_pipeline
+from instrumentation import instruments
 import logging
 from uuid import UUID
 import id_definitions
@@ -65,6 +68,10 @@ class _ZeroChunk(ChunkBase):
         self.BlockLight = whiteLight
         self.SkyLight = whiteLight
         self.Data = zeroChunk
+        self._snapshot = ChunkSnapshot(self, None, (zeroChunk, zeroChunk, whiteLight, whiteLight))
+
+    def snapshot(self):
+        return self._snapshot
 
 
 def unpackNibbleArray(dataArray):
@@ -102,6 +109,22 @@ def sanitizeBlocks(chunk):
         chunk.Blocks[:, :, 1:][badsnow] = chunk.materials.Air.ID
 
 
+_cowLock = threading.Lock()
+
+
+class _CowShare(object):
+    """ The AnvilChunkData objects currently sharing one set of block and light arrays. The owner is the chunk in the
+    world the arrays belong to. It keeps them, so references to them held by editing code stay valid, and gives the
+    other members a copy the next time it accesses them. Members without a claim copy them before touching them. """
+
+    def __init__(self):
+        self.members = weakref.WeakSet()
+        self.owner = None
+
+    def isOwner(self, chunkData):
+        return self.owner is not None and self.owner() is chunkData
+
+
 class AnvilChunkData(object):
     """ This is the chunk data backing an AnvilChunk. Chunk data is retained by the MCInfdevOldLevel until its
     AnvilChunk is no longer used, then it is either cached in memory, discarded, or written to disk according to
@@ -110,12 +133,25 @@ class AnvilChunkData(object):
     AnvilChunks are stored in a WeakValueDictionary so we can find out when they are no longer used by clients. The
     AnvilChunkData for an unused chunk may safely be discarded or written out to disk. The client should probably
      not keep references to a whole lot of chunks or else it will run out of memory.
+
+    The block and light arrays may be shared copy-on-write with undo snapshots of this chunk (see snapshot()). The
+    chunk keeps its arrays; the snapshots are given a copy the first time the chunk accesses them after a snapshot.
+    Code writing through a reference to Blocks or the other arrays taken before a snapshot must fetch the array from
+    the chunk again before writing, or the write also shows in the snapshot. The editor's operations record undo
+    before they fetch any arrays.
     """
 
+    arrayNames = ("Blocks", "Data", "BlockLight", "SkyLight")
+    _cowShare = None
+    _dirty = False
+    _viewSnapshot = None
+    generation = 0
+
     def __init__(self, world, chunkPosition, root_tag=None, create=False):
         self.chunkPosition = chunkPosition
         self.world = world
         self.root_tag = root_tag
+        self.generation = nextGeneration()
         self.dirty = False
 
         self.Blocks = zeros((16, 16, world.Height), 'uint16')
@@ -228,6 +264,176 @@ class AnvilChunkData(object):
     def materials(self):
         return self.world.materials
 
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @dirty.setter
+    def dirty(self, val):
+        """ Marking the chunk dirty also gives it a new generation, so callers can tell that it changed since they
+        last looked at it, and records it in the world's change journal. """
+        self._dirty = val
+        if val:
+            self.generation = nextGeneration()
+            self.world.markChunkChanged(self.chunkPosition, self.generation)
+
+    # --- Copy-on-write snapshots ---
+
+    def snapshot(self):
+        """ Return a new AnvilChunkData holding the current state of this chunk. The block and light arrays are
+        shared copy-on-write and only copied when either chunk accesses them again. The other NBT tags (entities,
+        tile entities and ticks) are deep-copied now, so the cost grows with the number of entities in the chunk. """
+        snap = AnvilChunkData.__new__(AnvilChunkData)
+        snap.chunkPosition = self.chunkPosition
+        snap.world = self.world
+        snap._dirty = self._dirty
+        snap.generation = self.generation
+        snap.root_tag = copy.deepcopy(self.root_tag)
+        snap._share(self)
+        return snap
+
+    def restore(self, snapshot):
+        """ Replace the contents of this chunk with the contents of snapshot. The snapshot stays valid and may be
+        restored again later. """
+        self._share(snapshot, own=True)
+        self.root_tag = copy.deepcopy(snapshot.root_tag)
+        self.dirty = True
+
+    def viewSnapshot(self):
+        """ Return a read-only ChunkSnapshot of the blocks and light. It holds copies of the arrays rather than
+        sharing them: its reader may keep them in locals across edits, so they can neither be written by this chunk
+        nor swapped for copies. The same snapshot is returned again until the chunk's generation changes or one of
+        its arrays is replaced. Reading the arrays keeps it; an edit written into them in place shows in the next
+        snapshot once the chunk is marked changed, as every edit is. """
+        view = self._viewSnapshot and self._viewSnapshot()
+        if view is not None and view.generation == self.generation:
+            return view
+
+        view = ChunkSnapshot(self, self.generation, [array(self.__dict__["_" + name]) for name in self.arrayNames])
+        self._viewSnapshot = weakref.ref(view)
+        return view
+
+    @property
+    def isShared(self):
+        return self._cowShare is not None
+
+    @property
+    def nbytes(self):
+        return sum(self.__dict__["_" + name].nbytes for name in self.arrayNames)
+
+    @property
+    def copiedBytes(self):
+        """ Bytes of the arrays this chunk holds apart from the chunk that owns them, or nbytes for the owner. Until
+        the owner accesses its arrays again, a snapshot costs no array memory of its own. """
+        share = self._cowShare
+        if share is not None and not share.isOwner(self) and share.owner is not None and share.owner() is not None:
+            return 0
+        return self.nbytes
+
+    def _share(self, other, own=False):
+        """ Take the arrays of other, which owns them unless it shares them already. With own=True this chunk becomes
+        their owner instead; if another chunk owns them, this chunk takes a copy. """
+        with _cowLock:
+            self._leaveShare()
+            share = other._cowShare
+            if share is None:
+                share = other._cowShare = _CowShare()
+                share.members.add(other)
+                if not own:
+                    share.owner = weakref.ref(other)
+
+            if own:
+                owner = share.owner and share.owner()
+                if owner is not None and owner is not self:
+                    for name in self.arrayNames:
+                        self.__dict__["_" + name] = array(other.__dict__["_" + name])
+                    return
+                share.owner = weakref.ref(self)
+
+            share.members.add(self)
+            self._cowShare = share
+            for name in self.arrayNames:
+                self.__dict__["_" + name] = other.__dict__["_" + name]
+
+    def _leaveShare(self):
+        """ Stop sharing this chunk's arrays. If it owned them, the other members are given a copy first. """
+        share = self._cowShare
+        if share is None:
+            return
+        self._cowShare = None
+        share.members.discard(self)
+        others = list(share.members)
+        if share.isOwner(self):
+            share.owner = None
+            if others:
+                copies = [(key, array(self.__dict__[key])) for key in ("_" + name for name in self.arrayNames)]
+                for other in others:
+                    other.__dict__.update(copies)
+        if len(others) == 1:
+            others[0]._cowShare = None
+            share.members.clear()
+
+    def _unshare(self):
+        with _cowLock:
+            share = self._cowShare
+            if share is None:
+                return
+            copyArrays = not share.isOwner(self) and len(share.members) > 1
+            self._leaveShare()
+            if copyArrays:
+                for name in self.arrayNames:
+                    self.__dict__["_" + name] = array(self.__dict__["_" + name])
+
+    def _arrayProperty(name):
+        key = "_" + name
+
+        def getter(self):
+            if self._cowShare is not None:
+                self._unshare()
+            return self.__dict__[key]
+
+        def setter(self, value):
+            if self._cowShare is not None:
+                self._unshare()
+            if self._viewSnapshot is not None:
+                self._viewSnapshot = None
+            self.__dict__[key] = value
+
+        return property(getter, setter)
+
+    Blocks = _arrayProperty("Blocks")
+    Data = _arrayProperty("Data")
+    BlockLight = _arrayProperty("BlockLight")
+    SkyLight = _arrayProperty("SkyLight")
+
+    del _arrayProperty
+
+
+class RawChunkSnapshot(object):
+    """ Undo snapshot of a chunk that was not loaded when it was captured: its payload as stored in the region file,
+    still compressed. Capturing and restoring it copies bytes without parsing the chunk, unless the chunk has been
+    loaded in the meantime. """
+
+    def __init__(self, chunkPosition, data, format):
+        self.chunkPosition = chunkPosition
+        self.data = data
+        self.format = format
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    copiedBytes = nbytes
+
+    def savedTagData(self):
+        """ The chunk's uncompressed NBT data, as AnvilChunkData.savedTagData returns it. """
+        if self.format == MCRegionFile.VERSION_GZIP:
+            return nbt.gunzip(self.data)
+        if self.format == MCRegionFile.VERSION_DEFLATE:
+            return inflate(self.data)
+
+        raise IOError("Unknown compress format: {0}".format(self.format))
+
 
 class AnvilChunk(LightedChunk):
     """ This is a 16x16xH chunk in an (infinite) world.
@@ -308,6 +514,13 @@ class AnvilChunk(LightedChunk):
     def dirty(self, val):
         self.chunkData.dirty = val
 
+    @property
+    def generation(self):
+        return self.chunkData.generation
+
+    def snapshot(self):
+        return self.chunkData.viewSnapshot()
+
     # --- Chunk attributes ---
 
     @property
@@ -656,7 +869,7 @@ class ChunkedLevelMixin(MCLevel):
             dc = sorted(dc)
             workTotal = sum(estimatedTotals)
             t = 0
-            for c, t, p in self._generateLightsIter(dc):
+            for c, t, p in instruments.iterate("lighting", self._generateLightsIter(dc)):
                 yield c + workDone, t + workTotal - estimatedTotals[i], p
 
             estimatedTotals[i] = t
@@ -944,7 +1157,12 @@ def TagProperty(tagName, tagType, default_or_func=None):
 
 
 class AnvilWorldFolder(object):
-    def __init__(self, filename):
+    """
+    :param durable: Whether region files fsync each header commit. The editor's scratch folders are discarded with
+        the session, so they turn it off.
+    """
+
+    def __init__(self, filename, durable=True):
         if not os.path.exists(filename):
             os.mkdir(filename)
 
@@ -952,6 +1170,7 @@ class AnvilWorldFolder(object):
             raise IOError("AnvilWorldFolder: Not a folder: %s" % filename)
 
         self.filename = filename
+        self.durable = durable
         self.regionFiles = {}
 
     # --- File paths ---
@@ -978,10 +1197,13 @@ class AnvilWorldFolder(object):
         regionFile = self.regionFiles.get((rx, rz))
         if regionFile:
             return regionFile
-        regionFile = MCRegionFile(self.getRegionFilename(rx, rz), (rx, rz))
+        regionFile = MCRegionFile(self.getRegionFilename(rx, rz), (rx, rz), self.durable)
         self.regionFiles[rx, rz] = regionFile
         return regionFile
 
+    def getWritableRegionFile(self, rx, rz):
+        return self.getRegionFile(rx, rz)
+
     def getRegionForChunk(self, cx, cz):
         rx = cx >> 5
         rz = cz >> 5
@@ -996,18 +1218,26 @@ class AnvilWorldFolder(object):
     # --- Chunks and chunk listing ---
 
     @staticmethod
-    def tryLoadRegionFile(filepath):
+    def regionCoordsForPath(filepath):
+        """ Return the (rx, rz) coordinates named by a region file's path, or None if it is not a region file. """
         filename = os.path.basename(filepath)
         bits = filename.split('.')
-        if len(bits) < 4 or bits[0] != 'r' or bits[3] != "mca":
+        # Exactly four parts, so a region's header journal (r.x.z.mca.wal) is not taken for the region itself.
+        if len(bits) != 4 or bits[0] != 'r' or bits[3] != "mca":
             return None
 
         try:
             rx, rz = map(int, bits[1:3])
         except ValueError:
             return None
+        return rx, rz
+
+    def tryLoadRegionFile(self, filepath):
+        rPos = self.regionCoordsForPath(filepath)
+        if rPos is None:
+            return None
 
-        return MCRegionFile(filepath, (rx, rz))
+        return MCRegionFile(filepath, rPos, self.durable)
 
     def findRegionFiles(self):
         regionDir = self.getFolderPath("region", generation=True)
@@ -1086,7 +1316,8 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
     '''
     playersFolder = None
 
-    def __init__(self, filename=None, create=False, random_seed=None, last_played=None, readonly=False, dat_name='level'):
+    def __init__(self, filename=None, create=False, random_seed=None, last_played=None, readonly=False, dat_name='level',
+                 worldFolder=None):
         """
         Load an Alpha level from the given filename. It can point to either
         a level.dat or a folder containing one. If create is True, it will
@@ -1095,6 +1326,9 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         and long(time.time() * 1000) will be used for LastPlayed.
 
         If you try to create an existing world, its level.dat will be replaced.
+
+        worldFolder is an AnvilWorldFolder already opened on filename, for levels that store their regions in a
+        different way. By default an AnvilWorldFolder is created.
         """
 
         self.dat_name = dat_name
@@ -1123,7 +1357,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         if not os.path.isdir(filename):
             raise IOError('File is not a Minecraft Alpha world')
 
-        self.worldFolder = AnvilWorldFolder(filename)
+        self.worldFolder = worldFolder if worldFolder is not None else AnvilWorldFolder(filename)
         self.filename = self.worldFolder.getFilePath("%s.dat" % dat_name)
         self.readonly = readonly
         if not readonly:
@@ -1138,8 +1372,8 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             if os.path.exists(workFolderPath2):
                 shutil.rmtree(workFolderPath2, True)
 
-            self.unsavedWorkFolder = AnvilWorldFolder(workFolderPath)
-            self.fileEditsFolder = AnvilWorldFolder(workFolderPath2)
+            self.unsavedWorkFolder = AnvilWorldFolder(workFolderPath, durable=False)
+            self.fileEditsFolder = AnvilWorldFolder(workFolderPath2, durable=False)
 
             self.editFileNumber = 1
 
@@ -1283,20 +1517,10 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
                 yield
 
         dirtyChunkCount = 0
-        for chunk in self._loadedChunkData.itervalues():
-            cx, cz = chunk.chunkPosition
-            if chunk.dirty:
-                data = chunk.savedTagData()
-                dirtyChunkCount += 1
-                self.worldFolder.saveChunk(cx, cz, data)
-                chunk.dirty = False
-            yield
-
-        for cx, cz in self.unsavedWorkFolder.listChunks():
-            if (cx, cz) not in self._loadedChunkData:
-                data = self.unsavedWorkFolder.readChunk(cx, cz)
-                self.worldFolder.saveChunk(cx, cz, data)
-                dirtyChunkCount += 1
+        for _ in instruments.iterate("save chunks", itertools.chain(
+                save_pipeline.saveDirtyChunksIter(self, self.saveThreads),
+                save_pipeline.copyWorkFolderChunksIter(self))):
+            dirtyChunkCount += 1
             yield
 
         self.unsavedWorkFolder.closeRegions()
@@ -1348,6 +1572,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
     # --- Resource limits ---
 
     loadedChunkLimit = 400
+    saveThreads = None  # worker threads used to compress chunks while saving, None for one per CPU
 
     # --- Constants ---
 
@@ -1634,6 +1859,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
                 # Only source chunk loaded. Discard destination chunk and save source chunk in its place.
                 self._loadedChunkData.pop((cx, cz), None)
                 self.unsavedWorkFolder.saveChunk(cx, cz, sourceChunk.savedTagData())
+                self.markChunkChanged((cx, cz))
                 return
         else:
             if destChunk:
@@ -1657,6 +1883,7 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
                     sourceFolder = world.worldFolder
 
                 self.unsavedWorkFolder.copyChunkFrom(sourceFolder, cx, cz)
+                self.markChunkChanged((cx, cz))
 
     def _getChunkBytes(self, cx, cz):
         if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
@@ -1673,8 +1900,10 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             raise ChunkAccessDenied
 
         try:
-            data = self._getChunkBytes(cx, cz)
-            root_tag = nbt.load(buf=data)
+            with instruments.stage("chunk load"):
+                data = self._getChunkBytes(cx, cz)
+            with instruments.stage("nbt parse"):
+                root_tag = nbt.load(buf=data)
             chunkData = AnvilChunkData(self, (cx, cz), root_tag)
         except (MemoryError, ChunkNotPresent):
             raise
@@ -1682,7 +1911,8 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
             raise ChunkMalformed("Chunk {0} had an error: {1!r}".format((cx, cz), e), sys.exc_info()[2])
 
         if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
-            chunkData.dirty = True
+            # Still unsaved, but unchanged since it was journalled: loading it is not an edit.
+            chunkData._dirty = True
 
         self._storeLoadedChunkData(chunkData)
 
@@ -1696,15 +1926,36 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
                 self.checkSessionLock()
             for (ocx, ocz), oldChunkData in self._loadedChunkData.items():
                 if (ocx, ocz) not in self._loadedChunks:
-                    if oldChunkData.dirty and not self.readonly:
-                        data = oldChunkData.savedTagData()
-                        self.unsavedWorkFolder.saveChunk(ocx, ocz, data)
-
-                    del self._loadedChunkData[ocx, ocz]
+                    self._evictChunkData(ocx, ocz, oldChunkData)
                     break
 
         self._loadedChunkData[chunkData.chunkPosition] = chunkData
 
+    def _evictChunkData(self, cx, cz, chunkData):
+        if chunkData.dirty and not self.readonly:
+            data = chunkData.savedTagData()
+            self.unsavedWorkFolder.saveChunk(cx, cz, data)
+
+        del self._loadedChunkData[cx, cz]
+
+    @property
+    def loadedChunkBytes(self):
+        """ Bytes of block and light arrays held by the chunk data loaded in memory. """
+        return sum(chunkData.copiedBytes for chunkData in self._loadedChunkData.itervalues())
+
+    def unloadChunkData(self):
+        """
+        Drop the loaded chunk data that no AnvilChunk is using, writing dirty chunks to the temporary work folder
+        first. Unlike unload(), the level stays open and reads them back when they are asked for again. Dirty chunks
+        of a read-only level are kept, as they cannot be written anywhere.
+        """
+        if not self.readonly:
+            self.checkSessionLock()
+        for (cx, cz), chunkData in self._loadedChunkData.items():
+            if (cx, cz) in self._loadedChunks or (chunkData.dirty and self.readonly):
+                continue
+            self._evictChunkData(cx, cz, chunkData)
+
     def getChunk(self, cx, cz):
         '''
         Read the chunk from disk, load it, and then return it
@@ -1727,6 +1978,65 @@ class MCInfdevOldLevel(ChunkedLevelMixin, EntityLevel):
         self.recentChunks.append(chunk)
         return chunk
 
+    def snapshotChunk(self, cx, cz):
+        '''
+        Capture the current state of a chunk without serializing it. A loaded chunk is captured as a copy-on-write
+        snapshot of its chunk data; a chunk that is not loaded is captured as its compressed bytes, without parsing it.
+
+        :param cx: The X coordinate of the chunk
+        :type cx: int
+        :param cz: The Z coordinate of the chunk
+        :type cz: int
+        :return: A snapshot that can be passed to restoreChunkSnapshot
+        :rtype: pymclevel.infiniteworld.AnvilChunkData or pymclevel.infiniteworld.RawChunkSnapshot
+        '''
+        if (cx, cz) in self._loadedChunkData:
+            return self._loadedChunkData[cx, cz].snapshot()
+
+        if self.saving:
+            raise ChunkAccessDenied
+        if not self.readonly and self.unsavedWorkFolder.containsChunk(cx, cz):
+            folder = self.unsavedWorkFolder
+        elif self.worldFolder.containsChunk(cx, cz):
+            folder = self.worldFolder
+        else:
+            raise ChunkNotPresent((cx, cz))
+        data, format = folder.getRegionForChunk(cx, cz)._readChunk(cx, cz)
+        return RawChunkSnapshot((cx, cz), data, format)
+
+    def restoreChunkSnapshot(self, snapshot):
+        '''
+        Put a chunk captured by snapshotChunk back into the level, creating the chunk if needed
+
+        :param snapshot: A snapshot returned by snapshotChunk
+        :type snapshot: pymclevel.infiniteworld.AnvilChunkData or pymclevel.infiniteworld.RawChunkSnapshot
+        '''
+        if self.readonly:
+            raise IOError("World is opened read only.")
+        cx, cz = snapshot.chunkPosition
+        if isinstance(snapshot, RawChunkSnapshot):
+            if (cx, cz) not in self._loadedChunkData:
+                # Not loaded, so the bytes can go straight into the work folder like copyChunkFrom does.
+                self.unsavedWorkFolder.getRegionForChunk(cx, cz)._saveChunk(cx, cz, snapshot.data, snapshot.format)
+                if self._allChunks is not None:
+                    self._allChunks.add((cx, cz))
+                self._bounds = None
+                self.markChunkChanged((cx, cz))
+                return
+            snapshot = AnvilChunkData(self, (cx, cz), nbt.load(buf=snapshot.savedTagData()))
+
+        if self.containsChunk(cx, cz):
+            self._getChunkData(cx, cz).restore(snapshot)
+        else:
+            chunkData = AnvilChunkData.__new__(AnvilChunkData)
+            chunkData.chunkPosition = (cx, cz)
+            chunkData.world = self
+            chunkData.restore(snapshot)
+            if self._allChunks is not None:
+                self._allChunks.add((cx, cz))
+            self._storeLoadedChunkData(chunkData)
+            self._bounds = None
+
     def markDirtyChunk(self, cx, cz):
         self.getChunk(cx, cz).chunkChanged()
 
@@ -0,0 +1,200 @@
+"""
+Stage timers for finding out where the editor spends its time.
+
+instruments.stage(name) times a block of code. instruments.iterate(name, iterator) times a generator, counting only
+the time spent inside it: the editor's work iterators yield to draw frames, and the time they are suspended is not
+theirs. Each stage keeps a rolling Histogram of its latest samples. summary() formats them for the editor's debug
+overlay and for mce.py's "timings" command.
+
+While a trace is recording, every sample is also kept as a complete ("X") event of the Chrome trace event format.
+saveTrace writes them to a JSON file that chrome://tracing and Perfetto open. Set the MCEDIT_TRACE environment
+variable to a file name to record a trace from start-up and write it on exit.
+"""
+
+import atexit
+import bisect
+import collections
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+from timeit import default_timer
+
+log = logging.getLogger(__name__)
+
+# Upper edges of Histogram.buckets, in seconds
+BUCKET_EDGES = (0.0001, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5)
+
+
+class Histogram(object):
+    """ The latest `size` samples of a stage, in seconds, and the count and total of all of them. """
+
+    def __init__(self, size=512):
+        self.samples = collections.deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def mean(self):
+        if not self.samples:
+            return 0.0
+        return sum(self.samples) / len(self.samples)
+
+    @property
+    def max(self):
+        return max(self.samples) if self.samples else 0.0
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[int(round((len(ordered) - 1) * p / 100.0))]
+
+    def buckets(self, edges=BUCKET_EDGES):
+        """ Number of samples at or below each edge and above the one before it, plus those above the last. """
+        counts = [0] * (len(edges) + 1)
+        for s in self.samples:
+            counts[bisect.bisect_left(edges, s)] += 1
+        return counts
+
+
+class Instruments(object):
+    maxTraceEvents = 1000000  # events kept while recording, about 200MB of JSON
+
+    def __init__(self):
+        self.enabled = True
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._trace = None
+        self._traceStart = 0.0
+        self._threadNames = {}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    # --- Recording ---
+
+    def record(self, name, start, duration):
+        """ Add a sample of `duration` seconds, which began at default_timer() `start`, to the stage `name`. """
+        with self._lock:
+            self._histogram(name).add(duration)
+            self._traceEvent(name, start, duration)
+
+    def _histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        return histogram
+
+    def _traceEvent(self, name, start, duration):
+        trace = self._trace
+        if trace is None or len(trace) >= self.maxTraceEvents:
+            return
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._threadNames:
+            self._threadNames[tid] = thread.name
+        trace.append({"name": name, "cat": name.split(" ", 1)[0], "ph": "X", "pid": os.getpid(), "tid": tid,
+                      "ts": (start - self._traceStart) * 1e6, "dur": duration * 1e6})
+
+    @contextmanager
+    def stage(self, name):
+        """ Time the body of a with statement as a sample of the stage `name`. """
+        if not self.enabled:
+            yield
+            return
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.record(name, start, default_timer() - start)
+
+    def iterate(self, name, iterator):
+        """
+        Yield the items of iterator, recording the time spent inside it as one sample of `name` once it is exhausted.
+        When tracing, each step is its own event, so the trace shows where the iterator was interleaved with others.
+        """
+        if not self.enabled:
+            for value in iterator:
+                yield value
+            return
+
+        it = iter(iterator)
+        total = 0.0
+        while True:
+            start = default_timer()
+            try:
+                value = it.next()
+            except StopIteration:
+                break
+            finally:
+                elapsed = default_timer() - start
+                total += elapsed
+                if self._trace is not None:
+                    with self._lock:
+                        self._traceEvent(name, start, elapsed)
+            yield value
+        with self._lock:
+            self._histogram(name).add(total)
+
+    # --- Reporting ---
+
+    def summary(self):
+        """ One line per stage, the stage with the most time in its recent samples first. """
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda (name, h): -sum(h.samples))
+            return ["{0}: {1:.2f}ms avg, {2:.2f}ms p95, {3:.2f}ms max ({4}, {5:.1f}s total)".format(
+                name, h.mean * 1000, h.percentile(95) * 1000, h.max * 1000, h.count, h.total)
+                for name, h in histograms]
+
+    # --- Chrome trace ---
+
+    @property
+    def tracing(self):
+        return self._trace is not None
+
+    def startTrace(self):
+        with self._lock:
+            self._trace = []
+            self._traceStart = default_timer()
+            self._threadNames = {}
+
+    def stopTrace(self):
+        """ Stop recording and return the trace events recorded. """
+        with self._lock:
+            events, self._trace = self._trace or [], None
+            pid = os.getpid()
+            events.extend({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": threadName}}
+                          for tid, threadName in self._threadNames.iteritems())
+        return events
+
+    def saveTrace(self, filename):
+        """ Stop recording and write the trace to filename. Returns the number of events written. """
+        events = self.stopTrace()
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        log.info("Wrote %d trace events to %s", len(events), filename)
+        return len(events)
+
+
+instruments = Instruments()
+
+
+def _saveTraceAtExit(filename):
+    if instruments.tracing:
+        instruments.saveTrace(filename)
+
+
+if os.environ.get("MCEDIT_TRACE"):
+    instruments.startTrace()
+    atexit.register(_saveTraceAtExit, os.environ["MCEDIT_TRACE"])
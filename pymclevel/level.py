@@ -16,12 +16,21 @@ import materials
 from math import floor
 from mclevelbase import ChunkMalformed, ChunkNotPresent
 import nbt
-from numpy import argmax, swapaxes, zeros, zeros_like
+from numpy import argmax, array, swapaxes, zeros, zeros_like
 import os.path
+import weakref
 import id_definitions
 
 log = getLogger(__name__)
 
+# Source of chunk generations. Values are never reused, so a generation identifies one state of one chunk, and the
+# highest generation recorded by a level tells whether anything in it changed since a caller last looked.
+_generations = itertools.count(1)
+
+
+def nextGeneration():
+    return next(_generations)
+
 
 def computeChunkHeightMap(materials, blocks, HeightMap=None):
     """Computes the HeightMap array for a chunk, which stores the lowest
@@ -146,8 +155,73 @@ class MCLevel(object):
     parentWorld = None
     world = None
 
+    changeGeneration = 0
+    _changeJournal = None
+    _journalReaders = None
+    _prunedGeneration = 0
+
     entityClass = Entity
 
+    # --- Change journal ---
+
+    def markChunkChanged(self, cPos, generation=None):
+        """ Record that the chunk at cPos changed. Chunks call this whenever they are marked dirty.
+
+        :param generation: The chunk's new generation, or None to take the next one.
+        """
+        if generation is None:
+            generation = nextGeneration()
+        if self._changeJournal is None:
+            self._changeJournal = {}
+        self._changeJournal[cPos] = generation
+        if generation > self.changeGeneration:
+            self.changeGeneration = generation
+
+    def chunksChangedSince(self, generation):
+        """ Return the positions of the chunks changed after changeGeneration had the value generation.
+
+        Entries every journal reader has read are pruned, so a caller that keeps a generation across frames must be
+        a reader itself (see readChanges).
+        """
+        if not self._changeJournal or generation >= self.changeGeneration:
+            return []
+        return [cPos for cPos, g in self._changeJournal.iteritems() if g > generation]
+
+    def advanceJournalReader(self, reader, generation):
+        """ Record that reader has read the journal up to generation, registering it if needed, and prune the
+        entries every reader has read. Readers are held weakly.
+        """
+        if self._journalReaders is None:
+            self._journalReaders = weakref.WeakKeyDictionary()
+        self._journalReaders[reader] = generation
+        self.pruneChangeJournal()
+
+    def removeJournalReader(self, reader):
+        if self._journalReaders is not None:
+            self._journalReaders.pop(reader, None)
+            self.pruneChangeJournal()
+
+    def readChanges(self, reader):
+        """ Return the chunks changed since reader last read the journal and advance it to changeGeneration. A new
+        reader starts at the current changeGeneration and reads nothing.
+        """
+        generation = self.changeGeneration
+        readers = self._journalReaders
+        changed = self.chunksChangedSince(readers[reader]) if readers is not None and reader in readers else []
+        self.advanceJournalReader(reader, generation)
+        return changed
+
+    def pruneChangeJournal(self):
+        """ Drop the entries at or before the oldest reader's generation. Without readers, nothing is dropped. """
+        if not self._journalReaders or not self._changeJournal:
+            return
+        oldest = min(self._journalReaders.itervalues())
+        if oldest <= self._prunedGeneration:
+            return
+        self._prunedGeneration = oldest
+        for cPos in [cPos for cPos, g in self._changeJournal.iteritems() if g <= oldest]:
+            del self._changeJournal[cPos]
+
     # Game version check. Stores the info found in the 'Version::Name' tag
 
     @property
@@ -628,9 +702,53 @@ class EntityLevel(MCLevel):
         return self._fakeEntities[cx, cz]
 
 
+def _readOnly(a):
+    if a is None:
+        return None
+    view = a.view()
+    view.flags.writeable = False
+    return view
+
+
+class ChunkSnapshot(object):
+    """
+    A read-only view of the blocks and light of a chunk as they were at one generation, returned by the chunk's
+    snapshot(). Code that reads a chunk over several steps while it may be edited, such as the renderer meshing it
+    between frames, sees one consistent state. The arrays are indexed [x,z,y] like the chunk's and cannot be written.
+    A chunk without light arrays gives None for them.
+
+    :ivar generation: The chunk's generation when the snapshot was taken; the snapshot is out of date once the chunk's
+        generation differs. None for chunks that do not count generations.
+    """
+
+    arrayNames = ("Blocks", "Data", "BlockLight", "SkyLight")
+    Width = Length = 16
+
+    def __init__(self, chunk, generation, arrays):
+        self.chunkPosition = chunk.chunkPosition
+        self.world = chunk.world
+        self.generation = generation
+        for name, a in zip(self.arrayNames, arrays):
+            setattr(self, name, _readOnly(a))
+
+    @property
+    def Height(self):
+        return self.Blocks.shape[2]
+
+    @property
+    def materials(self):
+        return self.world.materials
+
+    def section(self, y):
+        """ Return the (Blocks, Data, BlockLight, SkyLight) views of the 16 block high section starting at y. """
+        arrays = (getattr(self, name) for name in self.arrayNames)
+        return tuple(a if a is None else a[..., y:y + 16] for a in arrays)
+
+
 class ChunkBase(EntityLevel):
-    dirty = False
+    _dirty = False
     needsLighting = False
+    world = None
 
     chunkPosition = NotImplemented
     Blocks = Data = SkyLight = BlockLight = HeightMap = NotImplemented  # override these!
@@ -641,6 +759,17 @@ class ChunkBase(EntityLevel):
     def Height(self):
         return self.world.Height
 
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @dirty.setter
+    def dirty(self, val):
+        """ Marking the chunk dirty records it in the world's change journal. """
+        self._dirty = val
+        if val and self.world is not None:
+            self.world.markChunkChanged(self.chunkPosition)
+
     @property
     def bounds(self):
         cx, cz = self.chunkPosition
@@ -654,6 +783,12 @@ class ChunkBase(EntityLevel):
     def materials(self):
         return self.world.materials
 
+    def snapshot(self):
+        """ Return a ChunkSnapshot of the chunk's blocks and light, copied now. Chunks that can share their arrays
+        copy-on-write override this. """
+        arrays = [getattr(self, name) for name in ChunkSnapshot.arrayNames]
+        return ChunkSnapshot(self, getattr(self, "generation", None), [a if a is None else array(a) for a in arrays])
+
     def getChunkSlicesForBox(self, box):
         """
          Given a BoundingBox enclosing part of the world, return a smaller box enclosing the part of this chunk
@@ -0,0 +1,172 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Block, entity and tile entity counts for a box or a whole level, shared by the editor's Analyze command and mce.
+
+Blocks are counted with one bincount per chunk over a combined key, (data << 12) | blockID, computed in place in a
+scratch buffer that is reused for every chunk. For Anvil levels the counts of each chunk are cached, and whether they
+are still fresh is decided before the chunk is loaded: a saved chunk is keyed on its timestamp and offset in the region
+file, and a chunk with unsaved edits stays fresh until the level's change journal lists it again. Analysing the same
+box again after an edit only loads and rescans the chunks that changed since the last run.
+"""
+
+from collections import defaultdict
+import logging
+import weakref
+
+from numpy import bincount, uint16, zeros
+
+import items
+from mclevelbase import exhaust
+
+log = logging.getLogger(__name__)
+
+_analyzers = weakref.WeakKeyDictionary()
+
+
+def analyzerFor(level):
+    """ Return the LevelAnalyzer for level, keeping its chunk cache between calls. """
+    analyzer = _analyzers.get(level)
+    if analyzer is None:
+        # The analyzer only holds a proxy, or the level could never be collected from the weak dictionary.
+        analyzer = _analyzers[level] = LevelAnalyzer(weakref.proxy(level))
+    return analyzer
+
+
+class AnalysisResult(object):
+    """
+    :ivar blockCounts: Array of 65536 counts indexed by (data << 12) | blockID
+    :ivar entityCounts: {(entity id number, name): count}
+    :ivar tileEntityCounts: {tile entity id: count}
+    """
+
+    def __init__(self, box):
+        self.box = box
+        self.blockCounts = zeros(65536, 'int64')
+        self.entityCounts = defaultdict(int)
+        self.tileEntityCounts = defaultdict(int)
+        self.chunksScanned = 0
+
+    def presentBlocks(self):
+        """ Return (blockID, blockData, count) for every block type present, ordered by key. """
+        return [(int(key) & 0xfff, int(key) >> 12, int(self.blockCounts[key]))
+                for key in self.blockCounts.nonzero()[0]]
+
+
+class LevelAnalyzer(object):
+    def __init__(self, level):
+        self.level = level
+        self._cache = {}
+        self._keys = zeros(16 * 16 * level.Height, uint16)
+        self._entityNames = {}
+
+    def analyze(self, box=None):
+        return exhaust(self.analyzeIter(box))
+
+    def analyzeIter(self, box=None):
+        """
+        Count the blocks, entities and tile entities in box, or in the whole level if box is None.
+
+        :return: An iterator yielding (chunksDone, chunkCount) progress tuples, then the AnalysisResult
+        """
+        level = self.level
+        result = AnalysisResult(box)
+        cache = {}
+        cacheable = hasattr(level, "unsavedWorkFolder")
+        changed = set(level.readChanges(self)) if cacheable else ()
+
+        if box is None:
+            chunkCount = level.chunkCount
+            chunks = self._allChunkSlices()
+        else:
+            chunkCount = box.chunkCount
+            chunks = ((cPos, slices) for cPos, slices, point in level._getSlices(box) if level.containsChunk(*cPos))
+
+        for i, (cPos, slices) in enumerate(chunks, 1):
+            yield i, chunkCount
+            stamp = self._chunkStamp(*cPos) if cacheable else None
+            sliceKey = tuple((s.start, s.stop) for s in slices)
+
+            cached = self._cache.get(cPos)
+            if stamp is None or cached is None or cached[:2] != (stamp, sliceKey) or cPos in changed:
+                cached = (stamp, sliceKey, self._analyzeChunk(level.getChunk(*cPos), slices, box))
+                result.chunksScanned += 1
+            if stamp is not None:
+                cache[cPos] = cached
+
+            keys, counts, entityCounts, tileEntityCounts = cached[2]
+            result.blockCounts[keys] += counts
+            for k, v in entityCounts.iteritems():
+                result.entityCounts[k] += v
+            for k, v in tileEntityCounts.iteritems():
+                result.tileEntityCounts[k] += v
+
+        # Only keep the chunks of the latest run, so analysing a whole world does not pin its counts in memory.
+        self._cache = cache
+        log.info(u"Analyzed {0} chunks, {1} rescanned".format(chunkCount, result.chunksScanned))
+        yield result
+
+    def _allChunkSlices(self):
+        everything = (slice(None),) * 3
+        for cPos in self.level.allChunks:
+            yield cPos, everything
+
+    def _chunkStamp(self, cx, cz):
+        """
+        (timestamp, offset) of the chunk in the world's region file. A chunk with unsaved edits is stamped "unsaved":
+        its edits are all journalled, so it is fresh unless the change journal lists it.
+        """
+        level = self.level
+        chunkData = level._loadedChunkData.get((cx, cz))
+        if chunkData is not None and chunkData.dirty:
+            return "unsaved"
+        if not level.readonly and level.unsavedWorkFolder.containsChunk(cx, cz):
+            return "unsaved"
+        if not level.worldFolder.containsChunk(cx, cz):
+            return None
+        regionFile = level.worldFolder.getRegionForChunk(cx, cz)
+        return int(regionFile.getTimestamp(cx, cz)), int(regionFile.getOffset(cx, cz))
+
+    def _analyzeChunk(self, chunk, slices, box):
+        blocks = chunk.Blocks[slices]
+        key = self._keys[:blocks.size].reshape(blocks.shape)
+        key[:] = chunk.Data[slices]
+        key <<= 12
+        key |= blocks
+        counts = bincount(key.ravel())
+        present = counts.nonzero()[0]
+
+        entityCounts = defaultdict(int)
+        tileEntityCounts = defaultdict(int)
+        if box is None:
+            entities, tileEntities = chunk.Entities, chunk.TileEntities
+        else:
+            entities, tileEntities = chunk.getEntitiesInBox(box), chunk.getTileEntitiesInBox(box)
+        for ent in entities:
+            entityCounts[self._entityName(ent)] += 1
+        for ent in tileEntities:
+            tileEntityCounts[ent["id"].value] += 1
+
+        return present, counts[present], dict(entityCounts), dict(tileEntityCounts)
+
+    def _entityName(self, ent):
+        """ Return (entity id number, display name) for an entity tag. Names are looked up once per kind. """
+        entityID = ent["id"].value
+        if entityID == "Item" and "Item" in ent:
+            itemTag = ent["Item"]
+            lookupKey = entityID, itemTag["id"].value, itemTag["Damage"].value if "Damage" in itemTag else 0
+        else:
+            lookupKey = entityID,
+
+        name = self._entityNames.get(lookupKey)
+        if name is None:
+            if len(lookupKey) == 3:
+                try:
+                    v = items.items.findItem(lookupKey[1], lookupKey[2]).name + " (Item)"
+                except items.ItemNotFound:
+                    v = "Unknown Item"
+            else:
+                v = entityID
+            name = self._entityNames[lookupKey] = (self.level.entityClass.getId(entityID), v)
+        return name
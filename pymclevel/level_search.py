@@ -0,0 +1,295 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Block and NBT search helpers used by the Find filter.
+
+Block searches compare whole chunk slices with NumPy instead of reading one block at a time.
+
+Entity and tile entity searches can use a ChunkTagIndex, which records which tag names and ids appear in each
+chunk of a Java world. The index is stored in the world folder and only re-reads chunks whose region timestamp
+changed since the last search, so repeated searches over a large world only load the chunks that can match.
+"""
+
+import json
+import logging
+import os
+import time
+
+from entity import Entity, TileEntity
+from mclevelbase import ChunkNotPresent, ChunkMalformed
+import nbt
+
+log = logging.getLogger(__name__)
+
+KIND_ENTITIES = "Entities"
+KIND_TILE_ENTITIES = "TileEntities"
+
+
+def findBlocks(level, box, blockID, blockData=None):
+    """
+    Iterate over the positions in box holding the given block.
+
+    :param blockData: If not None, the block data value must also match.
+    :return: An iterator yielding ((x, y, z), data) tuples
+    """
+    for chunk, slices, point in level.getChunkSlices(box):
+        blocks = chunk.Blocks[slices]
+        mask = blocks == blockID
+        if not mask.any():
+            continue
+        data = chunk.Data[slices]
+        if blockData is not None:
+            mask &= data == blockData
+
+        cx, cz = chunk.chunkPosition
+        ox = (cx << 4) + (slices[0].start or 0)
+        oz = (cz << 4) + (slices[1].start or 0)
+        oy = slices[2].start or 0
+        for x, z, y in zip(*mask.nonzero()):
+            yield (ox + x, oy + y, oz + z), data[x, z, y]
+
+
+def tagMatches(tag, name, value, tagType=None, caseSensitive=True):
+    """
+    Return True if tag or any tag nested in it has a name containing name and a value containing value.
+    Compound and list tags only match on their name and only when value is empty.
+
+    :param tagType: A TAG_* class the matching tag must be an instance of, or None to match any type.
+    """
+    if not caseSensitive:
+        name = name.upper()
+        value = value.upper()
+
+    def fold(s):
+        s = u"%s" % s
+        return s if caseSensitive else s.upper()
+
+    stack = [tag]
+    while stack:
+        t = stack.pop()
+        if tagType is not None and type(t) is not tagType:
+            nameMatches = False
+        else:
+            nameMatches = name == "" or name in fold(t.name)
+        if isinstance(t, (nbt.TAG_Compound, nbt.TAG_List)):
+            if nameMatches and value == "":
+                return True
+            stack.extend(t.value)
+        elif nameMatches and value in fold(t.value):
+            return True
+    return False
+
+
+def _tagNames(tag, names):
+    stack = [tag]
+    while stack:
+        t = stack.pop()
+        if t.name:
+            names.add(t.name)
+        if isinstance(t, (nbt.TAG_Compound, nbt.TAG_List)):
+            stack.extend(t.value)
+
+
+class ChunkTagIndex(object):
+    """
+    Maps the tag names and ids used by the entities and tile entities of a Java world to the chunks containing them.
+
+    Entries are kept per chunk together with the chunk's region timestamp and sector offset, and per region together
+    with the region file's modification time and size, so update() only reads chunks saved since the index was last
+    written. Both times have a resolution of one second, and a batched save can write a region twice within one. A
+    region indexed during the second it was last modified is therefore checked again by the next update, and a chunk
+    whose timestamp is the region's last modified second is read again.
+    Chunks with unsaved edits are never indexed; candidateChunks() always returns them.
+    """
+    VERSION = 2
+    filename = "##MCEDIT.SEARCHINDEX##.json"
+
+    def __init__(self, level):
+        self.level = level
+        self.path = level.worldFolder.getFilePath(self.filename)
+        self.regionTimes = {}
+        self.chunks = {}
+        self._inverted = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = json.load(f)
+            if data.get("version") != self.VERSION:
+                return
+            self.regionTimes = dict((tuple(json.loads(k)), v) for k, v in data["regions"].iteritems())
+            self.chunks = dict((tuple(json.loads(k)), v) for k, v in data["chunks"].iteritems())
+        except Exception as e:
+            log.warning(u"Discarding unreadable search index {0}: {1!r}".format(self.path, e))
+            self.regionTimes = {}
+            self.chunks = {}
+
+    def save(self):
+        data = {
+            "version": self.VERSION,
+            "regions": dict((json.dumps(k), v) for k, v in self.regionTimes.iteritems()),
+            "chunks": dict((json.dumps(k), v) for k, v in self.chunks.iteritems()),
+        }
+        try:
+            with open(self.path, "wb") as f:
+                json.dump(data, f)
+        except (IOError, OSError) as e:
+            log.warning(u"Could not save search index {0}: {1!r}".format(self.path, e))
+
+    @staticmethod
+    def _chunkEntry(timestamp, offset, levelTag):
+        entry = {"t": int(timestamp), "o": int(offset)}
+        for kind in KIND_ENTITIES, KIND_TILE_ENTITIES:
+            names = set()
+            ids = set()
+            for tag in levelTag.get(kind, ()):
+                _tagNames(tag, names)
+                if "id" in tag:
+                    ids.add(tag["id"].value)
+            entry[kind] = {"names": sorted(names), "ids": sorted(ids)}
+        return entry
+
+    def updateIter(self):
+        """
+        Re-read the chunks saved since the last update. Yields (regionsDone, regionCount) progress tuples.
+
+        Region files are checked by modification time first and only opened if they changed. The index is written
+        back only if something changed and the world is not read only.
+        """
+        worldFolder = self.level.worldFolder
+        regionPaths = list(worldFolder.findRegionFiles())
+        seen = set()
+        updated = False
+        for i, path in enumerate(regionPaths):
+            rPos = worldFolder.regionCoordsForPath(path)
+            if rPos is None:
+                continue
+            seen.add(rPos)
+            st = os.stat(path)
+            stamp = [st.st_mtime, st.st_size]
+            known = self.regionTimes.get(rPos)
+            if known is not None and known[:2] == stamp and known[2]:
+                yield i, len(regionPaths)
+                continue
+
+            regionFile = worldFolder.getRegionFile(*rPos)
+            rx, rz = rPos
+            regionSecond = int(st.st_mtime)
+            changed = known is None or known[:2] != stamp
+            present = set()
+            for index, offset in enumerate(regionFile.offsets):
+                if not offset:
+                    continue
+                cPos = (index & 0x1f) + (rx << 5), (index >> 5) + (rz << 5)
+                present.add(cPos)
+                timestamp = int(regionFile.modTimes[index])
+                entry = self.chunks.get(cPos)
+                if (entry is not None and entry["t"] == timestamp and entry.get("o") == offset and
+                        timestamp != regionSecond):
+                    continue
+                try:
+                    levelTag = nbt.load(buf=regionFile.readChunk(*cPos))["Level"]
+                except Exception as e:
+                    log.debug(u"Search index skipping chunk {0}: {1!r}".format(cPos, e))
+                    if self.chunks.pop(cPos, None) is not None:
+                        changed = True
+                    continue
+                newEntry = self._chunkEntry(timestamp, offset, levelTag)
+                if newEntry != entry:
+                    self.chunks[cPos] = newEntry
+                    changed = True
+
+            for cPos in [c for c in self.chunks if (c[0] >> 5, c[1] >> 5) == rPos and c not in present]:
+                del self.chunks[cPos]
+                changed = True
+            # Settled once the region was last modified in an earlier second than this update ran in.
+            self.regionTimes[rPos] = stamp + [regionSecond < int(time.time())]
+            if changed:
+                self._inverted = None
+                updated = True
+            yield i, len(regionPaths)
+
+        for rPos in [r for r in self.regionTimes if r not in seen]:
+            del self.regionTimes[rPos]
+            for cPos in [c for c in self.chunks if (c[0] >> 5, c[1] >> 5) == rPos]:
+                del self.chunks[cPos]
+            self._inverted = None
+            updated = True
+
+        if updated and not self.level.readonly:
+            self.save()
+
+    def update(self):
+        for _ in self.updateIter():
+            pass
+
+    @property
+    def inverted(self):
+        """ {kind: {name or id: set of chunk positions}} built from the per-chunk entries. """
+        if self._inverted is None:
+            inverted = {KIND_ENTITIES: {}, KIND_TILE_ENTITIES: {}}
+            for cPos, entry in self.chunks.iteritems():
+                for kind in KIND_ENTITIES, KIND_TILE_ENTITIES:
+                    keys = inverted[kind]
+                    for key in entry[kind]["names"] + entry[kind]["ids"]:
+                        keys.setdefault(key, set()).add(cPos)
+            self._inverted = inverted
+        return self._inverted
+
+    def unsavedChunks(self):
+        level = self.level
+        unsaved = set(level.listDirtyChunks())
+        if not level.readonly:
+            unsaved.update(level.unsavedWorkFolder.listChunks())
+        return unsaved
+
+    def candidateChunks(self, box, kind, name="", caseSensitive=True):
+        """
+        Return the positions of the chunks in box that may hold an object of kind (KIND_ENTITIES or
+        KIND_TILE_ENTITIES) with a tag whose name contains name.
+        """
+        keys = self.inverted[kind]
+        if not caseSensitive:
+            name = name.upper()
+
+        candidates = set()
+        for key, positions in keys.iteritems():
+            k = key if caseSensitive else key.upper()
+            if name in k:
+                candidates.update(positions)
+
+        candidates.update(self.unsavedChunks())
+        return set(c for c in candidates
+                   if box.mincx <= c[0] < box.maxcx and box.mincz <= c[1] < box.maxcz)
+
+
+def findTags(level, box, kind, name="", value="", tagType=None, caseSensitive=True, index=None):
+    """
+    Iterate over the entities or tile entities in box with a tag matching name, value and tagType
+    (see tagMatches).
+
+    :param kind: KIND_ENTITIES or KIND_TILE_ENTITIES
+    :param index: An up to date ChunkTagIndex for level, used to skip chunks that cannot match.
+    :return: An iterator yielding (chunk, (x, y, z), tag) tuples
+    """
+    if index is not None:
+        positions = sorted(index.candidateChunks(box, kind, name, caseSensitive))
+        chunks = []
+        for cPos in positions:
+            try:
+                chunks.append(level.getChunk(*cPos))
+            except (ChunkNotPresent, ChunkMalformed):
+                continue
+    else:
+        chunks = (chunk for chunk, slices, point in level.getChunkSlices(box))
+
+    posFunc = Entity.pos if kind == KIND_ENTITIES else TileEntity.pos
+    for chunk in chunks:
+        for tag in getattr(chunk, kind):
+            pos = tuple(posFunc(tag))
+            if pos in box and tagMatches(tag, name, value, tagType, caseSensitive):
+                yield chunk, pos, tag
@@ -1500,7 +1500,6 @@ class PocketLeveldbChunkPre1(LightedChunk):
 
     _Entities = nbt.TAG_List()
     _TileEntities = nbt.TAG_List()
-    dirty = False
     version = "\x02"
 
     def __init__(self, cx, cz, world, data=None, create=False, world_version=None):
@@ -1775,7 +1774,6 @@ class PocketLeveldbChunk1Plus(LightedChunk):
 
     _Entities = nbt.TAG_List()
     _TileEntities = nbt.TAG_List()
-    dirty = False
     version = "\x03"
 
     def __init__(self, cx, cz, world, data=None, create=False, world_version=None, chunk_version=None):
@@ -8,10 +8,10 @@ from os.path import join
 from collections import defaultdict
 from pprint import pformat
 import mclangres
-import json
 import os
 import pkg_resources
 import id_definitions
+import defs_cache
 
 NOTEX = (496, 496)
 
@@ -93,11 +93,11 @@ class BlockstateAPI(object):
         if pkg_resources.resource_exists(__name__, definition_file):
             # We're running from source or on Windows using the executable (<<== Not sure...)
             with pkg_resources.resource_stream(__name__, definition_file) as def_file:
-                self.blockstates = json.load(def_file)
+                self.blockstates = defs_cache.loadJSON(def_file)[0]
         else:
             # In all other cases, retrieve the file directly from the file system.
             with open(os.path.join("pymclevel", definition_file)) as def_file:
-                self.blockstates = json.load(def_file)
+                self.blockstates = defs_cache.loadJSON(def_file)[0]
 
         self.material_map[self._mats] = self
 
@@ -263,6 +263,9 @@ class MCMaterials(object):
                                  opacity=0,
         )
 
+        # Identifies the sources loaded so far; see addJSONBlocks. None once the state can't be cached any more.
+        self._stateKey = defs_cache.sourceHash("materials", defaultName)
+
     def __repr__(self):
         return "<MCMaterials ({0})>".format(self.name)
 
@@ -381,16 +384,17 @@ class MCMaterials(object):
             log.debug("Failed to read %s using pkg_resources. Trying %s instead." % (filename, path))
 
             f = file(path)
+        sourceKey = None
         try:
             log.info(u"Loading block info from %s", f)
-            blockyaml = json.load(f)
+            blockyaml, sourceKey = defs_cache.loadJSON(f)
 
         except Exception as e:
             log.warn(u"Exception while loading block info from %s: %s", f, e)
             traceback.print_exc()
 
         if blockyaml:
-            self.addJSONBlocks(blockyaml)
+            self.addJSONBlocks(blockyaml, sourceKey)
 
     def addJSONBlocksFromVersion(self, game_version):
         # Load first the versionned stuff
@@ -421,7 +425,23 @@ class MCMaterials(object):
         meth()
 #         build_api_material_map()
 
-    def addJSONBlocks(self, blockyaml):
+    def addJSONBlocks(self, blockyaml, sourceKey=None):
+        """
+        Add the blocks defined in blockyaml.
+
+        :param sourceKey: A key identifying the content of blockyaml, as returned by defs_cache.loadJSON. When given,
+            the resulting state of this object is cached and restored instead of rebuilt the next time the same
+            sources are loaded in the same order.
+        """
+        stateKey = None
+        if sourceKey is not None and self._stateKey is not None:
+            stateKey = defs_cache.sourceHash("materials", self._stateKey, sourceKey)
+            state = defs_cache.load(stateKey)
+            if state is not None:
+                self._setState(state)
+                self._stateKey = stateKey
+                return
+
         self.yamlDatas.append(blockyaml)
         for block in blockyaml['blocks']:
             try:
@@ -431,6 +451,56 @@ class MCMaterials(object):
                 traceback.print_exc()
                 log.warn(u"Block definition: \n%s", pformat(block))
 
+        self._stateKey = stateKey
+        if stateKey is not None:
+            defs_cache.save(stateKey, self._getState())
+
+    # Attributes stored as-is in the definitions cache. Shared references between them are kept by pickle.
+    _stateAttributes = ("blockTextures", "names", "aka", "search", "type", "idStr", "lightEmission",
+                        "lightAbsorption", "flatColors", "yamlDatas")
+
+    def _getState(self):
+        blocks = []
+        index = {}
+
+        def ref(block):
+            i = index.get(id(block))
+            if i is None:
+                i = index[id(block)] = len(blocks)
+                attrs = dict(block.__dict__)
+                del attrs["materials"]
+                blocks.append(attrs)
+            return i
+
+        state = dict((name, getattr(self, name)) for name in self._stateAttributes)
+        state["Air"] = ref(self.Air)
+        state["allBlocks"] = [ref(b) for b in self.allBlocks]
+        state["blocksByID"] = dict((k, ref(b)) for k, b in self.blocksByID.iteritems())
+        state["blocksByType"] = dict((k, [ref(b) for b in v]) for k, v in self.blocksByType.iteritems())
+        state["blocks"] = blocks
+        return state
+
+    def _setState(self, state):
+        blocks = []
+        for attrs in state["blocks"]:
+            block = Block.__new__(Block)
+            block.__dict__.update(attrs)
+            block.materials = self
+            blocks.append(block)
+
+        for name in self._stateAttributes:
+            setattr(self, name, state[name])
+        self.color = self.flatColors
+        self.brightness = self.lightEmission
+        self.opacity = self.lightAbsorption
+
+        self.Air = blocks[state["Air"]]
+        self.allBlocks = [blocks[i] for i in state["allBlocks"]]
+        self.blocksByID = dict((k, blocks[i]) for k, i in state["blocksByID"].iteritems())
+        self.blocksByType = defaultdict(list)
+        for k, v in state["blocksByType"].iteritems():
+            self.blocksByType[k] = [blocks[i] for i in v]
+
     def addJSONBlock(self, kw):
         blockID = kw['id']
 
@@ -2,10 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import atexit
+import collections
+import copy
 import itertools
 import logging
 import os
 from os.path import dirname, join, basename
+import Queue
 import random
 from pymclevel import PocketLeveldbWorld
 import re
@@ -13,6 +16,7 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import urllib
 import json
@@ -612,12 +616,23 @@ class MCServerChunkGenerator(object):
 
         level.saveInPlace()
 
+    processCount = 2
+
+    def generateChunksInLevelIter_scheduled(self, level, chunks, simulate=False):
+        # Runs several servers at once, each on its own copy of the world. See ChunkGenerationScheduler.
+        workDir = os.path.join(self.worldCacheDir, self.jarStorage.checksumForVersion(self.serverVersion),
+                               str(level.RandomSeed))
+        scheduler = ChunkGenerationScheduler(self.serverCommand(self.serverJarFile), workDir,
+                                             processCount=self.processCount)
+        for p in scheduler.generateChunksInLevelIter(level, chunks, simulate):
+            yield p
+
 #     if __builtins__.get('mcenf_generateChunksInLevelIter', False):
 #         log.info("Using new MCServerChunkGenerator.generateChunksInLevelIter")
 #         generateChunksInLevelIter = generateChunksInLevelIter_new
 #     else:
 #         generateChunksInLevelIter = generateChunksInLevelIter_old
-    generateChunksInLevelIter = generateChunksInLevelIter_new
+    generateChunksInLevelIter = generateChunksInLevelIter_scheduled
 
     def runServer(self, startingDir):
         if isinstance(startingDir, unicode):
@@ -626,16 +641,23 @@ class MCServerChunkGenerator(object):
         return self._runServer(startingDir, self.serverJarFile)
 
     lowMemory = False
+    serverMemory = "1024M"
 
     @classmethod
-    def _runServer(cls, startingDir, jarfile):
-        log.info("Starting server %s in %s", jarfile, startingDir)
+    def serverCommand(cls, jarfile, memory=None):
+        """ Return the argument list used to start the server in jarfile with the given -Xmx/-Xms value. """
         if cls.lowMemory:
             memflags = []
         else:
-            memflags = ["-Xmx1024M", "-Xms1024M", ]
+            memory = memory or cls.serverMemory
+            memflags = ["-Xmx" + memory, "-Xms" + memory, ]
+        return [cls.java_exe, "-Djava.awt.headless=true"] + memflags + ["-jar", jarfile]
 
-        proc = subprocess.Popen([cls.java_exe, "-Djava.awt.headless=true"] + memflags + ["-jar", jarfile],
+    @classmethod
+    def _runServer(cls, startingDir, jarfile):
+        log.info("Starting server %s in %s", jarfile, startingDir)
+
+        proc = subprocess.Popen(cls.serverCommand(jarfile),
                                 executable=cls.java_exe,
                                 cwd=startingDir,
                                 stdin=subprocess.PIPE,
@@ -697,3 +719,227 @@ class MCServerChunkGenerator(object):
             except ValueError:
                 pass
         return version
+
+
+def planGenerationCenters(chunks, radius):
+    """
+    Return spawn positions whose (2 * radius + 1) chunk squares cover every chunk in chunks.
+
+    The cover is built greedily from the chunks themselves: the uncovered chunk with the lowest x (then z) is put on
+    the low x edge of the next square, which is slid along z to cover as many uncovered chunks as it can. Squares
+    follow the requested area instead of a fixed grid, so an area straddling grid lines needs no extra server runs
+    and disjoint areas do not pull in the space between them.
+    """
+    uncovered = set(chunks)
+    centers = []
+    for cx, cz in sorted(uncovered):
+        if (cx, cz) not in uncovered:
+            continue
+        ccx = cx + radius
+        best = []
+        for ccz in xrange(cz - radius, cz + radius + 1):
+            covered = [(x, z) for x in xrange(cx, ccx + radius + 1) for z in xrange(ccz - radius, ccz + radius + 1)
+                       if (x, z) in uncovered]
+            if len(covered) > len(best):
+                best, center = covered, (ccx, ccz)
+        uncovered.difference_update(best)
+        centers.append(center)
+    return centers
+
+
+# level.dat tags that choose the terrain generator, copied into the generator slots' worlds
+generatorTags = ("generatorName", "generatorOptions", "generatorVersion", "MapFeatures")
+
+
+def _generatorSettings(level):
+    root_tag = getattr(level, "root_tag", None)
+    if root_tag is None or "Data" not in root_tag:
+        return {}
+    data = root_tag["Data"]
+    return dict((name, data[name]) for name in generatorTags if name in data)
+
+
+class _GeneratorSlot(object):
+    """ A server folder with its own copy of the world, used by one generator process at a time. """
+
+    def __init__(self, folder, dimNo):
+        self.folder = folder
+        self.dimNo = dimNo
+        self.worldDir = os.path.join(folder, "world")
+
+    def prepare(self, level):
+        """ Set up the slot's world with the seed and generator settings of level. A world left from an earlier run
+        with other generator settings is replaced, as the chunks it holds would not match the level's. """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        settings = _generatorSettings(level)
+        values = dict((name, tag.value) for name, tag in settings.iteritems())
+        if os.path.exists(self.worldDir):
+            world = infiniteworld.MCInfdevOldLevel(self.worldDir, readonly=True)
+            try:
+                stale = dict((name, tag.value) for name, tag in _generatorSettings(world).iteritems()) != values
+            finally:
+                world.close()
+            if stale:
+                log.info(u"Replacing generator slot world {0} made with other generator settings".format(
+                    self.worldDir))
+                shutil.rmtree(self.worldDir)
+
+        if not os.path.exists(self.worldDir):
+            world = infiniteworld.MCInfdevOldLevel(self.worldDir, create=True, random_seed=level.RandomSeed)
+            data = world.root_tag["Data"]
+            for name, tag in settings.iteritems():
+                data[name] = copy.deepcopy(tag)
+            world.saveInPlace()
+            world.close()
+
+        propsFile = os.path.join(self.folder, "server.properties")
+        properties = readProperties(propsFile)
+        properties["level-name"] = "world"
+        properties["allow-nether"] = "false" if self.dimNo == 0 else "true"
+        properties["server-port"] = int(32767 + random.random() * 32700)
+        saveProperties(propsFile, properties)
+        MCServerChunkGenerator.addEULA(self.folder)
+
+    def setSpawn(self, cx, cz):
+        world = infiniteworld.MCInfdevOldLevel(self.worldDir)
+        world.setPlayerSpawnPosition((cx * 16, 64, cz * 16))
+        world.saveInPlace()
+        world.close()
+
+    def openWorld(self):
+        world = infiniteworld.MCInfdevOldLevel(self.worldDir, readonly=True)
+        if self.dimNo != 0:
+            return world, world.getDimension(self.dimNo)
+        return world, world
+
+
+class ChunkGenerationScheduler(object):
+    """
+    Generates chunks for a level by running several generator processes at the same time.
+
+    The requested chunks are covered with squares of (2 * spawnRadius + 1) chunks, one per server run. Each process
+    works in its own folder (a "slot") on its own copy of the world, seeded like the level. While some slots are
+    generating, chunks from finished slots are copied into the level and the slot is given the next square. Chunks
+    still missing after a round are planned again around themselves, up to maxRounds times.
+
+    The command is the argument list of the generator process and is run inside the slot folder. It must create the
+    world's spawn area around the spawn point in level.dat, print a line containing "INFO" and "Done" when ready,
+    and exit when it reads "stop" on stdin. MCServerChunkGenerator.serverCommand builds one for a server jar; tests
+    can pass a stub script instead.
+    """
+    spawnRadius = 8
+    maxRounds = 3
+    simulateSeconds = 8
+
+    def __init__(self, command, workDir, processCount=2):
+        self.command = command
+        self.workDir = workDir
+        self.processCount = max(1, processCount)
+
+    def generateChunks(self, level, chunks, simulate=False):
+        return exhaust(self.generateChunksInLevelIter(level, chunks, simulate))
+
+    def _runGenerator(self, slot, center, simulate, results):
+        try:
+            slot.setSpawn(*center)
+            proc = subprocess.Popen(self.command,
+                                    cwd=slot.folder,
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    universal_newlines=True,
+            )
+            MCServerChunkGenerator.processes.append(proc)
+            try:
+                for line in iter(proc.stdout.readline, ""):
+                    if "INFO" in line and "Done" in line:
+                        if simulate:
+                            time.sleep(self.simulateSeconds)
+                        proc.stdin.write("stop\n")
+                        proc.stdin.flush()
+                        break
+                    if "FAILED TO BIND" in line:
+                        proc.kill()
+                        raise RuntimeError("Server failed to bind to port!")
+                proc.communicate()
+            finally:
+                MCServerChunkGenerator.processes.remove(proc)
+            results.put((slot, center, None))
+        except Exception as e:
+            results.put((slot, center, e))
+
+    def _copyChunks(self, slot, level, remaining, center, copyChunk):
+        world, source = slot.openWorld()
+        try:
+            ccx, ccz = center
+            radius = self.spawnRadius
+            copied = []
+            for cx, cz in list(remaining):
+                if abs(cx - ccx) > radius or abs(cz - ccz) > radius:
+                    continue
+                if level.containsChunk(cx, cz):
+                    remaining.discard((cx, cz))
+                elif source.containsChunk(cx, cz):
+                    copyChunk(source, level, cx, cz)
+                    remaining.discard((cx, cz))
+                    copied.append((cx, cz))
+            return copied
+        finally:
+            world.close()
+
+    @staticmethod
+    def copyChunk(source, level, cx, cz):
+        data = source._getChunkBytes(cx, cz)
+        if isinstance(level, PocketLeveldbWorld):
+            level.saveGeneratedChunk(cx, cz, data)
+        else:
+            level.worldFolder.saveChunk(cx, cz, data)
+
+    def generateChunksInLevelIter(self, level, chunks, simulate=False):
+        remaining = set(c for c in chunks if not level.containsChunk(*c))
+        total = len(remaining)
+        slots = [_GeneratorSlot(os.path.join(self.workDir, "slot%d" % i), level.dimNo)
+                 for i in xrange(self.processCount)]
+        for slot in slots:
+            slot.prepare(level)
+
+        results = Queue.Queue()
+        rounds = 0
+        while remaining and rounds < self.maxRounds:
+            rounds += 1
+            centers = collections.deque(planGenerationCenters(remaining, self.spawnRadius))
+            if rounds > 1:
+                log.info(u"Generating {0} missing chunks again".format(len(remaining)))
+            freeSlots = list(slots)
+            running = 0
+            progress = "Generating {0} chunks with {1} processes...".format(len(remaining), len(slots))
+
+            while centers or running:
+                while centers and freeSlots:
+                    slot = freeSlots.pop()
+                    t = threading.Thread(target=self._runGenerator, args=(slot, centers.popleft(), simulate, results))
+                    t.daemon = True
+                    t.start()
+                    running += 1
+
+                try:
+                    slot, center, error = results.get(timeout=0.25)
+                except Queue.Empty:
+                    yield total - len(remaining), total, progress
+                    continue
+
+                running -= 1
+                if error is not None:
+                    log.warning(u"Generating around {0} failed: {1!r}".format(center, error))
+                else:
+                    copied = self._copyChunks(slot, level, remaining, center, self.copyChunk)
+                    log.info(u"Copied {0} chunks generated around {1}".format(len(copied), center))
+                freeSlots.append(slot)
+                yield total - len(remaining), total, progress
+
+        level._allChunks = None
+        if remaining:
+            log.warning(u"{0} chunks could not be generated.".format(len(remaining)))
+        level.saveInPlace()
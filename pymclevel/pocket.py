@@ -370,7 +370,6 @@ class PocketChunk(LightedChunk):
 
     Entities = TileEntities = property(lambda self: TAG_List())
 
-    dirty = False
     filename = "chunks.dat"
 
     def __init__(self, cx, cz, data, world):
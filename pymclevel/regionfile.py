@@ -4,6 +4,7 @@
 import logging
 import os
 import struct
+import threading
 import zlib
 
 from numpy import fromstring
@@ -25,7 +26,19 @@ def inflate(data):
 
 
 class MCRegionFile(object):
+    """
+    A region file holding up to 32x32 compressed chunks.
+
+    Writes never overwrite the sectors of a chunk that the header on disk still points to. New payloads go to free
+    sectors or the end of the file, and the offset and timestamp tables are then committed through a journal
+    (path + ".wal"): the new tables are written to the journal, then over the header, then the journal is removed.
+    A journal left by a crash is replayed when the file is next opened, so the file always holds either the old or
+    the new version of every chunk. Sectors given up by a write only become free once its header is committed.
+
+    :param durable: fsync the payloads, the journal and the header on each commit. Off for scratch folders.
+    """
     holdFileOpen = False  # if False, reopens and recloses the file on each access
+    durable = True
 
     @property
     def file(self):
@@ -45,12 +58,16 @@ class MCRegionFile(object):
     def __del__(self):
         self.close()
 
-    def __init__(self, path, regionCoords):
+    def __init__(self, path, regionCoords, durable=None):
         self.path = path
         self.regionCoords = regionCoords
         self._file = None
+        self._lock = threading.RLock()
+        if durable is not None:
+            self.durable = durable
         if not os.path.exists(path):
             open(path, "w").close()
+        self._replayJournal()
 
         with self.file as f:
 
@@ -118,6 +135,7 @@ class MCRegionFile(object):
         recovered = 0
         log.info("Beginning repairs on {file} ({chunks} chunks)".format(file=os.path.basename(self.path),
                                                                         chunks=sum(self.offsets > 0)))
+        removed = []
         rx, rz = self.regionCoords
         for index, offset in enumerate(self.offsets):
             if offset:
@@ -163,16 +181,23 @@ class MCRegionFile(object):
 
                 except Exception, e:
                     log.info("Unexpected chunk data at sector {sector} ({exc})".format(sector=sectorStart, exc=e))
-                    self.setOffset(cx, cz, 0)
+                    removed.append((cx, cz))
                     deleted += 1
 
+        # The removals and recoveries are committed together, in one journal commit.
+        emptySlots = set((cx & 0x1f, cz & 0x1f) for cx, cz in removed)
+        payloads = []
         for cPos, foundData in lostAndFound.iteritems():
             cx, cz = cPos
-            if self.getOffset(cx, cz) == 0:
+            if self.getOffset(cx, cz) == 0 or (cx & 0x1f, cz & 0x1f) in emptySlots:
                 log.info("Found chunk {found} and its slot is empty, recovering it".format(found=cPos))
-                self.saveChunk(cx, cz, foundData)
+                payloads.append((cx, cz, deflate(foundData), self.VERSION_DEFLATE))
+                emptySlots.discard((cx & 0x1f, cz & 0x1f))
                 recovered += 1
 
+        if removed or payloads:
+            self.saveChunks(payloads, removed)
+
         log.info("Repair complete. Removed {0} chunks, recovered {1} chunks, net {2}".format(deleted, recovered,
                                                                                              recovered - deleted))
 
@@ -191,7 +216,7 @@ class MCRegionFile(object):
         if sectorStart + numSectors > len(self.freeSectors):
             raise ChunkNotPresent((cx, cz))
 
-        with self.file as f:
+        with self._lock, self.file as f:
             f.seek(sectorStart * self.SECTOR_BYTES)
             data = f.read(numSectors * self.SECTOR_BYTES)
         if len(data) < 5:
@@ -231,88 +256,144 @@ class MCRegionFile(object):
             raise ChunkTooBig(e.message + " (%d uncompressed)" % len(uncompressedData))
 
     def _saveChunk(self, cx, cz, data, format):
-        cx &= 0x1f
-        cz &= 0x1f
-        offset = self.getOffset(cx, cz)
+        self.saveChunks([(cx, cz, data, format)])
 
-        sectorNumber = offset >> 8
-        sectorsAllocated = offset & 0xff
-        sectorsNeeded = (len(data) + self.CHUNK_HEADER_SIZE) / self.SECTOR_BYTES + 1
-
-        if sectorsNeeded >= 256:
-            raise ChunkTooBig("Chunk too big! %d bytes exceeds 1MB" % len(data))
-
-        if sectorNumber != 0 and sectorsAllocated >= sectorsNeeded:
-            log.debug("REGION SAVE {0},{1} rewriting {2}b".format(cx, cz, len(data)))
-            self.writeSector(sectorNumber, data, format)
-        else:
-            # we need to allocate new sectors
+    def saveChunks(self, chunks, removed=()):
+        """
+        Write several already compressed chunks at once. chunks is a list of (cx, cz, data, format) tuples.
 
-            # mark the sectors previously used for this chunk as free
-            for i in xrange(sectorNumber, sectorNumber + sectorsAllocated):
-                self.freeSectors[i] = True
+        Each payload is written to the first run of free sectors large enough to hold it, or to the end of the file,
+        in the order of the chunks' slots in the offset table. The offset and timestamp tables are then committed
+        once for the whole batch, so saving a region costs a single round of fsyncs.
 
-            runLength = 0
-            runStart = 0
+        :param removed: (cx, cz) positions whose offsets are cleared in the same commit. Their sectors are left
+            reserved, as repair() uses this for entries that may point into other chunks.
+        """
+        chunks = sorted(chunks, key=lambda c: (c[1] & 0x1f, c[0] & 0x1f))
+        if not len(chunks) and not len(removed):
+            return
+        for cx, cz, data, format in chunks:
+            if (len(data) + self.CHUNK_HEADER_SIZE) / self.SECTOR_BYTES + 1 >= 256:
+                raise ChunkTooBig("Chunk too big! %d bytes exceeds 1MB" % len(data))
+
+        now = time.time()
+        offsets = dict(((cx & 0x1f) + (cz & 0x1f) * 32, 0) for cx, cz in removed)
+        modTimes = {}
+        released = []
+        allocated = []
+        with self._lock, self.file as f:
             try:
-                runStart = self.freeSectors.index(True)
-
-                for i in xrange(runStart, len(self.freeSectors)):
-                    if runLength:
-                        if self.freeSectors[i]:
-                            runLength += 1
-                        else:
-                            runLength = 0
-                    elif self.freeSectors[i]:
-                        runStart = i
-                        runLength = 1
-
-                    if runLength >= sectorsNeeded:
-                        break
-            except ValueError:
-                pass
-
-            # we found a free space large enough
+                for cx, cz, data, format in chunks:
+                    index = (cx & 0x1f) + (cz & 0x1f) * 32
+                    sectorsNeeded = (len(data) + self.CHUNK_HEADER_SIZE) / self.SECTOR_BYTES + 1
+
+                    sectorNumber = self._allocateSectors(sectorsNeeded)
+                    allocated.append((sectorNumber, sectorsNeeded))
+                    payload = struct.pack(">IB", len(data) + 1, format) + data
+                    f.seek(sectorNumber * self.SECTOR_BYTES)
+                    f.write(payload + "\0" * (sectorsNeeded * self.SECTOR_BYTES - len(payload)))
+
+                    offset = offsets.get(index, self.offsets[index])
+                    released.append((offset >> 8, offset & 0xff))
+                    offsets[index] = sectorNumber << 8 | sectorsNeeded
+                    modTimes[index] = now
+            except:
+                self._freeSectors(allocated)
+                raise
+
+            log.debug("REGION SAVE {0} chunks, {1} sectors in file".format(len(chunks), len(self.freeSectors)))
+            self._commitTables(f, offsets, modTimes, released, allocated)
+
+    def _freeSectors(self, runs):
+        for start, count in runs:
+            self.freeSectors[start:start + count] = [True] * count
+
+    def _allocateSectors(self, sectorsNeeded):
+        """ Reserve a run of sectorsNeeded free sectors, growing the file if there is none, and return its start. """
+        freeSectors = self.freeSectors
+        runStart = runLength = 0
+        for i, free in enumerate(freeSectors):
+            if not free:
+                runLength = 0
+                continue
+            if not runLength:
+                runStart = i
+            runLength += 1
             if runLength >= sectorsNeeded:
-                log.debug("REGION SAVE {0},{1}, reusing {2}b".format(cx, cz, len(data)))
-                sectorNumber = runStart
-                self.setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
-                self.writeSector(sectorNumber, data, format)
-                self.freeSectors[sectorNumber:sectorNumber + sectorsNeeded] = [False] * sectorsNeeded
-
-            else:
-                # no free space large enough found -- we need to grow the
-                # file
-
-                log.debug("REGION SAVE {0},{1}, growing by {2}b".format(cx, cz, len(data)))
+                break
 
-                with self.file as f:
-                    f.seek(0, 2)
-                    filesize = f.tell()
+        if runLength < sectorsNeeded:
+            # Either no run is long enough or the last one reaches the end of the file; grow the file from there.
+            if not runLength:
+                runStart = len(freeSectors)
+            freeSectors += [True] * (runStart + sectorsNeeded - len(freeSectors))
 
-                    sectorNumber = len(self.freeSectors)
+        freeSectors[runStart:runStart + sectorsNeeded] = [False] * sectorsNeeded
+        return runStart
 
-                    assert sectorNumber * self.SECTOR_BYTES == filesize
+    # --- Header journal ---
 
-                    filesize += sectorsNeeded * self.SECTOR_BYTES
-                    f.truncate(filesize)
-
-                self.freeSectors += [False] * sectorsNeeded
+    @property
+    def journalPath(self):
+        return self.path + ".wal"
 
-                self.setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
-                self.writeSector(sectorNumber, data, format)
+    def _sync(self, f):
+        if self.durable:
+            f.flush()
+            os.fsync(f.fileno())
 
-        self.setTimestamp(cx, cz)
+    def _commitTables(self, f, offsets, modTimes, released=(), allocated=()):
+        """
+        Set entries of the offset and timestamp tables ({index: value}) and commit them to the open region file f
+        through the journal.
 
-    def writeSector(self, sectorNumber, data, format):
-        with self.file as f:
-            log.debug("REGION: Writing sector {0}".format(sectorNumber))
+        :param released: (start, count) runs of sectors the old entries pointed to, freed once the commit is done
+        :param allocated: (start, count) runs of sectors the new entries point to. They are freed again, and the
+            tables restored, if the commit fails before its journal is complete.
+        """
+        oldOffsets, oldModTimes = self.offsets.copy(), self.modTimes.copy()
+        for index, value in offsets.iteritems():
+            self.offsets[index] = value
+        for index, value in modTimes.iteritems():
+            self.modTimes[index] = value
+        header = self.offsets.tostring() + self.modTimes.tostring()
 
-            f.seek(sectorNumber * self.SECTOR_BYTES)
-            f.write(struct.pack(">I", len(data) + 1))  # // chunk length
-            f.write(struct.pack("B", format))  # // chunk version number
-            f.write(data)  # // chunk data
-            # f.flush()
+        try:
+            # The payloads the new tables point to must reach the disk before the tables do.
+            self._sync(f)
+            with open(self.journalPath, "wb") as journal:
+                journal.write(struct.pack(">I", zlib.crc32(header) & 0xffffffff) + header)
+                self._sync(journal)
+        except:
+            self.offsets, self.modTimes = oldOffsets, oldModTimes
+            self._freeSectors(allocated)
+            raise
+
+        # The journal is complete, so the new tables are the committed ones: if writing the header fails, the journal
+        # is replayed when the file is next opened. The released sectors stay reserved until the header is written.
+        f.seek(0)
+        f.write(header)
+        self._sync(f)
+        os.remove(self.journalPath)
+        self._freeSectors(released)
+
+    def _replayJournal(self):
+        """ Finish a header commit interrupted by a crash. A journal that was not completely written means the
+        header itself was never touched, so it is discarded. """
+        if not os.path.exists(self.journalPath):
+            return
+        with open(self.journalPath, "rb") as journal:
+            data = journal.read()
+        header = data[4:]
+        if len(header) == self.SECTOR_BYTES * 2 and struct.unpack(">I", data[:4])[0] == zlib.crc32(header) & 0xffffffff:
+            log.warning(u"Completing an interrupted header write for {0}".format(self.path))
+            with self.file as f:
+                f.seek(0)
+                f.write(header)
+                self._sync(f)
+        else:
+            log.warning(u"Discarding an incomplete header journal for {0}".format(self.path))
+        os.remove(self.journalPath)
 
     def containsChunk(self, cx, cz):
         return self.getOffset(cx, cz) != 0
@@ -325,10 +406,8 @@ class MCRegionFile(object):
     def setOffset(self, cx, cz, offset):
         cx &= 0x1f
         cz &= 0x1f
-        self.offsets[cx + cz * 32] = offset
-        with self.file as f:
-            f.seek(0)
-            f.write(self.offsets.tostring())
+        with self._lock, self.file as f:
+            self._commitTables(f, {cx + cz * 32: offset}, {})
 
     def getTimestamp(self, cx, cz):
         cx &= 0x1f
@@ -341,10 +420,8 @@ class MCRegionFile(object):
 
         cx &= 0x1f
         cz &= 0x1f
-        self.modTimes[cx + cz * 32] = timestamp
-        with self.file as f:
-            f.seek(self.SECTOR_BYTES)
-            f.write(self.modTimes.tostring())
+        with self._lock, self.file as f:
+            self._commitTables(f, {}, {cx + cz * 32: timestamp})
 
     SECTOR_BYTES = 4096
     SECTOR_INTS = SECTOR_BYTES / 4
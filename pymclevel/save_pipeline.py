@@ -0,0 +1,116 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Staged writing of an MCInfdevOldLevel's changes into its world folder, used by saveInPlaceGen.
+
+The dirty chunks held in memory are ordered by region and handed to a pool of worker threads, each of which
+serializes a chunk to NBT and deflates it. zlib releases the GIL while compressing, so the workers overlap with each
+other and with the calling thread. The calling thread acts as the region writer: it gathers the compressed chunks of
+one region and writes them with a single MCRegionFile.saveChunks call while the workers go on with the next region.
+
+Chunks that were written to the unsaved work folder during the session are moved into the world folder as the
+compressed bytes stored in the work folder's region files, without inflating and deflating them again.
+"""
+
+import collections
+import itertools
+import logging
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from instrumentation import instruments
+from mclevelbase import ChunkNotPresent
+from regionfile import MCRegionFile, deflate
+
+log = logging.getLogger(__name__)
+
+
+def _regionPos(cPos):
+    cx, cz = cPos
+    return cx >> 5, cz >> 5
+
+
+def _chunkRegion(item):
+    return _regionPos(item[0].chunkPosition)
+
+
+def _serializeAndCompress(chunkData):
+    with instruments.stage("save compress"):
+        return deflate(chunkData.savedTagData()), MCRegionFile.VERSION_DEFLATE
+
+
+def saveDirtyChunksIter(level, threads=None):
+    """
+    Write the dirty chunks of level._loadedChunkData to level.worldFolder and mark them clean.
+
+    :param threads: Number of worker threads. Defaults to the number of CPUs.
+    :return: An iterator yielding (chunksDone, chunkCount) progress tuples
+    """
+    if threads is None:
+        threads = cpu_count()
+    threads = max(1, threads)
+    window = threads * 4
+
+    chunks = sorted((c for c in level._loadedChunkData.itervalues() if c.dirty),
+                    key=lambda c: _regionPos(c.chunkPosition))
+    pool = ThreadPool(threads)
+
+    def compressed():
+        pending = collections.deque()
+        for chunkData in chunks:
+            pending.append((chunkData, pool.apply_async(_serializeAndCompress, (chunkData,))))
+            while len(pending) >= window:
+                chunkData, asyncResult = pending.popleft()
+                yield chunkData, asyncResult.get()
+        while pending:
+            chunkData, asyncResult = pending.popleft()
+            yield chunkData, asyncResult.get()
+
+    done = 0
+    try:
+        for rPos, group in itertools.groupby(compressed(), _chunkRegion):
+            written = []
+            payloads = []
+            for chunkData, (data, format) in group:
+                cx, cz = chunkData.chunkPosition
+                written.append(chunkData)
+                payloads.append((cx, cz, data, format))
+                done += 1
+                yield done, len(chunks)
+
+            with instruments.stage("save region write"):
+                level.worldFolder.getWritableRegionFile(*rPos).saveChunks(payloads)
+            for chunkData in written:
+                chunkData.dirty = False
+    finally:
+        pool.close()
+        pool.join()
+
+
+def copyWorkFolderChunksIter(level):
+    """
+    Move the chunks in level.unsavedWorkFolder that are not loaded in memory into level.worldFolder, copying their
+    compressed data as it is.
+
+    :return: An iterator yielding (chunksDone, chunkCount) progress tuples
+    """
+    source = level.unsavedWorkFolder
+    positions = sorted((cPos for cPos in source.listChunks() if cPos not in level._loadedChunkData), key=_regionPos)
+
+    done = 0
+    for rPos, group in itertools.groupby(positions, _regionPos):
+        regionFile = source.getRegionFile(*rPos)
+        payloads = []
+        for cx, cz in group:
+            done += 1
+            yield done, len(positions)
+            try:
+                data, format = regionFile._readChunk(cx, cz)
+            except ChunkNotPresent:
+                continue
+            payloads.append((cx, cz, data, format))
+
+        if payloads:
+            with instruments.stage("save region write"):
+                level.worldFolder.getWritableRegionFile(*rPos).saveChunks(payloads)
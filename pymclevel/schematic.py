@@ -7,7 +7,6 @@ Created on Jul 22, 2011
 @author: Rio
 """
 import atexit
-from contextlib import closing
 import os
 import shutil
 import zipfile
@@ -20,6 +19,7 @@ from level import MCLevel, EntityLevel
 from materials import alphaMaterials, MCMaterials, namedMaterials
 from mclevelbase import exhaust
 import nbt
+from zip_folder import ZipWorldFolder
 from numpy import array, swapaxes, uint8, zeros, resize, ndenumerate
 from release import TAG as RELEASE_TAG
 import math
@@ -669,18 +669,19 @@ class INVEditChest(MCSchematic):
 
 
 class ZipSchematic(infiniteworld.MCInfdevOldLevel):
+    """
+    A schematic stored as a zipped world folder. Region files are read from the archive in place; see
+    zip_folder.ZipWorldFolder. Edited regions and new files are kept in a temporary folder until the schematic is
+    saved.
+    """
     def __init__(self, filename, create=False):
         self.zipfilename = filename
 
         tempdir = tempfile.mktemp("schematic")
-        if create is False:
-            zf = zipfile.ZipFile(filename, allowZip64=True)
-            zf.extractall(tempdir)
-            zf.close()
-            if os.path.exists(os.path.join(tempdir, '##MCEDIT.TEMP##', 'region')):
-                shutil.move(os.path.join(tempdir, '##MCEDIT.TEMP##', 'region'), os.path.join(tempdir, 'region'))
-
-        super(ZipSchematic, self).__init__(tempdir, create, dat_name='schematic')
+        # Extracts schematic.dat and the other small files before the level reads them.
+        worldFolder = ZipWorldFolder(tempdir, None if create else filename)
+
+        super(ZipSchematic, self).__init__(tempdir, create, dat_name='schematic', worldFolder=worldFolder)
         atexit.register(shutil.rmtree, self.worldFolder.filename, True)
 
         try:
@@ -702,10 +703,18 @@ class ZipSchematic(infiniteworld.MCInfdevOldLevel):
         shutil.rmtree(self.worldFolder.filename, True)
 
     def saveInPlaceGen(self):
-        self.saveToFile(self.zipfilename)
-        yield
+        for i in self.saveToFileIter(self.zipfilename):
+            yield i
 
     def saveToFile(self, filename):
+        exhaust(self.saveToFileIter(filename))
+
+    def saveToFileIter(self, filename):
+        # Flush loaded and spilled chunks into the world folder first; regions untouched since the archive was
+        # opened are copied over as they are.
+        for i in super(ZipSchematic, self).saveInPlaceGen():
+            yield i
+
         schematicDat = nbt.TAG_Compound()
         schematicDat.name = "Mega Schematic"
 
@@ -716,18 +725,7 @@ class ZipSchematic(infiniteworld.MCInfdevOldLevel):
 
         schematicDat.save(self.worldFolder.getFilePath("schematic.dat"))
 
-        basedir = self.worldFolder.filename
-        assert os.path.isdir(basedir)
-
-        with closing(zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED, allowZip64=True)) as z:
-            for root, dirs, files in os.walk(basedir):
-                # NOTE: ignore empty directories
-                for fn in files:
-                    absfn = os.path.join(root, fn)
-                    shutil.move(absfn, absfn.replace("##MCEDIT.TEMP##" + os.sep, ""))
-                    absfn = absfn.replace("##MCEDIT.TEMP##" + os.sep, "")
-                    zfn = absfn[len(basedir) + len(os.sep):]  # XXX: relative path
-                    z.write(absfn, zfn)
+        self.worldFolder.saveArchive(filename)
 
     def getWorldBounds(self):
         return BoundingBox((0, 0, 0), (self.Width, self.Height, self.Length))
@@ -1,15 +1,27 @@
 import itertools
+import json
 import os
 import shutil
+import struct
+import time
 import unittest
+import zlib
 import numpy
 
 from pymclevel import mclevel
-from pymclevel.infiniteworld import MCInfdevOldLevel
+from pymclevel.infiniteworld import MCInfdevOldLevel, RawChunkSnapshot
 from pymclevel import nbt
+from pymclevel.regionfile import MCRegionFile, deflate
 from pymclevel.schematic import MCSchematic
 from pymclevel.box import BoundingBox
 from pymclevel import block_copy
+from pymclevel import chunk_pipeline
+from pymclevel import chunk_transplant
+from pymclevel import level_search
+from pymclevel import level_analysis
+from pymclevel import autosave
+from pymclevel import world_tiles
+from pymclevel.instrumentation import instruments
 from templevel import mktemp, TempLevel
 
 __author__ = 'Rio'
@@ -134,6 +146,48 @@ class TestAnvilLevel(unittest.TestCase):
         level.generateLights()
         level.saveInPlace()
 
+    def testSaveWorkFolderChunks(self):
+        level = self.anvilLevel.level
+        level.loadedChunkLimit = 1
+        positions = list(itertools.islice(level.allChunks, 4))
+        for cx, cz in positions:
+            chunk = level.getChunk(cx, cz)
+            chunk.Blocks[:, :, 0] = level.materials.Glass.ID
+            chunk.chunkChanged(False)
+            del chunk
+        assert level.unsavedWorkFolder.listChunks()
+
+        level.saveInPlace()
+        level.close()
+        level = MCInfdevOldLevel(level.filename)
+        for cx, cz in positions:
+            assert (level.getChunk(cx, cz).Blocks[:, :, 0] == level.materials.Glass.ID).all()
+        level.close()
+
+    def testAutosaveRecovery(self):
+        level = self.anvilLevel.level
+        service = autosave.AutosaveService(level, interval=0.001, frameBudget=10)
+        cx, cz = level.allChunks.next()
+        chunk = level.getChunk(cx, cz)
+        chunk.Blocks[:, :, 0] = level.materials.Glass.ID
+        chunk.chunkChanged(False)
+        del chunk
+
+        time.sleep(0.01)
+        service.tick()
+        service.stop(discard=False)
+
+        # Closing without saving or stopping the service the usual way leaves the store, as a crash would.
+        level.close()
+        level = MCInfdevOldLevel(level.filename)
+        assert autosave.hasUnsavedChunks(level)
+        assert autosave.recoverUnsavedChunks(level) == 1
+        assert (level.getChunk(cx, cz).Blocks[:, :, 0] == level.materials.Glass.ID).all()
+
+        autosave.discardUnsavedChunks(level)
+        assert not autosave.hasUnsavedChunks(level)
+        level.close()
+
     def testRecompress(self):
         level = self.anvilLevel.level
         cx, cz = level.allChunks.next()
@@ -155,6 +209,340 @@ class TestAnvilLevel(unittest.TestCase):
             for key in keys:
                 assert (d[key] == getattr(ch, key)).all()
 
+    def testRegionHeaderJournal(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        regionFile = level.worldFolder.getRegionForChunk(cx, cz)
+        data = regionFile.readChunk(cx, cz)
+        regionFile.saveChunk(cx, cz, data)
+        assert regionFile.readChunk(cx, cz) == data
+        assert not os.path.exists(regionFile.journalPath)
+
+        # A commit interrupted after its journal was written is completed when the file is opened again.
+        offsets = regionFile.offsets.copy()
+        offsets[(cx & 0x1f) + (cz & 0x1f) * 32] = 0
+        header = offsets.tostring() + regionFile.modTimes.tostring()
+        with open(regionFile.journalPath, "wb") as f:
+            f.write(struct.pack(">I", zlib.crc32(header) & 0xffffffff) + header)
+        assert not MCRegionFile(regionFile.path, regionFile.regionCoords).containsChunk(cx, cz)
+        assert not os.path.exists(regionFile.journalPath)
+
+        # A journal that was only partly written is dropped.
+        with open(regionFile.journalPath, "wb") as f:
+            f.write(header[:100])
+        regionFile = MCRegionFile(regionFile.path, regionFile.regionCoords)
+        assert not regionFile.containsChunk(cx, cz)
+        assert not os.path.exists(regionFile.journalPath)
+
+    def testRegionFailedBatch(self):
+        class FailingPayload(str):
+            def __radd__(self, other):
+                raise IOError("No space left on device")
+
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        regionFile = level.worldFolder.getRegionForChunk(cx, cz)
+        data = regionFile.readChunk(cx, cz)
+        offsets = regionFile.offsets.copy()
+        freeSectors = list(regionFile.freeSectors)
+
+        # A batch failing after some of its payloads were written leaves the tables and free sectors as they were,
+        other = (cx & ~0x1f) + ((cx + 1) & 0x1f), cz
+        batch = [(cx, cz, deflate(data), MCRegionFile.VERSION_DEFLATE),
+                 (other[0], other[1], FailingPayload("x" * 100), MCRegionFile.VERSION_DEFLATE)]
+        self.assertRaises(IOError, regionFile.saveChunks, batch)
+        assert (regionFile.offsets == offsets).all()
+        assert regionFile.freeSectors[:len(freeSectors)] == freeSectors
+        assert all(regionFile.freeSectors[len(freeSectors):])
+
+        # and the chunk's sectors are not handed out to the next write.
+        regionFile.saveChunk(other[0], other[1], data)
+        assert regionFile.readChunk(cx, cz) == data
+
+    def testChunkSnapshot(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+
+        ch = level.getChunk(cx, cz)
+        blocks = ch.Blocks
+        oldBlocks = numpy.array(blocks)
+        snapshot = level.snapshotChunk(cx, cz)
+        # Shared arrays cost the snapshot nothing until the chunk accesses them again.
+        assert snapshot.copiedBytes == 0
+        ch.Blocks[:] = 1
+        ch.dirty = True
+        assert snapshot.copiedBytes == snapshot.nbytes
+
+        # The chunk keeps its arrays, so writes through a reference taken before the snapshot are not lost.
+        blocks[..., 0] = 3
+        assert ch.Blocks is blocks
+        assert (ch.Blocks[..., 0] == 3).all()
+
+        assert (snapshot.Blocks == oldBlocks).all()
+        level.restoreChunkSnapshot(snapshot)
+        assert (level.getChunk(cx, cz).Blocks == oldBlocks).all()
+
+        level.getChunk(cx, cz).Blocks[:] = 2
+        assert (snapshot.Blocks == oldBlocks).all()
+
+        # A chunk that is not loaded is captured as its compressed bytes.
+        cx, cz = next(cPos for cPos in level.allChunks if cPos not in level._loadedChunkData)
+        snapshot = level.snapshotChunk(cx, cz)
+        assert isinstance(snapshot, RawChunkSnapshot)
+        assert (cx, cz) not in level._loadedChunkData
+        ch = level.getChunk(cx, cz)
+        oldBlocks = numpy.array(ch.Blocks)
+        ch.Blocks[:] = 1
+        ch.chunkChanged()
+        level.restoreChunkSnapshot(snapshot)
+        assert (level.getChunk(cx, cz).Blocks == oldBlocks).all()
+
+    def testChangeJournal(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        generation = level.changeGeneration
+        assert level.chunksChangedSince(generation) == []
+
+        level.getChunk(cx, cz).chunkChanged()
+        assert level.chunksChangedSince(generation) == [(cx, cz)]
+        assert level.changeGeneration == level.getChunk(cx, cz).generation
+        assert level.chunksChangedSince(level.changeGeneration) == []
+
+        # Entries are kept until every reader has read them.
+        class Reader(object):
+            pass
+
+        first, second = Reader(), Reader()
+        level.advanceJournalReader(first, generation)
+        level.advanceJournalReader(second, generation)
+        assert level.readChanges(first) == [(cx, cz)]
+        assert level.readChanges(first) == []
+        assert level._changeJournal
+        assert level.readChanges(second) == [(cx, cz)]
+        assert not level._changeJournal
+
+    def testWorkFolderReloadUnjournalled(self):
+        level = self.anvilLevel.level
+        level.loadedChunkLimit = 1
+        positions = list(itertools.islice(level.allChunks, 4))
+        for cx, cz in positions:
+            chunk = level.getChunk(cx, cz)
+            chunk.Blocks[:, :, 0] = level.materials.Glass.ID
+            chunk.chunkChanged(False)
+            del chunk
+        assert level.unsavedWorkFolder.listChunks()
+
+        generation = level.changeGeneration
+        for cx, cz in positions:
+            chunk = level.getChunk(cx, cz)
+            assert chunk.dirty
+            del chunk
+        assert level.changeGeneration == generation
+        assert level.chunksChangedSince(generation) == []
+
+    def testChunkPipeline(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        box = BoundingBox((cx * 16, 0, cz * 16), (32, 64, 32))
+
+        class StoneFilter(object):
+            @staticmethod
+            def performChunk(level, chunk, slices, point, options):
+                chunk.Blocks[slices] = options["ID"]
+                return chunk.chunkPosition
+
+            @staticmethod
+            def reduceChunks(level, box, options, results):
+                options["Results"] = results
+
+        options = {"ID": level.materials.Stone.ID}
+        chunk_pipeline.performChunkFilters(level, box, [(StoneFilter, options)], threads=2)
+
+        assert (level.getChunk(cx, cz).Blocks[:, :, 0:64] == level.materials.Stone.ID).all()
+        assert options["Results"] == [cPos for cPos, slices, point in level._getSlices(box)
+                                      if level.containsChunk(*cPos)]
+
+    def testFindBlocks(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        box = BoundingBox((cx * 16, 0, cz * 16), (16, level.Height, 16))
+
+        level.fillBlocks(box, level.materials.Stone)
+        level.setBlockAt(cx * 16 + 3, 70, cz * 16 + 5, level.materials.Glass.ID)
+
+        found = list(level_search.findBlocks(level, box, level.materials.Glass.ID))
+        assert [pos for pos, data in found] == [(cx * 16 + 3, 70, cz * 16 + 5)]
+
+    def testChunkTagIndex(self):
+        level = self.anvilLevel.level
+        index = level_search.ChunkTagIndex(level)
+        index.update()
+
+        box = level.bounds
+        found = list(level_search.findTags(level, box, level_search.KIND_ENTITIES, "id"))
+        indexed = list(level_search.findTags(level, box, level_search.KIND_ENTITIES, "id", index=index))
+        assert len(found) == len(indexed)
+
+        index = level_search.ChunkTagIndex(level)
+        assert index.chunks
+
+        # Nothing changed since, so updating again does not write the index.
+        os.remove(index.path)
+        index.update()
+        assert not os.path.exists(index.path)
+
+        # A chunk saved in the second its region was last modified is read again while that region is not settled,
+        # since it may have been rewritten within the second after it was indexed.
+        cx, cz = next(iter(index.chunks))
+        rx, rz = cx >> 5, cz >> 5
+        second = int(time.time()) - 10
+        level.worldFolder.getRegionFile(rx, rz).setTimestamp(cx, cz, second)
+        regionPath = level.worldFolder.getRegionFilename(rx, rz)
+        os.utime(regionPath, (second, second))
+        index.update()
+        entry = index.chunks[cx, cz]
+        assert entry["t"] == second
+
+        index.chunks[cx, cz] = dict(entry, **{level_search.KIND_ENTITIES: {"names": ["Stale"], "ids": []}})
+        index.regionTimes[rx, rz][2] = False
+        index.update()
+        assert index.chunks[cx, cz] == entry
+        assert index.regionTimes[rx, rz][2]
+
+    def testWorldTiles(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        rx, rz = cx >> 5, cz >> 5
+        pyramid = world_tiles.TilePyramid(level)
+        heights, tops, sides = pyramid.chunkTile(cx, cz)
+        chunk = level.getChunk(cx, cz)
+        top = numpy.clip(numpy.swapaxes(chunk.HeightMap, 0, 1) - 1, 0, level.Height - 1)
+        assert ((heights == top) | (heights == -1)).all()
+
+        for _ in pyramid.updateRegionIter(rx, rz):
+            pass
+        heights1 = pyramid.regionTile(rx, rz)[0]
+        assert heights1.shape == (512 // world_tiles.REGION_STEP,) * 2
+        x, z = (cx & 0x1f) * 4, (cz & 0x1f) * 4
+        assert (heights1[x:x + 4, z:z + 4] >= 0).any() == (heights >= 0).any()
+
+        pyramid = world_tiles.TilePyramid(level)
+        assert pyramid.regionIsCurrent(rx, rz)
+        assert (pyramid.chunkTile(cx, cz)[0] == heights).all()
+
+        chunk.chunkChanged()
+        assert not world_tiles.TilePyramid(level).regionIsCurrent(rx, rz)
+
+    def testChunkViewSnapshot(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        chunk = level.getChunk(cx, cz)
+        snapshot = chunk.snapshot()
+        assert snapshot is chunk.snapshot()
+        assert snapshot.generation == chunk.generation
+        assert not snapshot.Blocks.flags.writeable
+        blocks = numpy.array(snapshot.Blocks)
+
+        chunk.Blocks[:] = level.materials.Stone.ID
+        chunk.chunkChanged()
+        assert (snapshot.Blocks == blocks).all()
+        assert snapshot.generation != chunk.generation
+        assert chunk.snapshot() is not snapshot
+        assert (chunk.snapshot().section(0)[0] == level.materials.Stone.ID).all()
+
+        # Writes through a reference to the chunk's arrays do not show in a snapshot taken afterwards.
+        blocks = chunk.Blocks
+        view = chunk.snapshot()
+        blocks[:] = level.materials.Air.ID
+        assert (view.Blocks == level.materials.Stone.ID).all()
+
+        # Reading the live arrays keeps the snapshot; marking the chunk changed replaces it.
+        chunk.Blocks
+        assert chunk.snapshot() is view
+        chunk.chunkChanged()
+        assert (chunk.snapshot().Blocks == level.materials.Air.ID).all()
+
+    def testInstrumentation(self):
+        level = self.anvilLevel.level
+        instruments.reset()
+        instruments.startTrace()
+        for cPos in itertools.islice(level.allChunks, 4):
+            level.getChunk(*cPos).chunkChanged()
+        level.saveInPlace()
+
+        filename = mktemp("trace.json")
+        count = instruments.saveTrace(filename)
+        with open(filename) as f:
+            events = json.load(f)["traceEvents"]
+        os.unlink(filename)
+
+        assert len(events) == count
+        names = set(e["name"] for e in events if e["ph"] == "X")
+        assert set(["chunk load", "nbt parse", "save compress", "save chunks"]) <= names
+        assert instruments.histograms["chunk load"].count >= 4
+        assert sum(instruments.histograms["save compress"].buckets()) == 4
+        assert not instruments.tracing
+
+    def testAnalyzeBox(self):
+        level = self.anvilLevel.level
+        # Fewer loaded chunks than the box holds, so the cache must not rely on chunks staying loaded.
+        level.loadedChunkLimit = 1
+        box = level.bounds
+        analyzer = level_analysis.analyzerFor(level)
+        first = analyzer.analyze(box)
+        assert first.blockCounts.sum() == sum(chunk.Blocks[slices].size
+                                              for chunk, slices, point in level.getChunkSlices(box))
+
+        cx, cz = level.allChunks.next()
+        chunk = level.getChunk(cx, cz)
+        chunk.Blocks[:, :, 0] = level.materials.Stone.ID
+        chunk.Data[:, :, 0] = 0
+        chunk.chunkChanged()
+        del chunk
+
+        result = analyzer.analyze(box)
+        assert result.chunksScanned == 1
+        fresh = level_analysis.LevelAnalyzer(level).analyze(box)
+        assert (result.blockCounts == fresh.blockCounts).all()
+        assert analyzer.analyze(box).chunksScanned == 0
+
+    def testTransplantChunks(self):
+        level = self.anvilLevel.level
+        cx, cz = level.allChunks.next()
+        box = BoundingBox((cx * 16, 0, cz * 16), (32, level.Height, 32))
+        destPoint = (box.minx + 64, 0, box.minz - 32)
+
+        temppath = mktemp("AnvilTransplant")
+        newLevel = MCInfdevOldLevel(filename=temppath, create=True)
+        assert chunk_transplant.canTransplant(newLevel, level, box, destPoint, biomes=True)
+        generation = newLevel.changeGeneration
+        newLevel.copyBlocksFrom(level, box, destPoint, create=True, biomes=True)
+        changed = set(newLevel.chunksChangedSince(generation))
+
+        for scx, scz in box.chunkPositions:
+            if not level.containsChunk(scx, scz):
+                continue
+            assert (scx + 4, scz - 2) in changed
+            dest = newLevel.getChunk(scx + 4, scz - 2)
+            assert dest.root_tag["Level"]["xPos"].value == scx + 4
+            assert (dest.Blocks == level.getChunk(scx, scz).Blocks).all()
+
+        # Without biomes, the destination chunks keep their own.
+        scx, scz = next(cPos for cPos in box.chunkPositions if level.containsChunk(*cPos))
+        dest = newLevel.getChunk(scx + 4, scz - 2)
+        dest.root_tag["Level"]["Biomes"].value[:] = 7
+        dest.chunkChanged()
+        del dest
+        assert chunk_transplant.canTransplant(newLevel, level, box, destPoint, biomes=False)
+        newLevel.copyBlocksFrom(level, box, destPoint, biomes=False)
+        dest = newLevel.getChunk(scx + 4, scz - 2)
+        assert (dest.root_tag["Level"]["Biomes"].value == 7).all()
+        assert (dest.Blocks == level.getChunk(scx, scz).Blocks).all()
+        del dest
+
+        newLevel.close()
+        shutil.rmtree(temppath)
+
     def testPlayerSpawn(self):
         level = self.anvilLevel.level
 
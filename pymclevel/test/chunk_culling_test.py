@@ -0,0 +1,73 @@
+import unittest
+
+from chunk_culling import ChunkDrawSet, UNSECTIONED
+
+
+class HalfFrustum(object):
+    """ Sees only the spheres centred at a positive x. """
+
+    @staticmethod
+    def visible(points, radius):
+        return points[:, 0] > 0
+
+
+class FakeChunkRenderer(object):
+    def __init__(self, chunkPosition, lists=None, tops=None, surface=(0, 0)):
+        self.chunkPosition = chunkPosition
+        self.renderstateLists = {"blocks": lists} if lists else None
+        self.renderstateTops = {"blocks": tops or [UNSECTIONED] * len(lists or ())}
+        self.geometryRange = (0, 256)
+        self.surfaceMin, self.surfaceMax = surface
+
+
+def drawSet(renderers):
+    return ChunkDrawSet(dict((cr.chunkPosition, cr) for cr in renderers))
+
+
+def drawnLists(drawSet, frustum, cameraY=0):
+    return sorted(drawSet.visibleLists(frustum, cameraY).get("blocks", ()))
+
+
+class TestChunkDrawSet(unittest.TestCase):
+    def testEmpty(self):
+        empty = drawSet([FakeChunkRenderer((0, 0))])
+        assert empty.count == 0
+        assert empty.visibleLists(None, 0) == {}
+
+    def testFrustum(self):
+        # Chunks in four regions; the one at x = -1 is alone in its region.
+        chunks = drawSet([FakeChunkRenderer(cPos, [i]) for i, cPos in
+                          enumerate([(-1, 0), (0, 0), (5, 3), (40, 0), (-40, 0)])])
+        assert chunks.count == 5
+        assert chunks.visibleMask(None).all()
+        assert drawnLists(chunks, None) == [0, 1, 2, 3, 4]
+        assert drawnLists(chunks, HalfFrustum()) == [1, 2, 3]
+
+    def testListsKeptWhileViewUnchanged(self):
+        chunks = drawSet([FakeChunkRenderer((0, 0), [1]), FakeChunkRenderer((-1, 0), [2])])
+        lists = chunks.visibleLists(HalfFrustum(), 0)
+        assert chunks.visibleLists(HalfFrustum(), 0) is lists
+        assert chunks.visibleLists(None, 0) is not lists
+        assert drawnLists(chunks, None) == [1, 2]
+
+    def testOcclusionHint(self):
+        # The lower list lies under the cover of the chunk and of all its neighbours.
+        surface = (64, 72)
+        renderers = [FakeChunkRenderer((0, 0), [10, 11], [32, 96], surface)]
+        renderers += [FakeChunkRenderer((dx, dz), surface=surface)
+                      for dx in (-1, 0, 1) for dz in (-1, 0, 1) if dx or dz]
+        chunks = drawSet(renderers)
+        assert drawnLists(chunks, None, 100) == [11]
+        assert drawnLists(chunks, None, 72) == [11]
+        assert drawnLists(chunks, None, 70) == [10, 11]
+
+        # A neighbour without a cover turns the hint off.
+        chunks = drawSet(renderers[:-1])
+        assert drawnLists(chunks, None, 100) == [10, 11]
+
+    def testUnsectionedListsAlwaysDrawn(self):
+        surface = (64, 72)
+        renderers = [FakeChunkRenderer((0, 0), [10, 11], [32, UNSECTIONED], surface)]
+        renderers += [FakeChunkRenderer((dx, dz), surface=surface)
+                      for dx in (-1, 0, 1) for dz in (-1, 0, 1) if dx or dz]
+        assert drawnLists(drawSet(renderers), None, 100) == [11]
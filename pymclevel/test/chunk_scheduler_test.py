@@ -0,0 +1,70 @@
+import unittest
+
+import numpy
+
+from chunk_scheduler import ChunkScheduler
+
+
+class HalfFrustum(object):
+    """ Sees only the chunks with positive x. """
+
+    planes = numpy.array([[1.0, 0.0, 0.0, 0.0]])
+
+    @staticmethod
+    def visible(points, radius):
+        return points[:, 0] > 0
+
+
+class TestChunkScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = ChunkScheduler()
+        self.positions = [(x, z) for x in range(-8, 8) for z in range(-8, 8)]
+
+    def testPopClosestFirst(self):
+        scheduler = self.scheduler
+        scheduler.pending.reset(self.positions)
+        popped = [scheduler.pending.pop() for _ in range(len(self.positions))]
+        distances = [scheduler.distance(cPos) for cPos in popped]
+        assert distances == sorted(distances)
+        assert scheduler.pending.pop() is None
+
+    def testPopAfterCameraMove(self):
+        scheduler = self.scheduler
+        queue = scheduler.pending
+        queue.reset(self.positions)
+        queue.pop()
+
+        # Every entry was keyed around the origin; the closest chunk is now in a far corner.
+        scheduler.setCamera((-120.0, -120.0), None)
+        popped = [queue.pop() for _ in range(10)]
+        distances = [scheduler.distance(cPos) for cPos in popped]
+        assert popped[0] == (-8, -8)
+        assert distances == sorted(distances)
+
+        queue.push((-9, -9))
+        assert queue.pop() == (-9, -9)
+
+    def testHiddenChunksStayQueued(self):
+        scheduler = self.scheduler
+        queue = scheduler.pending
+        queue.reset([(-2, 0), (-1, 0)])
+        scheduler.setCamera((0.0, 0.0), HalfFrustum())
+        assert queue.pop() is None
+        assert len(queue) == 2
+
+        queue.push((3, 0))
+        assert queue.pop() == (3, 0)
+
+    def testFarthestLoadedAfterCameraMove(self):
+        scheduler = self.scheduler
+        for cPos in self.positions:
+            scheduler.addLoaded(cPos)
+        assert scheduler.farthestLoaded()[0] == (-8, -8)
+
+        scheduler.setCamera((-120.0, -120.0), None)
+        cPos, distance = scheduler.farthestLoaded()
+        assert cPos == (7, 7)
+        assert distance == max(scheduler.distance(p) for p in self.positions)
+
+        scheduler.forgetLoaded((7, 7))
+        assert scheduler.farthestLoaded()[0] in ((6, 7), (7, 6))
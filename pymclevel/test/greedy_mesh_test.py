@@ -0,0 +1,90 @@
+import unittest
+
+import numpy
+
+import greedy_mesh
+
+
+def gridQuads(heights):
+    """ One unit quad per cell of a 2D height grid, (cells, 4, 3) with vertices x, y, z, and the cell of each. """
+    cellX, cellZ = numpy.indices(heights.shape)
+    cellX, cellZ = cellX.ravel(), cellZ.ravel()
+    quads = numpy.zeros((len(cellX), 4, 3), numpy.float32)
+    for i, (dx, dz) in enumerate(((0, 0), (1, 0), (1, 1), (0, 1))):
+        quads[:, i, 0] = cellX + dx
+        quads[:, i, 1] = heights[cellX, cellZ]
+        quads[:, i, 2] = cellZ + dz
+    return quads, cellX, cellZ
+
+
+class TestGreedyMesh(unittest.TestCase):
+    def checkCover(self, keys, mask, rects):
+        """ The rectangles cover each masked cell exactly once, and nothing else, each with a single key. """
+        covered = numpy.zeros(keys.shape, 'int32')
+        for x, z, w, l in rects:
+            assert w > 0 and l > 0
+            assert len(numpy.unique(keys[x:x + w, z:z + l])) == 1
+            covered[x:x + w, z:z + l] += 1
+        assert (covered == mask).all()
+
+    def testUniformGrid(self):
+        keys = numpy.zeros((16, 16), 'int32')
+        mask = numpy.ones((16, 16), bool)
+        assert greedy_mesh.greedyRectangles(keys, mask) == [(0, 0, 16, 16)]
+
+    def testKeysAndHoles(self):
+        keys = numpy.zeros((16, 16), 'int32')
+        keys[4:9, 2:12] = 1
+        keys[12:, :] = 2
+        mask = numpy.ones((16, 16), bool)
+        mask[0, 0] = mask[7, 7] = mask[15, 15] = False
+        rects = greedy_mesh.greedyRectangles(keys, mask)
+        self.checkCover(keys, mask, rects)
+        assert len(rects) < mask.sum() / 4
+
+        assert greedy_mesh.greedyRectangles(keys, numpy.zeros((16, 16), bool)) == []
+
+    def testRandomGrids(self):
+        random = numpy.random.RandomState(0)
+        for _ in range(20):
+            keys = random.randint(0, 3, (16, 16))
+            mask = random.rand(16, 16) > 0.2
+            self.checkCover(keys, mask, greedy_mesh.greedyRectangles(keys, mask))
+
+    def testMergeGridQuads(self):
+        heights = numpy.zeros((16, 16), 'int32')
+        heights[:8, :] = 64
+        heights[8:, :] = 70
+        heights[3, 5] = 80
+        quads, cellX, cellZ = gridQuads(heights)
+        keys = heights[cellX, cellZ]
+
+        merged = greedy_mesh.mergeGridQuads(quads, cellX, cellZ, keys, heights.shape)
+        assert merged.dtype == quads.dtype
+        assert len(merged) < len(quads)
+
+        # The merged quads tile the grid, each at the height of the cells it covers.
+        covered = numpy.zeros(heights.shape, 'int32')
+        for quad in merged:
+            x0, x1 = int(quad[:, 0].min()), int(quad[:, 0].max())
+            z0, z1 = int(quad[:, 2].min()), int(quad[:, 2].max())
+            assert (heights[x0:x1, z0:z1] == quad[0, 1]).all()
+            covered[x0:x1, z0:z1] += 1
+        assert (covered == 1).all()
+
+    def testMergeSparseQuads(self):
+        heights = numpy.zeros((4, 4), 'int32')
+        quads, cellX, cellZ = gridQuads(heights)
+        keep = (cellX + cellZ) % 2 == 0  # a checkerboard has nothing to merge
+        merged = greedy_mesh.mergeGridQuads(quads[keep], cellX[keep], cellZ[keep], heights[cellX, cellZ][keep],
+                                            heights.shape)
+        assert len(merged) == keep.sum()
+        assert sorted(map(tuple, merged[:, 0].tolist())) == sorted(map(tuple, quads[keep][:, 0].tolist()))
+
+        empty = quads[:0]
+        assert len(greedy_mesh.mergeGridQuads(empty, cellX[:0], cellZ[:0], heights.ravel()[:0], heights.shape)) == 0
+
+    def testExposedColumns(self):
+        heights = numpy.array([[64, 64], [70, 60]])
+        depths = numpy.array([[60, 64], [64, 60]])
+        assert greedy_mesh.exposedColumns(heights, depths).tolist() == [[True, False], [True, False]]
@@ -1,9 +1,11 @@
 import itertools
 import os
 import unittest
+import zipfile
 from pymclevel import mclevel
 from templevel import TempLevel, mktemp
-from pymclevel.schematic import MCSchematic
+from pymclevel.schematic import MCSchematic, ZipSchematic
+from pymclevel.clipboard import ClipboardStore
 from pymclevel.box import BoundingBox
 
 __author__ = 'Rio'
@@ -71,6 +73,99 @@ class TestSchematics(unittest.TestCase):
         zs.close()
         os.remove(zs.filename)
 
+    def testZipSchematicInPlace(self):
+        level = self.anvilLevel.level
+        box = BoundingBox(level.bounds.origin, (64, 64, 64))
+        zs = level.extractZipSchematic(box)
+        zs.close()
+
+        zs = ZipSchematic(zs.zipfilename)
+        regionDir = zs.worldFolder.getFolderPath("region", False)
+        assert not os.listdir(regionDir)
+        assert zs.chunkCount == box.chunkCount
+
+        # Saving without region edits updates the archive in place and leaves the region members where they are.
+        def regionOffsets():
+            with zipfile.ZipFile(zs.zipfilename) as z:
+                return dict((info.filename, info.header_offset) for info in z.infolist()
+                            if info.filename.startswith("region/"))
+
+        offsets = regionOffsets()
+        size = os.path.getsize(zs.zipfilename)
+        zs.saveInPlace()
+        assert regionOffsets() == offsets
+        assert os.path.getsize(zs.zipfilename) > size
+        assert zs.chunkCount == box.chunkCount
+
+        cx, cz = iter(zs.allChunks).next()
+        chunk = zs.getChunk(cx, cz)
+        chunk.Blocks[:] = 1
+        chunk.chunkChanged()
+        zs.saveInPlace()
+        assert not os.listdir(regionDir)
+        zs.close()
+
+        zs = ZipSchematic(zs.zipfilename)
+        assert (zs.getChunk(cx, cz).Blocks == 1).all()
+        assert zs.chunkCount == box.chunkCount
+        zs.close()
+        os.remove(zs.zipfilename)
+
+    def testClipboardStore(self):
+        level = self.anvilLevel.level
+        box = BoundingBox(level.bounds.origin, (21, 40, 19))
+        schematic = level.extractSchematic(box)
+        schematic.rotateLeft()
+        blocks = schematic.Blocks.copy()
+        data = schematic.Data.copy()
+        tileEntityCount = len(schematic.TileEntities)
+
+        store = ClipboardStore(memoryLimit=0, folder=mktemp("clipboard"))
+        entry = store.add(schematic)
+        other = store.add(MCSchematic(shape=(4, 4, 4)))
+        assert not entry.resident
+        assert other.resident
+        assert entry.size == schematic.size
+
+        # Looking at a spilled entry neither loads it for good nor reorders the store.
+        peeked = entry.peekSchematic()
+        assert (peeked.Blocks == blocks).all()
+        assert not entry.resident and other.resident
+
+        restored = entry.schematic
+        assert restored is not schematic
+        assert (restored.Blocks == blocks).all()
+        assert (restored.Data == data).all()
+        assert len(restored.TileEntities) == tileEntityCount
+        assert entry.resident and not other.resident
+
+        store.remove(entry)
+        assert not os.path.exists(entry.folder)
+        store.clear()
+        assert len(store) == 0
+
+    def testClipboardStoreZipSchematic(self):
+        level = self.anvilLevel.level
+        box = BoundingBox(level.bounds.origin, (32, 64, 32))
+        zs = level.extractZipSchematic(box)
+        cx, cz = iter(zs.allChunks).next()
+        chunk = zs.getChunk(cx, cz)
+        chunk.Blocks[:] = 1
+        chunk.chunkChanged()
+        del chunk
+
+        store = ClipboardStore(memoryLimit=0, folder=mktemp("clipboard"))
+        entry = store.add(zs)
+        assert entry.residentBytes == zs.loadedChunkBytes > 0
+
+        # Spilling unloads the chunk data but keeps the schematic, and the edit is read back from the work folder.
+        store.add(MCSchematic(shape=(4, 4, 4)))
+        assert entry.residentBytes == 0
+        assert entry.resident
+        assert (entry.peekSchematic().getChunk(cx, cz).Blocks == 1).all()
+
+        store.clear()
+
     def testINVEditChests(self):
         invFile = mclevel.fromFile("schematics/Chests/TinkerersBox.inv")
         assert invFile.Blocks.any()
@@ -1,6 +1,10 @@
+import os
+import sys
 import unittest
-from pymclevel.minecraft_server import MCServerChunkGenerator
-from templevel import TempLevel
+from pymclevel.minecraft_server import MCServerChunkGenerator, ChunkGenerationScheduler, planGenerationCenters, \
+    _GeneratorSlot
+from pymclevel import nbt
+from templevel import mktemp, TempLevel
 from pymclevel.box import BoundingBox
 
 __author__ = 'Rio'
@@ -31,3 +35,40 @@ class TestServerGen(unittest.TestCase):
                                   [(120, 50), (121, 50), (122, 50), (123, 50), (244, 244), (244, 245), (244, 246)])
         c = level.getChunk(50, 50)
         assert c.Blocks.any()
+
+
+class TestGenerationScheduler(unittest.TestCase):
+    def setUp(self):
+        self.alphalevel = TempLevel("AnvilWorld")
+
+    def testPlanCenters(self):
+        chunks = [(cx, cz) for cx in xrange(-20, 20) for cz in xrange(0, 5)]
+        radius = 4
+        centers = planGenerationCenters(chunks, radius)
+        for cx, cz in chunks:
+            assert any(abs(cx - x) <= radius and abs(cz - z) <= radius for x, z in centers)
+        # 40 chunks wide and 5 deep fit in five 9x9 squares; a fixed grid would need six
+        assert len(centers) == 5
+
+    def testStubGeneration(self):
+        level = self.alphalevel.level
+        stub = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_server.py")
+        scheduler = ChunkGenerationScheduler([sys.executable, stub], mktemp("GenSlots"), processCount=2)
+
+        chunks = [(cx, cz) for cx in xrange(300, 340) for cz in xrange(300, 310)]
+        scheduler.generateChunks(level, chunks)
+
+        for cx, cz in chunks:
+            assert level.containsChunk(cx, cz)
+        assert level.getChunk(300, 300).Blocks[:, :, 0].all()
+
+    def testSlotGeneratorSettings(self):
+        level = self.alphalevel.level
+        level.root_tag["Data"]["generatorName"] = nbt.TAG_String("flat")
+        slot = _GeneratorSlot(mktemp("GenSlot"), 0)
+        slot.prepare(level)
+
+        world, source = slot.openWorld()
+        assert world.root_tag["Data"]["generatorName"].value == "flat"
+        assert world.RandomSeed == level.RandomSeed
+        world.close()
@@ -0,0 +1,57 @@
+"""
+Stand-in for ftputil.FTPHost used by the world sync tests.
+
+Serves a local folder through the part of the FTPHost interface that WorldSync uses. Paths are "/"-separated and
+relative to the folder. Transfers are recorded in the shared list passed as transfers.
+"""
+import os
+import posixpath
+import shutil
+
+
+class LocalFolderHost(object):
+    path = posixpath
+
+    def __init__(self, root, transfers):
+        self.root = root
+        self.transfers = transfers
+        self.closed = False
+
+        host = self
+
+        class _Path(object):
+            join = staticmethod(posixpath.join)
+
+            @staticmethod
+            def exists(path):
+                return os.path.exists(host.localPath(path))
+
+        self.path = _Path()
+
+    def localPath(self, path):
+        return os.path.join(self.root, *[p for p in path.split("/") if p])
+
+    def walk(self, top):
+        for root, dirs, files in os.walk(self.localPath(top)):
+            rel = os.path.relpath(root, self.root).replace(os.sep, "/")
+            yield rel, dirs, files
+
+    def stat(self, path):
+        return os.stat(self.localPath(path))
+
+    def download(self, source, target):
+        self.transfers.append(("download", source))
+        shutil.copyfile(self.localPath(source), target)
+
+    def upload(self, source, target):
+        self.transfers.append(("upload", target))
+        shutil.copyfile(source, self.localPath(target))
+
+    def makedirs(self, path):
+        os.makedirs(self.localPath(path))
+
+    def remove(self, path):
+        os.remove(self.localPath(path))
+
+    def close(self):
+        self.closed = True
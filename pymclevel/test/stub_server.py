@@ -0,0 +1,39 @@
+"""
+Stand-in for minecraft_server.jar used by the chunk generation scheduler tests.
+
+Creates the chunks within RADIUS of the spawn point in ./world, fills their bottom layer with stone, prints the
+server's "Done" line and exits when "stop" is read from stdin.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from pymclevel.infiniteworld import MCInfdevOldLevel
+
+RADIUS = 8
+
+
+def main():
+    level = MCInfdevOldLevel("world")
+    x, y, z = level.playerSpawnPosition()
+    scx, scz = x >> 4, z >> 4
+    for cx in xrange(scx - RADIUS, scx + RADIUS + 1):
+        for cz in xrange(scz - RADIUS, scz + RADIUS + 1):
+            if not level.containsChunk(cx, cz):
+                level.createChunk(cx, cz)
+                chunk = level.getChunk(cx, cz)
+                chunk.Blocks[:, :, 0] = level.materials.Stone.ID
+                chunk.chunkChanged(False)
+    level.saveInPlace()
+    level.close()
+
+    print "[Server thread/INFO]: Done (0.001s)! For help, type \"help\""
+    sys.stdout.flush()
+    for line in iter(sys.stdin.readline, ""):
+        if line.strip() == "stop":
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import timeit
+
+# Run from the repository root, like the other time_* scripts.
+
+
+def run(code, env=None):
+    subprocess.check_call([sys.executable, "-c", code], env=env)
+
+
+def time_import(cache, number=5):
+    env = dict(os.environ)
+    env["PYMCLEVEL_DEFS_CACHE"] = cache
+    run("import pymclevel", env)  # Fills the cache, and the OS file cache
+    return timeit(lambda: run("import pymclevel", env), number=number) / number
+
+
+def time_interpreter(number=5):
+    return timeit(lambda: run("pass"), number=number) / number
+
+
+if __name__ == '__main__':
+    cacheDir = tempfile.mkdtemp("defs-cache")
+    try:
+        uncached = time_import("")
+        cached = time_import(cacheDir)
+    finally:
+        shutil.rmtree(cacheDir, True)
+    interpreter = time_interpreter()
+    uncached -= interpreter
+    cached -= interpreter
+    print "(interpreter startup of %0.1f ms subtracted)" % (interpreter * 1000)
+    print "import pymclevel without definitions cache: %0.1f ms" % (uncached * 1000)
+    print "import pymclevel with definitions cache:    %0.1f ms" % (cached * 1000)
@@ -0,0 +1,58 @@
+import unittest
+
+import numpy
+
+import vertex_format
+from vertex_format import POSITION_SCALE, TEXCOORD_SCALE
+
+
+def floatVertices(xyz, st, rgba):
+    """ A float layout array of shape (quads, 4, 6) holding the given values in every vertex of each quad. """
+    count = len(xyz)
+    vertexArray = numpy.zeros((count, 4, 6), numpy.float32)
+    vertexArray[..., 0:3] = numpy.array(xyz, numpy.float32)[:, numpy.newaxis]
+    vertexArray[..., 3:5] = numpy.array(st, numpy.float32)[:, numpy.newaxis]
+    vertexArray.view('uint8')[..., 20:24] = numpy.array(rgba, numpy.uint8)[:, numpy.newaxis]
+    return vertexArray
+
+
+class TestVertexFormat(unittest.TestCase):
+    def testLayouts(self):
+        vertexArray = floatVertices([(0, 0, 0)], [(0, 0)], [(0, 0, 0, 0)])
+        packed = vertex_format.quantize(vertexArray)
+        assert vertex_format.isFloatLayout(vertexArray) and not vertex_format.isPacked(vertexArray)
+        assert vertex_format.isPacked(packed) and not vertex_format.isFloatLayout(packed)
+        assert packed.shape == (1, 4)
+        assert vertex_format.packedVertexByteLength == 16
+
+    def testRoundTrip(self):
+        # Values on the fixed point grid survive exactly, colour bytes are copied as they are.
+        xyz = [(0, 0, 0), (16, 16, 16), (0.5, 15 + 1.0 / POSITION_SCALE, -1), (-0.25, 3.75, 8.125)]
+        st = [(0, 0), (256, 512), (1.0 / TEXCOORD_SCALE, 15.5), (-2, 1023.9375)]
+        rgba = [(0, 0, 0, 0), (255, 255, 255, 255), (12, 34, 56, 78), (200, 100, 50, 25)]
+        vertexArray = floatVertices(xyz, st, rgba)
+
+        expanded = vertex_format.expand(vertex_format.quantize(vertexArray))
+        assert expanded.dtype == numpy.float32
+        assert expanded.shape == vertexArray.shape
+        assert (expanded.view('uint8')[..., 20:24] == vertexArray.view('uint8')[..., 20:24]).all()
+        assert (expanded[..., 0:5] == vertexArray[..., 0:5]).all()
+
+    def testRounding(self):
+        vertexArray = floatVertices([(0.3, 7.001, -4.9999)], [(3.33, 0.01)], [(1, 2, 3, 4)])
+        expanded = vertex_format.expand(vertex_format.quantize(vertexArray))
+        assert (abs(expanded[..., 0:3] - vertexArray[..., 0:3]) <= 0.5 / POSITION_SCALE).all()
+        assert (abs(expanded[..., 3:5] - vertexArray[..., 3:5]) <= 0.5 / TEXCOORD_SCALE).all()
+
+    def testClipping(self):
+        # Values past the int16 range are clipped to its ends instead of wrapping around.
+        limits = numpy.iinfo(numpy.int16)
+        vertexArray = floatVertices([(200, -200, 127)], [(4096, -4096)], [(0, 0, 0, 0)])
+        packed = vertex_format.quantize(vertexArray)
+        assert packed["xyz"][0, 0].tolist() == [limits.max, limits.min, 127 * POSITION_SCALE]
+        assert packed["st"][0, 0].tolist() == [limits.max, limits.min]
+
+        expanded = vertex_format.expand(packed)
+        assert expanded[0, 0, 0] == float(limits.max) / POSITION_SCALE
+        assert expanded[0, 0, 1] == float(limits.min) / POSITION_SCALE
+        assert expanded[0, 0, 2] == 127
@@ -0,0 +1,110 @@
+import os
+import shutil
+import unittest
+from pymclevel.world_sync import RemoteChanged, WorldSync
+from templevel import mktemp
+from stub_ftp import LocalFolderHost
+
+__author__ = 'Rio'
+
+
+class TestWorldSync(unittest.TestCase):
+    def setUp(self):
+        self.server = mktemp("ftpserver")
+        os.mkdir(self.server)
+        shutil.copytree(os.path.join("testfiles", "AnvilWorld"), os.path.join(self.server, "world"))
+        self.local = mktemp("ftplocal")
+        self.transfers = []
+
+    def tearDown(self):
+        shutil.rmtree(self.server, True)
+        shutil.rmtree(self.local, True)
+
+    def makeSync(self):
+        factory = lambda: LocalFolderHost(self.server, self.transfers)
+        return WorldSync(factory, "world", os.path.join(self.local, "world"),
+                         os.path.join(self.local, "world.sync.json"), connections=3)
+
+    def serverFiles(self):
+        names = []
+        for root, dirs, files in os.walk(os.path.join(self.server, "world")):
+            names.extend(os.path.join(root, f) for f in files if f != "session.lock")
+        return names
+
+    def testPullOnlyChanges(self):
+        sync = self.makeSync()
+        sync.pull()
+        assert len(self.transfers) == len(self.serverFiles())
+        assert os.path.exists(os.path.join(self.local, "world", "level.dat"))
+
+        del self.transfers[:]
+        sync = self.makeSync()
+        sync.pull()
+        assert self.transfers == []
+
+        with open(os.path.join(self.server, "world", "level.dat"), "ab") as f:
+            f.write("x")
+        os.remove(os.path.join(self.server, "world", "region", "r.0.0.mca"))
+        sync.pull()
+        assert self.transfers == [("download", "world/level.dat")]
+        assert not os.path.exists(os.path.join(self.local, "world", "region", "r.0.0.mca"))
+
+    def testPushOnlyChanges(self):
+        from pymclevel.infiniteworld import MCInfdevOldLevel
+
+        sync = self.makeSync()
+        sync.pull()
+        del self.transfers[:]
+
+        level = MCInfdevOldLevel(os.path.join(self.local, "world"))
+        cx, cz = iter(level.allChunks).next()
+        chunk = level.getChunk(cx, cz)
+        chunk.Blocks[:] = 1
+        chunk.chunkChanged()
+        level.saveInPlace()
+        level.close()
+
+        regionName = "world/region/r.%d.%d.mca" % (cx >> 5, cz >> 5)
+        self.makeSync().push()
+        uploads = set(name for kind, name in self.transfers)
+        assert regionName in uploads
+        assert all(name in (regionName, "world/level.dat") for name in uploads)
+
+        del self.transfers[:]
+        self.makeSync().push()
+        assert self.transfers == []
+
+    def testPushRefusesRemoteChanges(self):
+        sync = self.makeSync()
+        sync.pull()
+        del self.transfers[:]
+
+        with open(os.path.join(self.local, "world", "level.dat"), "ab") as f:
+            f.write("y")
+        with open(os.path.join(self.server, "world", "level.dat"), "ab") as f:
+            f.write("x")
+
+        sync = self.makeSync()
+        assert sync.pushConflicts() == ["level.dat"]
+        self.assertRaises(RemoteChanged, sync.push)
+        assert not [name for kind, name in self.transfers if kind == "upload"]
+
+        sync.push(overwrite=True)
+        assert ("upload", "world/level.dat") in self.transfers
+
+    def testRegionRewrittenWithinASecond(self):
+        sync = self.makeSync()
+        sync.pull()
+
+        name = "region/r.0.0.mca"
+        path = sync.localPath(name)
+        st = os.stat(path)
+        with open(path, "r+b") as f:
+            f.seek(8192)
+            data = f.read(16)
+            f.seek(8192)
+            f.write("".join(chr(ord(c) ^ 0xff) for c in data))
+        os.utime(path, (st.st_atime, st.st_mtime + 5))
+        assert os.path.getsize(path) == st.st_size
+
+        assert self.makeSync().manifest.localChanged(name, path)
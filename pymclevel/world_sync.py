@@ -0,0 +1,349 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Incremental synchronisation of a world folder with a remote copy, used by the FTP client.
+
+The remote side is any object with the subset of the ftputil.FTPHost interface used here: walk, stat, download,
+upload, makedirs, remove, close, and path.join / path.exists. A new host is made for each transfer connection, so
+several files are moved at once.
+
+A JSON manifest records, for every file as of the last transfer:
+
+- the remote size and modification time from the server listing;
+- the local size and modification time;
+- a signature of the local contents, and for region files also a hash of the whole file.
+
+For region files the signature is a hash of the file size and the 8 KiB offset and timestamp tables. The region
+format records a new timestamp for every chunk written, so this changes whenever a chunk does, without reading
+the rest of the file. The timestamps have a resolution of one second, so a chunk rewritten in place within the
+same second leaves the header as it was; when the modification time of a region file changed but its header did
+not, it is compared with a hash of the whole file, which the manifest also keeps. Other files are hashed whole.
+
+pull downloads the files whose remote listing changed or whose local copy was edited since the last transfer.
+push uploads the local files whose signature changed and removes remote files that were deleted locally. It first
+lists the server and refuses, raising RemoteChanged, if any of those files changed there since the last transfer,
+unless it is told to overwrite them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import Queue
+import threading
+
+log = logging.getLogger(__name__)
+
+REGION_HEADER_BYTES = 8192
+skippedNames = ("session.lock",)
+skippedFolders = ("##MCEDIT.TEMP##", "##MCEDIT.TEMP2##", "##MCEDIT.RECOVERY##", "##MCEDIT.TILES##")
+
+
+def _isRegionFile(path):
+    return path.endswith(".mca") or path.endswith(".mcr")
+
+
+class RemoteChanged(IOError):
+    """ Raised by push when files it would upload or remove were changed on the server since the last transfer. """
+
+    def __init__(self, names):
+        IOError.__init__(self, "{0} files changed on the server since the last transfer: {1}".format(
+            len(names), ", ".join(names[:5])))
+        self.names = names
+
+
+def fileSignature(path, whole=False):
+    """ Hash identifying the contents of the local file at path. Region files are hashed by their header unless
+    whole is True. """
+    h = hashlib.sha1()
+    if _isRegionFile(path) and not whole:
+        h.update(str(os.path.getsize(path)))
+        with open(path, "rb") as f:
+            h.update(f.read(REGION_HEADER_BYTES))
+    else:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), ""):
+                h.update(block)
+    return h.hexdigest()
+
+
+class SyncManifest(object):
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = data["files"]
+            except Exception as e:
+                log.warning(u"Discarding unreadable sync manifest {0}: {1!r}".format(path, e))
+
+    def save(self):
+        tempPath = self.path + ".tmp"
+        with open(tempPath, "wb") as f:
+            json.dump({"version": self.VERSION, "files": self.entries}, f)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tempPath, self.path)
+
+    def record(self, name, localPath, remoteStat):
+        st = os.stat(localPath)
+        entry = self.entries[name] = {
+            "remote": [remoteStat.st_size, remoteStat.st_mtime],
+            "local": [st.st_size, st.st_mtime],
+            "sig": fileSignature(localPath),
+        }
+        if _isRegionFile(localPath):
+            entry["whole"] = fileSignature(localPath, whole=True)
+
+    def localChanged(self, name, localPath):
+        """ Return True if the local file was edited since it was last transferred. """
+        entry = self.entries.get(name)
+        if entry is None or not os.path.exists(localPath):
+            return True
+        st = os.stat(localPath)
+        if [st.st_size, st.st_mtime] == entry["local"]:
+            return False
+        if fileSignature(localPath) != entry["sig"]:
+            return True
+        if _isRegionFile(localPath) and fileSignature(localPath, whole=True) != entry.get("whole"):
+            # A chunk rewritten within the second its timestamp already had.
+            return True
+        entry["local"] = [st.st_size, st.st_mtime]
+        return False
+
+    def remoteChanged(self, name, remoteStat):
+        entry = self.entries.get(name)
+        return entry is None or [remoteStat.st_size, remoteStat.st_mtime] != entry["remote"]
+
+    def remoteConflicts(self, names, remote):
+        """ The names that are on the server, listed as remote, and changed there since the last transfer. """
+        return sorted(name for name in names if name in remote and self.remoteChanged(name, remote[name]))
+
+
+class WorldSync(object):
+    """
+    Keeps the folder localRoot in sync with the folder remoteRoot on the hosts made by hostFactory.
+
+    :param hostFactory: Callable returning a new connected host. Each transfer thread uses its own host.
+    :param manifestPath: Where to keep the manifest. It must be outside localRoot.
+    :param connections: Number of files to transfer at once.
+    """
+
+    def __init__(self, hostFactory, remoteRoot, localRoot, manifestPath, connections=4):
+        self.hostFactory = hostFactory
+        self.remoteRoot = remoteRoot
+        self.localRoot = localRoot
+        self.manifest = SyncManifest(manifestPath)
+        self.connections = max(1, connections)
+        self.transferred = []
+
+    def localPath(self, name):
+        return os.path.join(self.localRoot, *name.split("/"))
+
+    def listRemote(self, host):
+        """ Return {name: stat} for the files under remoteRoot. Names use "/" and are relative to remoteRoot. """
+        files = {}
+        prefix = self.remoteRoot.rstrip("/") + "/"
+        for root, dirs, filenames in host.walk(self.remoteRoot):
+            dirs[:] = [d for d in dirs if d not in skippedFolders]
+            rel = (root + "/")[len(prefix):] if (root + "/").startswith(prefix) else ""
+            for fn in filenames:
+                if fn in skippedNames:
+                    continue
+                files[rel + fn] = host.stat(host.path.join(root, fn))
+        return files
+
+    def listLocal(self):
+        files = []
+        for root, dirs, filenames in os.walk(self.localRoot):
+            dirs[:] = [d for d in dirs if d not in skippedFolders]
+            rel = os.path.relpath(root, self.localRoot)
+            for fn in filenames:
+                if fn in skippedNames:
+                    continue
+                files.append(fn if rel == os.curdir else "/".join(rel.split(os.sep) + [fn]))
+        return files
+
+    def _transfer(self, jobs, func):
+        """
+        Run func(host, job) for each job on up to self.connections threads.
+
+        :return: An iterator yielding (job, result) as each job finishes. Errors are raised once all jobs are done.
+        """
+        if not jobs:
+            return
+        queue = Queue.Queue()
+        for job in jobs:
+            queue.put(job)
+        results = Queue.Queue()
+        done = object()
+
+        def worker():
+            try:
+                host = self.hostFactory()
+            except Exception as e:
+                results.put((done, e))
+                return
+            try:
+                while True:
+                    try:
+                        job = queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    try:
+                        results.put((job, func(host, job)))
+                    except Exception as e:
+                        results.put((job, e))
+            finally:
+                host.close()
+                results.put((done, None))
+
+        threads = [threading.Thread(target=worker) for _ in xrange(min(self.connections, len(jobs)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        errors = []
+        remaining = len(jobs)
+        alive = len(threads)
+        while remaining and alive:
+            job, result = results.get()
+            if job is done:
+                alive -= 1
+                if result is not None:
+                    errors.append(result)
+                continue
+            remaining -= 1
+            if isinstance(result, Exception):
+                errors.append(result)
+            else:
+                yield job, result
+
+        if remaining:
+            errors.append(IOError("{0} transfers were not attempted".format(remaining)))
+        if errors:
+            raise IOError("{0} transfers failed, first error: {1!r}".format(len(errors), errors[0]))
+
+    def pull(self):
+        for _ in self.pullIter():
+            pass
+
+    def pullIter(self):
+        """ Download the changed files. Yields (filesDone, fileCount) progress tuples. """
+        host = self.hostFactory()
+        try:
+            remote = self.listRemote(host)
+        finally:
+            host.close()
+
+        manifest = self.manifest
+        jobs = sorted(name for name, st in remote.iteritems()
+                      if manifest.remoteChanged(name, st) or manifest.localChanged(name, self.localPath(name)))
+
+        for name in [n for n in manifest.entries if n not in remote]:
+            log.info(u"Removing {0}, deleted on the server".format(name))
+            if os.path.exists(self.localPath(name)):
+                os.remove(self.localPath(name))
+            del manifest.entries[name]
+
+        def download(host, name):
+            path = self.localPath(name)
+            if not os.path.isdir(os.path.dirname(path)):
+                try:
+                    os.makedirs(os.path.dirname(path))
+                except OSError:
+                    pass
+            host.download(host.path.join(self.remoteRoot, name), path + ".part")
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(path + ".part", path)
+
+        log.info(u"Downloading {0} of {1} files".format(len(jobs), len(remote)))
+        done = 0
+        try:
+            for name, _ in self._transfer(jobs, download):
+                manifest.record(name, self.localPath(name), remote[name])
+                self.transferred.append(name)
+                done += 1
+                yield done, len(jobs)
+        finally:
+            manifest.save()
+
+    def push(self, overwrite=False):
+        for _ in self.pushIter(overwrite):
+            pass
+
+    def _pushJobs(self):
+        """ (names to upload, names to remove from the server). """
+        local = self.listLocal()
+        jobs = sorted(name for name in local if self.manifest.localChanged(name, self.localPath(name)))
+        deleted = sorted(name for name in self.manifest.entries if name not in local)
+        return jobs, deleted
+
+    def pushConflicts(self):
+        """ The files push would upload or remove that were changed on the server since the last transfer. """
+        jobs, deleted = self._pushJobs()
+        host = self.hostFactory()
+        try:
+            remote = self.listRemote(host)
+        finally:
+            host.close()
+        return self.manifest.remoteConflicts(jobs + deleted, remote)
+
+    def pushIter(self, overwrite=False):
+        """
+        Upload the changed files and remove deleted ones. Yields (filesDone, fileCount) progress tuples.
+
+        :param overwrite: Replace files that were also changed on the server. Otherwise, RemoteChanged is raised
+            before anything is transferred.
+        """
+        manifest = self.manifest
+        jobs, deleted = self._pushJobs()
+
+        host = self.hostFactory()
+        try:
+            remote = self.listRemote(host)
+            conflicts = manifest.remoteConflicts(jobs + deleted, remote)
+            if conflicts:
+                if not overwrite:
+                    raise RemoteChanged(conflicts)
+                log.warning(u"Overwriting {0} files changed on the server".format(len(conflicts)))
+            folders = set(name.rpartition("/")[0] for name in jobs)
+            for folder in sorted(folders):
+                remoteFolder = host.path.join(self.remoteRoot, folder) if folder else self.remoteRoot
+                if not host.path.exists(remoteFolder):
+                    host.makedirs(remoteFolder)
+            for name in deleted:
+                log.info(u"Removing {0} from the server, deleted locally".format(name))
+                if name in remote:
+                    host.remove(host.path.join(self.remoteRoot, name))
+                del manifest.entries[name]
+        finally:
+            host.close()
+
+        def upload(host, name):
+            remotePath = host.path.join(self.remoteRoot, name)
+            try:
+                host.upload(self.localPath(name), remotePath)
+            except Exception as e:
+                # Some servers report the "226 Transfer complete" reply as an error.
+                if "226" not in str(e):
+                    raise
+            return host.stat(remotePath)
+
+        log.info(u"Uploading {0} files".format(len(jobs)))
+        done = 0
+        try:
+            for name, remoteStat in self._transfer(jobs, upload):
+                manifest.record(name, self.localPath(name), remoteStat)
+                self.transferred.append(name)
+                done += 1
+                yield done, len(jobs)
+        finally:
+            manifest.save()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+World map tiles: the height and colour of the top block of each column of a world, kept at three levels of detail so
+distant terrain can be drawn without loading its chunks.
+
+A tile holds three arrays indexed [x, z]. heights is the y of the top block, or -1 where the column is empty. tops is
+the RGBA colour of its top face and sides the colour of its sides, both taken from the materials' flatColors. Level
+0 holds one sample per column and is what LowDetailBlockRenderer draws a chunk from. Level 1 averages each
+REGION_STEP x REGION_STEP square of a region's columns into one sample. Level 2 does the same for each SUPER_STEP x
+SUPER_STEP square of a block of SUPER_REGIONS x SUPER_REGIONS regions.
+
+The tiles of each region are stored in the world's ##MCEDIT.TILES## folder with the region timestamp and sector
+offset of each chunk they were built from. When a region file's modification time differs from the one recorded,
+only the chunks whose timestamp or offset changed are read again. Chunks with unsaved edits are built from the loaded
+chunk, and are read again once the world is saved.
+"""
+
+import logging
+import os
+
+import numpy
+
+from infiniteworld import MCInfdevOldLevel
+from mclevelbase import ChunkNotPresent, ChunkMalformed
+from schematic import ZipSchematic
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+FOLDER = "##MCEDIT.TILES##"
+REGION_STEP = 4  # columns per level 1 sample, along each axis
+SUPER_STEP = 16  # columns per level 2 sample, along each axis
+SUPER_REGIONS = 4  # regions per level 2 tile, along each axis
+
+
+def emptyTile(width, length):
+    heights = numpy.empty((width, length), 'int16')
+    heights.fill(-1)
+    return heights, numpy.zeros((width, length, 4), 'uint8'), numpy.zeros((width, length, 4), 'uint8')
+
+
+def chunkTile(chunk):
+    """
+    Return the level 0 tile (heights, tops, sides) of chunk, read from its HeightMap. A block on top of the top block,
+    like a snow layer, gives the top its colour. Grass has the sides of dirt.
+    """
+    blocks = chunk.Blocks
+    width, length, height = blocks.shape
+    h = numpy.swapaxes(chunk.HeightMap.astype('int32') - 1, 0, 1)[:width, :length]
+    numpy.clip(h, 0, height - 1, h)
+
+    x, z = numpy.indices((width, length))
+    top = blocks[x, z, h]
+    above = blocks[x, z, numpy.minimum(h + 1, height - 1)]
+    flatColors = chunk.world.materials.flatColors
+
+    tops = flatColors[top, chunk.Data[x, z, h] & 0xf]
+    over = above > 0
+    tops[over] = flatColors[above[over], 0]
+    sides = (tops * 0.8).astype('uint8')
+    sides[top == 2] = flatColors[3, 0]
+    heights = numpy.where(top != 0, h, -1).astype('int16')
+    return heights, tops, sides
+
+
+def downsample(tile, step):
+    """ Average each step x step square of samples of tile into one, leaving out the empty columns. """
+    heights, tops, sides = tile
+    width, length = heights.shape
+
+    def blockSum(a):
+        a = a.reshape((width // step, step, length // step, step) + a.shape[2:])
+        return a.sum(axis=3).sum(axis=1)
+
+    valid = heights >= 0
+    count = blockSum(valid.astype('int32'))
+    divisor = numpy.maximum(count, 1)
+    heights = numpy.where(count > 0, blockSum(numpy.where(valid, heights, 0).astype('int32')) // divisor, -1)
+    mask = valid[..., numpy.newaxis]
+    divisor = divisor[..., numpy.newaxis]
+    return (heights.astype('int16'),
+            (blockSum(tops * mask) // divisor).astype('uint8'),
+            (blockSum(sides * mask) // divisor).astype('uint8'))
+
+
+def chunkIndex(cx, cz):
+    """ Index of a chunk within its region, in the order of the region file's header. """
+    return (cx & 0x1f) + (cz & 0x1f) * 32
+
+
+class RegionTiles(object):
+    """
+    The tiles of one region.
+
+    :ivar stamps: (region timestamp, sector offset) of each chunk when its tile was built, -1 if it was built from
+        unsaved data
+    :ivar fresh: Whether each chunk's tile matches the chunk
+    :ivar generation: Incremented each time a chunk's tile is rebuilt
+    :ivar hasData: Whether any chunk of the region exists. The level 0 tile of an empty region is never allocated.
+    """
+
+    def __init__(self, rPos):
+        self.rPos = rPos
+        self.level0 = None
+        self.level1 = None
+        self.stamps = numpy.empty((1024, 2), 'int64')
+        self.stamps.fill(-1)
+        self.fresh = numpy.zeros(1024, bool)
+        self.mtime = None
+        self.generation = 0
+        self.hasData = False
+        self.dirty = False
+
+
+class TilePyramid(object):
+    """
+    The world map tiles of a level. Tiles are only kept for MCInfdevOldLevel worlds and dimensions; for other levels,
+    chunkTile builds the tile from the chunk every time and the region tiles are not available. The tiles are only
+    written to disk for levels that are not read only.
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self.regions = {}
+        self._superTiles = {}
+        self.active = isinstance(level, MCInfdevOldLevel) and not isinstance(level, ZipSchematic)
+        self.path = None
+        if self.active and not level.readonly:
+            try:
+                self.path = level.worldFolder.getFolderPath(FOLDER)
+            except EnvironmentError as e:
+                log.warning(u"Cannot create world tiles folder: {0!r}".format(e))
+
+    def regionPath(self, rx, rz):
+        return os.path.join(self.path, "r.%d.%d.npz" % (rx, rz))
+
+    # --- Regions ---
+
+    def region(self, rx, rz):
+        """ Return the RegionTiles of a region, loading them from disk and checking them against the world. """
+        region = self.regions.get((rx, rz))
+        if region is None:
+            region = self.regions[rx, rz] = self._loadRegion(rx, rz)
+        self._validate(region)
+        return region
+
+    def _loadRegion(self, rx, rz):
+        region = RegionTiles((rx, rz))
+        if self.path is None or not os.path.exists(self.regionPath(rx, rz)):
+            return region
+        try:
+            with numpy.load(self.regionPath(rx, rz)) as data:
+                if int(data["version"]) != VERSION:
+                    return region
+                stamps = data["stamps"]
+                level1 = tuple(data[name + "1"] for name in ("heights", "tops", "sides"))
+                mtime = float(data["mtime"])
+        except Exception as e:
+            log.warning(u"Discarding unreadable world tiles for region {0}: {1!r}".format((rx, rz), e))
+            return region
+
+        region.stamps = stamps
+        region.level1 = level1
+        region.fresh = (stamps >= 0).all(axis=1)
+        region.mtime = None if numpy.isnan(mtime) else mtime
+        region.hasData = True
+        self._validate(region, force=True)
+
+        for cx, cz in self.unsavedChunks():
+            if (cx >> 5, cz >> 5) == (rx, rz):
+                region.fresh[chunkIndex(cx, cz)] = False
+        return region
+
+    def unsavedChunks(self):
+        level = self.level
+        unsaved = set(level.listDirtyChunks())
+        if not level.readonly:
+            unsaved.update(level.unsavedWorkFolder.listChunks())
+        return unsaved
+
+    def _regionIsEmpty(self, rx, rz):
+        """ True if the world has no chunk in a region, saved or not. """
+        level = self.level
+        if os.path.exists(level.worldFolder.getRegionFilename(rx, rz)):
+            return False
+        if not level.readonly and os.path.exists(level.unsavedWorkFolder.getRegionFilename(rx, rz)):
+            return False
+        return not any((cx >> 5, cz >> 5) == (rx, rz) for cx, cz in level.listDirtyChunks())
+
+    def _validate(self, region, force=False):
+        """ Mark the chunks of region that were saved since their tiles were built. """
+        rx, rz = region.rPos
+        worldFolder = self.level.worldFolder
+        path = worldFolder.getRegionFilename(rx, rz)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if mtime == region.mtime and not force:
+            return
+        if mtime is None:
+            current = numpy.zeros((1024, 2), 'int64')
+        else:
+            regionFile = worldFolder.getRegionFile(rx, rz)
+            current = numpy.column_stack((regionFile.modTimes, regionFile.offsets)).astype('int64')
+        region.fresh &= (region.stamps == current).all(axis=1)
+        region.mtime = mtime
+
+    def _level0(self, region):
+        if region.level0 is None:
+            path = None if self.path is None else self.regionPath(*region.rPos)
+            if path and os.path.exists(path) and region.fresh.any():
+                try:
+                    with numpy.load(path) as data:
+                        region.level0 = tuple(data[name + "0"] for name in ("heights", "tops", "sides"))
+                except Exception as e:
+                    log.warning(u"Discarding unreadable world tiles for region {0}: {1!r}".format(region.rPos, e))
+                    region.fresh[:] = False
+            if region.level0 is None:
+                region.level0 = emptyTile(512, 512)
+        return region.level0
+
+    def _chunkStamp(self, cx, cz):
+        """ (timestamp, offset) of the chunk in the world's region file, or None if it has unsaved edits. """
+        level = self.level
+        chunkData = level._loadedChunkData.get((cx, cz))
+        if chunkData is not None and chunkData.dirty:
+            return None
+        if not level.readonly and level.unsavedWorkFolder.containsChunk(cx, cz):
+            return None
+        if not level.worldFolder.containsChunk(cx, cz):
+            return 0, 0
+        regionFile = level.worldFolder.getRegionForChunk(cx, cz)
+        return int(regionFile.getTimestamp(cx, cz)), int(regionFile.getOffset(cx, cz))
+
+    def _buildChunk(self, region, cx, cz):
+        """ Rebuild the tile of a chunk. Returns True if the chunk was read. """
+        stamp = self._chunkStamp(cx, cz)
+        tile = None
+        if self.level.containsChunk(cx, cz):
+            try:
+                tile = chunkTile(self.level.getChunk(cx, cz))
+            except (ChunkNotPresent, ChunkMalformed) as e:
+                log.debug(u"World tiles skipping chunk {0}: {1!r}".format((cx, cz), e))
+
+        if tile is not None or region.hasData:
+            if tile is None:
+                tile = emptyTile(16, 16)
+            x, z = (cx & 0x1f) << 4, (cz & 0x1f) << 4
+            for a, t in zip(self._level0(region), tile):
+                a[x:x + 16, z:z + 16] = t
+            region.hasData = True
+
+        index = chunkIndex(cx, cz)
+        region.stamps[index] = (-1, -1) if stamp is None else stamp
+        region.fresh[index] = True
+        region.level1 = None
+        region.generation += 1
+        region.dirty = True
+        return tile is not None
+
+    def updateRegionIter(self, rx, rz):
+        """ Rebuild the tiles of the chunks of a region that changed, yielding after each chunk. """
+        region = self.region(rx, rz)
+        if not region.hasData and not region.fresh.all() and self._regionIsEmpty(rx, rz):
+            region.stamps[:] = 0
+            region.fresh[:] = True
+            region.generation += 1
+            return
+        for index in (~region.fresh).nonzero()[0].tolist():
+            if self._buildChunk(region, (rx << 5) + (index & 0x1f), (rz << 5) + (index >> 5)):
+                yield
+        if region.dirty:
+            self.saveRegion(region)
+
+    def regionIsCurrent(self, rx, rz):
+        return bool(self.region(rx, rz).fresh.all())
+
+    def invalidateChunk(self, cx, cz):
+        """ Rebuild the chunk's tile the next time it is asked for. Regions that are not loaded check on loading. """
+        region = self.regions.get((cx >> 5, cz >> 5))
+        if region is not None:
+            region.fresh[chunkIndex(cx, cz)] = False
+
+    def invalidateUnsaved(self):
+        """ Rebuild the tiles of the chunks with unsaved changes, after chunks were created or deleted. """
+        for region in self.regions.itervalues():
+            region.fresh &= (region.stamps >= 0).all(axis=1)
+        for cx, cz in self.unsavedChunks():
+            self.invalidateChunk(cx, cz)
+
+    # --- Tiles ---
+
+    def chunkTile(self, cx, cz):
+        """ Return the level 0 tile of a chunk, rebuilding it if the chunk changed. """
+        if not self.active:
+            if not self.level.containsChunk(cx, cz):
+                return emptyTile(16, 16)
+            return chunkTile(self.level.getChunk(cx, cz))
+
+        region = self.region(cx >> 5, cz >> 5)
+        if not region.fresh[chunkIndex(cx, cz)]:
+            self._buildChunk(region, cx, cz)
+        x, z = (cx & 0x1f) << 4, (cz & 0x1f) << 4
+        return tuple(a[x:x + 16, z:z + 16] for a in self._level0(region))
+
+    def regionTile(self, rx, rz):
+        """ Return the level 1 tile of a region. Call updateRegionIter first for it to match the world. """
+        region = self.region(rx, rz)
+        if region.level1 is None:
+            if region.hasData:
+                region.level1 = downsample(self._level0(region), REGION_STEP)
+            else:
+                region.level1 = emptyTile(512 // REGION_STEP, 512 // REGION_STEP)
+        return region.level1
+
+    def superRegions(self, sx, sz):
+        """ The positions of the regions covered by a level 2 tile. """
+        return [(sx * SUPER_REGIONS + i, sz * SUPER_REGIONS + j)
+                for i in xrange(SUPER_REGIONS) for j in xrange(SUPER_REGIONS)]
+
+    def superTile(self, sx, sz):
+        """ Return the level 2 tile of a block of regions. Call updateRegionIter first for each of superRegions. """
+        regions = self.superRegions(sx, sz)
+        generations = tuple(self.region(*rPos).generation for rPos in regions)
+        cached = self._superTiles.get((sx, sz))
+        if cached is not None and cached[0] == generations:
+            return cached[1]
+
+        side = 512 // SUPER_STEP
+        tile = emptyTile(side * SUPER_REGIONS, side * SUPER_REGIONS)
+        for rx, rz in regions:
+            x, z = (rx - sx * SUPER_REGIONS) * side, (rz - sz * SUPER_REGIONS) * side
+            for a, t in zip(tile, downsample(self.regionTile(rx, rz), SUPER_STEP // REGION_STEP)):
+                a[x:x + side, z:z + side] = t
+        self._superTiles[sx, sz] = generations, tile
+        return tile
+
+    # --- Storage ---
+
+    def saveRegion(self, region):
+        """ Write a region's tiles to disk. Returns False if they could not be written. """
+        region.dirty = False
+        if self.path is None:
+            return False
+        path = self.regionPath(*region.rPos)
+        if not region.hasData:
+            if os.path.exists(path):
+                os.remove(path)
+            return True
+
+        heights, tops, sides = self._level0(region)
+        heights1, tops1, sides1 = self.regionTile(*region.rPos)
+        tempPath = path + ".tmp"
+        try:
+            with open(tempPath, "wb") as f:
+                numpy.savez_compressed(f, version=VERSION, stamps=region.stamps,
+                                       mtime=numpy.nan if region.mtime is None else region.mtime,
+                                       heights0=heights, tops0=tops, sides0=sides,
+                                       heights1=heights1, tops1=tops1, sides1=sides1)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tempPath, path)
+        except EnvironmentError as e:
+            log.warning(u"Could not save world tiles {0}: {1!r}".format(path, e))
+            region.dirty = True
+            return False
+        return True
+
+    def save(self):
+        for region in self.regions.itervalues():
+            if region.dirty:
+                self.saveRegion(region)
+
+    def trim(self, keep):
+        """ Release the level 0 tiles of the regions not in keep, once they are saved. """
+        for rPos, region in self.regions.iteritems():
+            if rPos in keep or region.level0 is None:
+                continue
+            if region.dirty and not self.saveRegion(region):
+                continue
+            if self.path is not None:
+                region.level0 = None
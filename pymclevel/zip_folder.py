@@ -0,0 +1,471 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+World folder backend for ZipSchematic that reads region files straight out of the zip archive.
+
+ZipWorldFolder is an AnvilWorldFolder over a temporary overlay folder. Region files that have not been written to
+are served by ZipRegionFile, which reads chunk sectors from the archive member in place. Members written with
+ZIP_STORED (as saveArchive does) are read by seeking inside the archive; compressed members are extracted into the
+overlay the first time they are needed. The first write to a region copies its member into the overlay, and later
+reads and writes go to that copy.
+
+saveArchive updates the archive it reads from in place: the overlay files are appended as stored members after the
+existing ones, followed by a new central directory that lists them and the region members that were never written to.
+Those members keep their bytes where they are. The replaced members are left behind as dead space; once it is more
+than half the archive, or when saving to another file, the archive is written anew with ArchiveWriter, copying the
+unchanged members byte for byte without decompressing them. An interrupted in-place update leaves the archive's old
+directory in the file but no longer at its end, so it must not be interrupted.
+"""
+
+import copy
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import zipfile
+import zlib
+
+from numpy import fromstring
+
+from infiniteworld import AnvilWorldFolder
+from regionfile import MCRegionFile
+
+log = logging.getLogger(__name__)
+
+TEMP_PREFIX = "##MCEDIT.TEMP##/"
+skippedNames = ("session.lock",)
+skippedFolders = ("##MCEDIT.TEMP##", "##MCEDIT.TEMP2##", "##MCEDIT.RECOVERY##", "##MCEDIT.TILES##")
+
+
+def _regionCoords(name):
+    """ Return (rx, rz) if the archive member name is a region file, else None. """
+    if name.startswith(TEMP_PREFIX):
+        name = name[len(TEMP_PREFIX):]
+    folder, _, filename = name.rpartition("/")
+    if folder != "region":
+        return None
+    bits = filename.split('.')
+    if len(bits) != 4 or bits[0] != 'r' or bits[3] != "mca":
+        return None
+    try:
+        return int(bits[1]), int(bits[2])
+    except ValueError:
+        return None
+
+
+# Local file header of a zip member, as laid out by the zip format: signature, version, flags, method, time, date,
+# CRC, compressed size, uncompressed size, file name length and extra field length.
+localHeader = struct.Struct("<4s5H3L2H")
+# Central directory header: signature, made by version and system, extract version and reserved byte, flags, method,
+# time, date, CRC, compressed size, uncompressed size, file name, extra and comment lengths, disk number, internal
+# attributes, external attributes and local header offset.
+centralHeader = struct.Struct("<4s4B4HL2L5H2L")
+# End of central directory record: signature, disk numbers, entry counts, directory size and offset, comment length.
+endRecord = struct.Struct("<4s4H2LH")
+
+ZIP32_LIMIT = 0xffffffff
+ENTRY_LIMIT = 0xffff
+DATA_DESCRIPTOR = 0x08
+UTF8_NAME = 0x800
+
+
+def _dataOffset(f, info):
+    """ Offset of the member's data in the open archive f, found by reading its local file header. """
+    f.seek(info.header_offset)
+    header = localHeader.unpack(f.read(localHeader.size))
+    if header[0] != "PK\x03\x04":
+        raise zipfile.BadZipfile("Bad local file header for {0}".format(info.filename))
+    return info.header_offset + localHeader.size + header[-2] + header[-1]
+
+
+def _memberEnd(f, info):
+    """ Offset just past the member's data in the open archive f. """
+    return _dataOffset(f, info) + info.compress_size
+
+
+def _dosDateTime(dateTime):
+    year, month, day, hour, minute, second = dateTime
+    return (year - 1980) << 9 | month << 5 | day, hour << 11 | minute << 5 | second // 2
+
+
+def _encodedName(info):
+    """ (file name bytes, flag bits) to write for info. """
+    if isinstance(info.filename, unicode):
+        try:
+            return info.filename.encode("ascii"), info.flag_bits & ~UTF8_NAME
+        except UnicodeEncodeError:
+            return info.filename.encode("utf-8"), info.flag_bits | UTF8_NAME
+    return info.filename, info.flag_bits
+
+
+class ArchiveWriter(object):
+    """
+    Writes zip members into the open file f from offset start, then a central directory listing them and the
+    members kept in place. Members are written with their sizes in the local header, so archives needing zip64 records
+    are left to zipfile; see fits().
+    """
+
+    def __init__(self, f, start):
+        self.f = f
+        self.entries = []
+        f.seek(start)
+
+    @staticmethod
+    def fits(infos, extraBytes=0):
+        """ True if an archive of the members infos, plus extraBytes of new data, needs no zip64 records. """
+        return (len(infos) < ENTRY_LIMIT and
+                sum(info.compress_size for info in infos) + extraBytes < ZIP32_LIMIT and
+                all(info.file_size < ZIP32_LIMIT for info in infos))
+
+    def _writeHeader(self, info):
+        name, flags = _encodedName(info)
+        date, dosTime = _dosDateTime(info.date_time)
+        self.f.write(localHeader.pack("PK\x03\x04", info.extract_version, flags, info.compress_type, dosTime, date,
+                                      info.CRC, info.compress_size, info.file_size, len(name), 0))
+        self.f.write(name)
+
+    def keep(self, info):
+        """ List a member that is already in the file at info.header_offset. """
+        self.entries.append(info)
+
+    def writeFile(self, path, name):
+        """ Append the file at path as the stored member name. """
+        st = os.stat(path)
+        info = zipfile.ZipInfo(name, time.localtime(st.st_mtime)[:6])
+        info.external_attr = (st.st_mode & 0xffff) << 16
+        info.compress_type = zipfile.ZIP_STORED
+        info.header_offset = self.f.tell()
+        info.file_size = info.compress_size = st.st_size
+        info.CRC = 0  # written again below, once the data has been read
+        self._writeHeader(info)
+
+        crc = 0
+        with open(path, "rb") as source:
+            while True:
+                data = source.read(1 << 20)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                self.f.write(data)
+        info.CRC = crc & 0xffffffff
+
+        end = self.f.tell()
+        self.f.seek(info.header_offset)
+        self._writeHeader(info)
+        self.f.seek(end)
+        self.entries.append(info)
+
+    def copyMember(self, source, info, name):
+        """ Append the member info of the open archive source as name, copying its bytes without decompressing. """
+        offset = _dataOffset(source, info)
+        info = copy.copy(info)
+        info.filename = name
+        info.flag_bits &= ~DATA_DESCRIPTOR  # the sizes are in the local header
+        info.header_offset = self.f.tell()
+        self._writeHeader(info)
+
+        source.seek(offset)
+        remaining = info.compress_size
+        while remaining:
+            data = source.read(min(remaining, 1 << 20))
+            if not data:
+                raise IOError("Unexpected end of archive while copying {0}".format(info.filename))
+            self.f.write(data)
+            remaining -= len(data)
+        self.entries.append(info)
+
+    def close(self):
+        """ Write the central directory and end the file after it. """
+        f = self.f
+        directoryStart = f.tell()
+        for info in self.entries:
+            name, flags = _encodedName(info)
+            date, dosTime = _dosDateTime(info.date_time)
+            f.write(centralHeader.pack("PK\x01\x02", info.create_version, info.create_system, info.extract_version,
+                                       info.reserved, flags, info.compress_type, dosTime, date, info.CRC,
+                                       info.compress_size, info.file_size, len(name), len(info.extra),
+                                       len(info.comment), 0, info.internal_attr, info.external_attr,
+                                       info.header_offset))
+            f.write(name)
+            f.write(info.extra)
+            f.write(info.comment)
+        count = len(self.entries)
+        f.write(endRecord.pack("PK\x05\x06", 0, 0, count, count, f.tell() - directoryStart, directoryStart, 0))
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ZipMemberFile(object):
+    """ A read only file object over a stored (uncompressed) archive member. Closes the archive on exit. """
+
+    def __init__(self, archivePath, offset, size):
+        self._file = open(archivePath, "rb")
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.size
+        self.pos = max(0, pos)
+
+    def tell(self):
+        return self.pos
+
+    def read(self, count=-1):
+        end = self.size if count < 0 else min(self.size, self.pos + count)
+        if end <= self.pos:
+            return ""
+        self._file.seek(self.offset + self.pos)
+        data = self._file.read(end - self.pos)
+        self.pos += len(data)
+        return data
+
+
+class ZipRegionFile(MCRegionFile):
+    """ A region file read in place from a stored archive member. Writing raises IOError. """
+
+    def __init__(self, archivePath, info, offset, regionCoords):
+        self.path = archivePath + "/" + info.filename
+        self.archivePath = archivePath
+        self.info = info
+        self.dataOffset = offset
+        self.regionCoords = regionCoords
+        self._file = None
+        self._lock = threading.RLock()
+
+        with self.file as f:
+            offsetsData = f.read(self.SECTOR_BYTES)
+            modTimesData = f.read(self.SECTOR_BYTES)
+
+        self.offsets = fromstring(offsetsData, dtype='>u4')
+        self.modTimes = fromstring(modTimesData, dtype='>u4')
+        self.freeSectors = [False] * ((info.file_size + self.SECTOR_BYTES - 1) / self.SECTOR_BYTES)
+
+    @property
+    def file(self):
+        return ZipMemberFile(self.archivePath, self.dataOffset, self.info.file_size)
+
+    def close(self):
+        pass
+
+    def repair(self):
+        pass
+
+    def _saveChunk(self, cx, cz, data, format):
+        raise IOError("Region {0} is read from a zip archive and cannot be written".format(self.path))
+
+    def setOffset(self, cx, cz, offset):
+        raise IOError("Region {0} is read from a zip archive and cannot be written".format(self.path))
+
+    def saveChunks(self, chunks):
+        raise IOError("Region {0} is read from a zip archive and cannot be written".format(self.path))
+
+
+class ZipWorldFolder(AnvilWorldFolder):
+    """
+    An AnvilWorldFolder whose region files are read from the archive zipfilename until they are written to.
+    Members that are not region files are extracted into the folder when it is created.
+
+    :param zipfilename: The archive to read, or None for a new schematic.
+    """
+
+    def __init__(self, filename, zipfilename=None):
+        AnvilWorldFolder.__init__(self, filename, durable=False)
+        self.archivePath = None
+        self.regionMembers = {}  # (rx, rz) -> (ZipInfo, data offset)
+        self.overlaid = set()  # regions whose archive member was replaced by a file in the folder
+        if zipfilename is not None and os.path.exists(zipfilename):
+            self.openArchive(zipfilename, extract=True)
+
+    def openArchive(self, zipfilename, extract=False):
+        self.closeRegions()
+        self.archivePath = zipfilename
+        self.regionMembers = {}
+        self.overlaid = set()
+        with open(zipfilename, "rb") as f, zipfile.ZipFile(f, allowZip64=True) as zf:
+            for info in zf.infolist():
+                if info.filename.endswith("/"):
+                    continue
+                rPos = _regionCoords(info.filename)
+                if rPos is not None:
+                    if info.compress_type == zipfile.ZIP_STORED:
+                        self.regionMembers[rPos] = info, _dataOffset(f, info)
+                    else:
+                        self.regionMembers[rPos] = info, None
+                elif extract and not info.filename.startswith(TEMP_PREFIX) and info.filename not in skippedNames:
+                    zf.extract(info, self.filename)
+        log.info(u"Opened zip archive {0} with {1} region files".format(zipfilename, len(self.regionMembers)))
+
+    def _inArchive(self, rx, rz):
+        return (rx, rz) in self.regionMembers and (rx, rz) not in self.overlaid
+
+    def _extractRegion(self, rx, rz):
+        """ Copy the region's archive member into the folder. Later reads and writes use the copy. """
+        info, offset = self.regionMembers[rx, rz]
+        path = self.getRegionFilename(rx, rz)
+        with zipfile.ZipFile(self.archivePath, allowZip64=True) as zf, open(path, "wb") as out:
+            shutil.copyfileobj(zf.open(info), out, 1 << 20)
+        self.overlaid.add((rx, rz))
+        self.regionFiles.pop((rx, rz), None)
+        log.debug(u"Extracted {0} from {1}".format(info.filename, self.archivePath))
+
+    def getRegionFile(self, rx, rz):
+        regionFile = self.regionFiles.get((rx, rz))
+        if regionFile:
+            return regionFile
+        if self._inArchive(rx, rz):
+            info, offset = self.regionMembers[rx, rz]
+            if offset is None:
+                self._extractRegion(rx, rz)
+            else:
+                regionFile = ZipRegionFile(self.archivePath, info, offset, (rx, rz))
+                self.regionFiles[rx, rz] = regionFile
+                return regionFile
+        return AnvilWorldFolder.getRegionFile(self, rx, rz)
+
+    def getWritableRegionFile(self, rx, rz):
+        if self._inArchive(rx, rz):
+            self._extractRegion(rx, rz)
+        return self.getRegionFile(rx, rz)
+
+    def listChunks(self):
+        chunks = AnvilWorldFolder.listChunks(self)
+        for rx, rz in self.regionMembers:
+            if not self._inArchive(rx, rz):
+                continue
+            regionFile = self.getRegionFile(rx, rz)
+            for index in map(int, regionFile.offsets.nonzero()[0]):
+                chunks.add(((index & 0x1f) + (rx << 5), (index >> 5) + (rz << 5)))
+        return chunks
+
+    def containsChunk(self, cx, cz):
+        if self._inArchive(cx >> 5, cz >> 5):
+            return self.getRegionForChunk(cx, cz).containsChunk(cx, cz)
+        return AnvilWorldFolder.containsChunk(self, cx, cz)
+
+    def deleteChunk(self, cx, cz):
+        if self._inArchive(cx >> 5, cz >> 5):
+            if not self.getRegionForChunk(cx, cz).containsChunk(cx, cz):
+                return
+            self._extractRegion(cx >> 5, cz >> 5)
+        AnvilWorldFolder.deleteChunk(self, cx, cz)
+
+    def saveChunk(self, cx, cz, data):
+        self.getWritableRegionFile(cx >> 5, cz >> 5).saveChunk(cx, cz, data)
+
+    def copyChunkFrom(self, worldFolder, cx, cz):
+        fromRF = worldFolder.getRegionForChunk(cx, cz)
+        self.getWritableRegionFile(cx >> 5, cz >> 5).copyChunkFrom(fromRF, cx, cz)
+
+    # --- Saving ---
+
+    def _folderFiles(self):
+        for root, dirs, files in os.walk(self.filename):
+            dirs[:] = [d for d in dirs if d not in skippedFolders]
+            for fn in files:
+                if fn in skippedNames:
+                    continue
+                path = os.path.join(root, fn)
+                yield path, os.path.relpath(path, self.filename).replace(os.sep, "/")
+
+    def _keptMembers(self):
+        """ The region members that were never written to: {member name: ZipInfo}. """
+        return dict((info.filename, info) for rPos, (info, offset) in self.regionMembers.iteritems()
+                    if self._inArchive(*rPos))
+
+    def saveArchive(self, filename):
+        """
+        Write the folder and the unmodified archive members to the archive filename. If filename is the archive
+        this folder reads from, the archive is updated in place when it can be; either way, the folder's region files
+        are then served from the saved archive.
+        """
+        files = list(self._folderFiles())
+        kept = self._keptMembers()
+        for path, name in files:
+            kept.pop(name, None)
+        newBytes = sum(os.path.getsize(path) for path, name in files)
+
+        if filename == self.archivePath and os.path.exists(filename):
+            with open(filename, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                live = sum(_memberEnd(f, info) - info.header_offset for info in kept.itervalues())
+            if size - live <= size / 2 and ArchiveWriter.fits(kept.values(), size + newBytes):
+                with open(filename, "r+b") as f:
+                    writer = ArchiveWriter(f, size)
+                    for info in sorted(kept.itervalues(), key=lambda info: info.header_offset):
+                        writer.keep(info)
+                    for path, name in files:
+                        writer.writeFile(path, name)
+                    writer.close()
+                log.info(u"Updated zip archive {0}: {1} files written, {2} region files kept in place".format(
+                    filename, len(files), len(kept)))
+                self._reopenSaved(filename)
+                return
+
+        tempPath = filename + ".tmp"
+        if ArchiveWriter.fits(kept.values(), newBytes):
+            with open(tempPath, "wb") as f:
+                writer = ArchiveWriter(f, 0)
+                for path, name in files:
+                    writer.writeFile(path, name)
+                if kept:
+                    with open(self.archivePath, "rb") as source:
+                        for info, name in self._regionNames(kept):
+                            writer.copyMember(source, info, name)
+                writer.close()
+        else:
+            with zipfile.ZipFile(tempPath, "w", zipfile.ZIP_STORED, allowZip64=True) as z:
+                for path, name in files:
+                    z.write(path, name)
+                if kept:
+                    with zipfile.ZipFile(self.archivePath, allowZip64=True) as source:
+                        for info, name in self._regionNames(kept):
+                            self._extractMember(source, info, name, z)
+
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tempPath, filename)
+        log.info(u"Saved zip archive {0}: {1} files written, {2} region files copied".format(filename, len(files),
+                                                                                            len(kept)))
+        self._reopenSaved(filename)
+
+    @staticmethod
+    def _regionNames(kept):
+        """ (ZipInfo, region file name) of the kept members, in archive order. """
+        return [(info, "region/r.%s.%s.mca" % _regionCoords(info.filename))
+                for info in sorted(kept.itervalues(), key=lambda info: info.header_offset)]
+
+    @staticmethod
+    def _extractMember(source, info, name, dest):
+        """ Copy the member info of the ZipFile source into the ZipFile dest as name, stored uncompressed. Used for
+        archives too large for ArchiveWriter. """
+        zinfo = copy.copy(info)
+        zinfo.filename = name
+        zinfo.compress_type = zipfile.ZIP_STORED
+        with source.open(info) as member:
+            dest.writestr(zinfo, member.read())
+
+    def _reopenSaved(self, filename):
+        if filename == self.archivePath or self.archivePath is None:
+            # Everything in the folder's region directory is in the archive now.
+            self.closeRegions()
+            regionDir = self.getFolderPath("region", False)
+            for fn in os.listdir(regionDir):
+                os.remove(os.path.join(regionDir, fn))
+            self.openArchive(filename)
@@ -63,6 +63,10 @@ BlockRender documentation
                         elements makes up 32 bits) to view/change the values use
                         `.view('uint8')` to change the view of the array into uint8 type.
 
+  Once a section is meshed, ChunkCalculator calls quantize() on each of its block
+  renderers, which packs the float arrays into the 16 byte vertex_format.packedVertex
+  layout to save memory. Renderers whose arrays use another layout override quantize().
+
   To implement a block renderer either makeVertices or makeFaceVertices
   needs to be implemented. The base class BlockRenderer implements
   makeVertices in terms of makeFaceVertices, by iterating over the different
@@ -217,16 +221,23 @@ BlockRender documentation
 
 """
 
-from collections import defaultdict, deque
+from collections import defaultdict
 from datetime import datetime, timedelta
 from depths import DepthOffset
 from glutils import gl, Texture
+from chunk_culling import ChunkDrawSet, UNSECTIONED
+from chunk_scheduler import ChunkScheduler
+import greedy_mesh
+from mesh_cache import MeshCache
+import vertex_format
 from albow.resource import _2478aq_heot
 import logging
 import numpy
 from OpenGL import GL
 import pymclevel
 from pymclevel.materials import alphaMaterials, pocketMaterials
+from pymclevel import world_tiles
+from pymclevel.instrumentation import instruments
 import sys
 from config import config
 # import time
@@ -289,6 +300,13 @@ class ChunkRenderer(object):
         self.chunkPosition = chunkPosition
         self.bufferSize = 0
         self.renderstateLists = None
+        self.renderstateTops = None  # renderstate -> top of the section drawn by each list, see chunk_culling
+        self.geometryRange = (0, 0)  # lowest and highest y of the sections drawn by the lists
+        self.sectionCache = {}  # section y -> (owner, block renderers), see ChunkCalculator.computeGeometry
+        self.dirtySections = None  # y of the sections to mesh again, or None for all of them
+        self.invalidations = 0
+
+    surfaceMin = surfaceMax = 0  # see ChunkCalculator.opaqueCover
 
     @property
     def visibleLayers(self):
@@ -306,8 +324,10 @@ class ChunkRenderer(object):
 
             if states:
                 del self.renderstateLists[states]
+                self.renderstateTops.pop(states, None)
             else:
                 self.renderstateLists = None
+                self.renderstateTops = None
 
             self.needsRedisplay = True
             self.renderer.discardMasterList()
@@ -324,6 +344,9 @@ class ChunkRenderer(object):
             return
 
         lists = defaultdict(list)
+        tops = defaultdict(list)
+        height = self.renderer.level.Height
+        minY, maxY = height, 0
 
         showRedraw = self.renderer.showRedraw
 
@@ -340,24 +363,40 @@ class ChunkRenderer(object):
 
             l = blockRenderer.makeArrayList(self.chunkPosition, self.needsBlockRedraw and showRedraw)
             lists[blockRenderer.renderstate].append(l)
+            if hasattr(blockRenderer, 'y'):
+                tops[blockRenderer.renderstate].append(blockRenderer.y + 16)
+                minY = min(minY, blockRenderer.y)
+                maxY = max(maxY, blockRenderer.y + 16)
+            else:
+                tops[blockRenderer.renderstate].append(UNSECTIONED)
+                minY, maxY = 0, height
 
         if not (showRedraw and self.needsBlockRedraw):
             GL.glDisableClientState(GL.GL_COLOR_ARRAY)
 
         self.needsRedisplay = False
         self.renderstateLists = lists
+        self.renderstateTops = tops
+        self.geometryRange = (minY, max(minY, maxY))
 
     @property
     def needsBlockRedraw(self):
         return Layer.Blocks in self.invalidLayers
 
-    def invalidate(self, layers=None):
+    def invalidate(self, layers=None, sections=None):
+        """ sections lists the y of the block sections to mesh again; None invalidates the whole column. """
         if layers is None:
             layers = Layer.AllLayers
 
         if layers:
             layers = set(layers)
             self.invalidLayers.update(layers)
+            if Layer.Blocks in layers:
+                self.invalidations += 1
+                if sections is None:
+                    self.dirtySections = None
+                elif self.dirtySections is not None:
+                    self.dirtySections.update(sections)
             blockRenderers = [br for br in self.blockRenderers
                               if br.layer is Layer.Blocks
                               or br.layer not in layers]
@@ -379,6 +418,8 @@ class ChunkRenderer(object):
 
             # discard the standard detail renderers
             if minlod > 0:
+                self.sectionCache = {}
+                self.surfaceMin = self.surfaceMax = 0
                 blockRenderers = []
                 append = blockRenderers.append
                 for br in self.blockRenderers:
@@ -538,7 +579,7 @@ def makeVerticesFromModel(templates, dataMask=0):
                                              numpy.newaxis]  # xxx swap z with y using ^
                 
             vertexArray[..., 0:5] += templates[i, data][..., 0:5]
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices] & 15)[..., numpy.newaxis, :]
+            vertexArray[_ST] += texMap.at(blockIndices)[..., numpy.newaxis, :]
 
             vertexArray.view('uint8')[_RGB] = templates[i, data][..., 5][..., numpy.newaxis]
             vertexArray.view('uint8')[_A] = 0xFF
@@ -623,6 +664,67 @@ def createPrecomputedVertices():
 faceVertexTemplates = makeVertexTemplates()
 
 
+class ChunkSlab(object):
+    """
+    The block layers bottom to top of a chunk snapshot, read by ChunkCalculator.calcHighDetailFaces when it meshes
+    only some of a chunk's sections. The arrays are views of the snapshot's; arrays of a shorter chunk, such as a
+    128 high neighbour, are padded with zeros up to top.
+    """
+
+    def __init__(self, chunk, bottom, top):
+        self.chunkPosition = chunk.chunkPosition
+        self.world = chunk.world
+        for name in pymclevel.ChunkSnapshot.arrayNames:
+            setattr(self, name, self.layers(getattr(chunk, name), bottom, top))
+
+    @property
+    def materials(self):
+        return self.world.materials
+
+    @staticmethod
+    def layers(array, bottom, top):
+        if array is None:
+            return None
+        part = array[:, :, bottom:top]
+        if part.shape[2] < top - bottom:
+            padding = numpy.zeros(part.shape[:2] + (top - bottom - part.shape[2],), array.dtype)
+            part = numpy.concatenate((part, padding), axis=2)
+        return part
+
+
+class SectionTextures(object):
+    """
+    The texMap passed to BlockRenderer.makeVertices for one section. Calling it looks up the texture coordinates of
+    any blocks, as materials.blockTextures[blocks, blockData, direction]. at(blockIndices, direction) returns those of
+    the section's own blocks at blockIndices, a mask or index tuple over the section. It reads them from a table of
+    the whole section, built by the first renderer that asks and shared by the others.
+    """
+
+    def __init__(self, materials, blocks, blockData):
+        self.blockTextures = materials.blockTextures
+        self.blocks = blocks
+        self.blockData = blockData
+        self._table = None
+
+    def __call__(self, blocks, blockData=0, direction=slice(None)):
+        return self.blockTextures[blocks, blockData, direction]
+
+    @property
+    def table(self):
+        """ Texture coordinates of every block of the section, indexed [direction, x, z, y]. """
+        if self._table is None:
+            textures = self.blockTextures[self.blocks, self.blockData & 0xf]
+            self._table = numpy.ascontiguousarray(numpy.rollaxis(textures, 3))
+        return self._table
+
+    def at(self, blockIndices, direction=slice(None)):
+        if not isinstance(direction, slice):
+            return self.table[direction][blockIndices]
+        if not isinstance(blockIndices, tuple):
+            blockIndices = (blockIndices,)
+        return self.table[(direction,) + blockIndices].swapaxes(0, 1)
+
+
 class ChunkCalculator(object):
     cachedTemplate = None
     cachedTemplateHeight = 0
@@ -642,12 +744,15 @@ class ChunkCalculator(object):
 
         self.level = level
         self.makeRenderstates(level.materials)
+        self.meshCache = MeshCache(level)
+        self.tilePyramid = world_tiles.TilePyramid(level)
 
         # del xArray, zArray, yArray
         self.nullVertices = numpy.zeros((0,) * len(self.precomputedVertices[0].shape),
                                         dtype=self.precomputedVertices[0].dtype)
         config.settings.fastLeaves.addObserver(self)
         config.settings.roughGraphics.addObserver(self)
+        config.settings.greedyMeshing.addObserver(self)
 
     class renderstatePlain(object):
         @classmethod
@@ -785,6 +890,13 @@ class ChunkCalculator(object):
         self.exposedMaterialMap = numpy.array(materialMap)
         self.addTransparentMaterials(self.exposedMaterialMap, materialCount)
 
+        # Block ID tables for the slab and door passes of calcHighDetailFaces and computeGeometry
+        self.slabTable = numpy.zeros((pymclevel.materials.id_limit,), bool)
+        self.slabTable[[b.ID for b in alphaMaterials.allBlocks if "Slab" in b.name]] = True
+        self.doorTable = numpy.zeros((pymclevel.materials.id_limit,), bool)
+        if DoorRenderer in self.blockRendererClasses:
+            self.doorTable[DoorRenderer.blocktypes] = True
+
     def addTransparentMaterials(self, mats, materialCount):
         logging.debug("renderer::ChunkCalculator: Dynamically adding transparent materials.")
         for b in self.level.materials:
@@ -810,17 +922,7 @@ class ChunkCalculator(object):
         lod = cr.detailLevel
         cx, cz = cr.chunkPosition
         level = cr.renderer.level
-        try:
-            chunk = level.getChunk(cx, cz)
-        except Exception as e:
-            if "Session lock lost" in e.message:
-                yield
-                return
-            logging.warn(u"Error reading chunk: %s", e)
-            yield
-            return
 
-        yield
         brs = []
         append = brs.append
         classes = (
@@ -835,6 +937,7 @@ class ChunkCalculator(object):
         )
         existingBlockRenderers = dict(((type(b), b) for b in cr.blockRenderers))
 
+        rebuilt = []
         for blockRendererClass in classes:
             if cr.detailLevel not in blockRendererClass.detailLevels:
                 continue
@@ -845,11 +948,31 @@ class ChunkCalculator(object):
                     append(existingBlockRenderers[blockRendererClass])
 
                 continue
+            rebuilt.append(blockRendererClass)
 
+        # Terrain past the high detail distance is drawn from the world map tiles, without reading the chunk.
+        needsChunk = (lod == 0 and Layer.Blocks in cr.invalidLayers) or not all(c.usesWorldTiles for c in rebuilt)
+        try:
+            chunk = level.getChunk(cx, cz) if needsChunk else None
+            tile = self.tilePyramid.chunkTile(cx, cz) if any(c.usesWorldTiles for c in rebuilt) else None
+        except Exception as e:
+            if "Session lock lost" in e.message:
+                yield
+                return
+            logging.warn(u"Error reading chunk: %s", e)
+            yield
+            return
+
+        yield
+        for blockRendererClass in rebuilt:
             br = blockRendererClass(self)
             br.detailLevel = cr.detailLevel
 
-            for _ in br.makeChunkVertices(chunk):
+            if br.usesWorldTiles:
+                vertices = br.makeTileVertices(tile, level.Height)
+            else:
+                vertices = br.makeChunkVertices(chunk)
+            for _ in instruments.iterate("vertices " + blockRendererClass.__name__, vertices):
                 yield
             append(br)
 
@@ -857,8 +980,15 @@ class ChunkCalculator(object):
 
         # Recalculate high detail blocks if needed, otherwise retain the high detail renderers
         if lod == 0 and Layer.Blocks in cr.invalidLayers:
-            for _ in self.calcHighDetailFaces(cr, blockRenderers):
-                yield
+            cr.surfaceMin, cr.surfaceMax = (0, 0) if cr.renderer.showHiddenOres else self.opaqueCover(chunk)
+            # The disk cache is only consulted for a chunk's first meshing; after an edit, the section cache is faster.
+            cached = None if cr.sectionCache else self.meshCache.load(cr, self)
+            if cached is not None:
+                blockRenderers.extend(cached)
+            else:
+                for _ in self.calcHighDetailFaces(cr, blockRenderers):
+                    yield
+                self.meshCache.save(cr, self, blockRenderers)
         else:
             blockRenderers.extend(br for br in cr.blockRenderers if not isinstance(br, classes))
 
@@ -869,6 +999,27 @@ class ChunkCalculator(object):
         cr.vertexArraysDone()
         raise StopIteration
 
+    def opaqueCover(self, chunk):
+        """
+        Find the cover of each column of chunk: the top run of plain opaque cubes, from the column's highest one down
+        to the first block that is not one. Returns (bottom, top): the lowest y of the covers over all columns, and
+        one above the highest y. A section whose top is at or below bottom lies under the cover of every column.
+        Columns without a plain opaque cube count as 0.
+        """
+        opaque = self.exposedMaterialMap[chunk.Blocks] == GenericBlockRenderer.materialIndex
+        height = opaque.shape[2]
+        covered = opaque.any(axis=2)
+        tops = height - 1 - opaque[:, :, ::-1].argmax(axis=2)
+
+        # The highest gap under each column's top is the block below its cover
+        gaps = ~opaque
+        gaps[numpy.arange(height) >= tops[..., numpy.newaxis]] = False
+        bottoms = height - gaps[:, :, ::-1].argmax(axis=2)
+        bottoms[~gaps.any(axis=2)] = 0
+        bottoms[~covered] = 0
+        tops[~covered] = -1
+        return int(bottoms.min()), int(tops.max()) + 1
+
     @staticmethod
     def getNeighboringChunks(chunk):
         cx, cz = chunk.chunkPosition
@@ -1041,47 +1192,93 @@ class ChunkCalculator(object):
         # chunkBlocks and chunkLights shall be indexed [x,z,y] to follow infdev's convention
         cx, cz = cr.chunkPosition
         level = cr.renderer.level
+        height = level.Height
+        invalidations = cr.invalidations
 
-        chunk = level.getChunk(cx, cz)
+        # Mesh from read-only snapshots, so edits made while this yields do not show up in half of the mesh
+        chunk = level.getChunk(cx, cz).snapshot()
 #         if isinstance(chunk, pymclevel.level.FakeChunk):
 #             return
         neighboringChunks = self.getNeighboringChunks(chunk)
 
-        areaBlocks = self.getAreaBlocks(chunk, neighboringChunks)
-        yield
+        # Once every section is cached, only the invalidated ones are meshed again. The area arrays and face masks
+        # then cover those sections and the block layer on either side of them, not the whole column.
+        sections = range(0, height, 16)
+        owner = self, chunk.materials
+        if cr.dirtySections is not None and len(cr.sectionCache) == len(sections) and \
+                all(cached[0] == owner for cached in cr.sectionCache.itervalues()):
+            sections = sorted(cr.dirtySections)
+
+        if sections:
+            bottom, top = max(sections[0] - 1, 0), min(sections[-1] + 17, height)
+            chunk = ChunkSlab(chunk, bottom, top)
+            neighboringChunks = dict((face, ChunkSlab(neighbor.snapshot(), bottom, top))
+                                     for face, neighbor in neighboringChunks.iteritems())
+
+            with instruments.stage("area arrays"):
+                areaBlocks = self.getAreaBlocks(chunk, neighboringChunks)
+            yield
 
-        areaBlockLights = self.getAreaBlockLights(chunk, neighboringChunks)
-        yield
+            with instruments.stage("area arrays"):
+                areaBlockLights = self.getAreaBlockLights(chunk, neighboringChunks)
+            yield
 
-        allSlabs = set([b.ID for b in alphaMaterials.allBlocks if "Slab" in b.name])
-        for slab in allSlabs:
-            slabs = areaBlocks == slab
+            # Slabs are lit by the block above them
+            slabs = self.slabTable[areaBlocks]
             if slabs.any():
                 areaBlockLights[slabs] = areaBlockLights[:, :, 1:][slabs[:, :, :-1]]
             yield
 
-        showHiddenOres = cr.renderer.showHiddenOres
-        if showHiddenOres:
-            facingMats = self.hiddenOreMaterials[areaBlocks]
-        else:
-            facingMats = self.exposedMaterialMap[areaBlocks]
+            with instruments.stage("face masks"):
+                showHiddenOres = cr.renderer.showHiddenOres
+                if showHiddenOres:
+                    facingMats = self.hiddenOreMaterials[areaBlocks]
+                else:
+                    facingMats = self.exposedMaterialMap[areaBlocks]
 
-        yield
+            yield
 
-        if self.roughGraphics:
-            areaBlockMats = self.roughMaterials[areaBlocks]
-        else:
-            areaBlockMats = self.materialMap[areaBlocks]
+            with instruments.stage("face masks"):
+                if self.roughGraphics:
+                    areaBlockMats = self.roughMaterials[areaBlocks]
+                else:
+                    areaBlockMats = self.materialMap[areaBlocks]
 
-        facingBlockIndices = self.getFacingBlockIndices(areaBlocks, facingMats)
-        yield
+                facingBlockIndices = self.getFacingBlockIndices(areaBlocks, facingMats)
+            yield
+        else:
+            bottom, areaBlockMats, facingBlockIndices, areaBlockLights = 0, None, None, None
 
-        for _ in self.computeGeometry(chunk, areaBlockMats, facingBlockIndices, areaBlockLights, cr, blockRenderers):
+        for _ in self.computeGeometry(chunk, areaBlockMats, facingBlockIndices, areaBlockLights, cr, blockRenderers,
+                                      sections, bottom):
             yield
 
-    def computeGeometry(self, chunk, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer, blockRenderers):
-        blocks, blockData = chunk.Blocks, chunk.Data
-        blockData &= 0xf
+        # An invalidation that came in while this yielded still needs its sections meshed
+        if cr.invalidations == invalidations:
+            cr.dirtySections = set()
+
+    def computeGeometry(self, chunk, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer, blockRenderers,
+                        sections=None, bottom=0):
+        """
+        Mesh the sections at the heights in sections, all of them by default. chunk and the area arrays hold the
+        block layers from bottom up. The other sections keep the renderers in the chunk renderer's section cache.
+        """
+        if sections is None:
+            sections = range(0, chunk.world.Height, 16)
+
+        sectionCache = dict(chunkRenderer.sectionCache)
+        if sections:
+            for _ in self.computeSections(chunk, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer,
+                                          sections, bottom, sectionCache):
+                yield
+
+        for y in sorted(sectionCache):
+            blockRenderers.extend(sectionCache[y][1])
+        chunkRenderer.sectionCache = sectionCache
+
+    def computeSections(self, chunk, areaBlockMats, facingBlockIndices, areaBlockLights, chunkRenderer, sections,
+                        bottom, sectionCache):
+        blocks, blockData = chunk.Blocks, chunk.Data & 0xf
         blockMaterials = areaBlockMats[1:-1, 1:-1, 1:-1]
         if self.roughGraphics:
             blockMaterials.clip(0, 1, blockMaterials)
@@ -1093,48 +1290,58 @@ class ChunkCalculator(object):
             # side is on the upper part. So here we combine the metadata of the bottom part
             # with the top to form 0-32 metadata(which would be used in door renderer).
             #
-            copied = False
-            for door in DoorRenderer.blocktypes:
-                doors = blocks == door
-                if doors.any():
-                    if not copied:
-                        # copy if required but only once
-                        blockData = blockData.copy()
-                        copied = True
-                    # only accept lower part one block below upper part
-                    valid = doors[:, :, :-1] & doors[:, :, 1:] & (blockData[:, :, :-1] < 8) & (blockData[:, :, 1:] >= 8)
-                    mask = valid.nonzero()
-                    upper_mask = (mask[0], mask[1], mask[2]+1)
-                    blockData[mask] += (blockData[upper_mask] - 8) * 16
-                    blockData[upper_mask] = blockData[mask] + 8
+            doors = self.doorTable[blocks]
+            if doors.any():
+                # only accept lower part one block below an upper part of the same door
+                valid = (doors[:, :, :-1] & (blocks[:, :, :-1] == blocks[:, :, 1:]) &
+                         (blockData[:, :, :-1] < 8) & (blockData[:, :, 1:] >= 8))
+                mask = valid.nonzero()
+                upper_mask = (mask[0], mask[1], mask[2]+1)
+                blockData[mask] += (blockData[upper_mask] - 8) * 16
+                blockData[upper_mask] = blockData[mask] + 8
 
         sx = sz = slice(0, 16)
         asx = asz = slice(0, 18)
 
-        for y in xrange(0, chunk.world.Height, 16):
-            sy = slice(y, y + 16)
-            asy = slice(y, y + 18)
-
-            for _ in self.computeCubeGeometry(
-                    y,
-                    blockRenderers,
-                    blocks[sx, sz, sy],
-                    blockData[sx, sz, sy],
-                    chunk.materials,
-                    blockMaterials[sx, sz, sy],
-                    [f[sx, sz, sy] for f in facingBlockIndices],
-                    areaBlockLights[asx, asz, asy],
-                    chunkRenderer):
-                yield
+        # Cache entries are owned by this calculator and material set; a new calculator meshes every section again.
+        owner = self, chunk.materials
+        for y in sections:
+            sy = slice(y - bottom, y - bottom + 16)
+            asy = slice(y - bottom, y - bottom + 18)
+
+            sectionMaterials = blockMaterials[sx, sz, sy]
+            sectionFaces = [f[sx, sz, sy] for f in facingBlockIndices]
+            sectionRenderers = []
+            if not self.sectionIsHidden(sectionMaterials, sectionFaces):
+                for _ in self.computeCubeGeometry(
+                        y,
+                        sectionRenderers,
+                        blocks[sx, sz, sy],
+                        blockData[sx, sz, sy],
+                        chunk.materials,
+                        sectionMaterials,
+                        sectionFaces,
+                        areaBlockLights[asx, asz, asy],
+                        chunkRenderer):
+                    yield
+
+            sectionCache[y] = owner, sectionRenderers
+
+    @staticmethod
+    def sectionIsHidden(blockMaterials, facingBlockIndices):
+        """ True if a section makes no geometry: it is all air, or only holds plain cubes with no exposed face. """
+        if not blockMaterials.any():
+            return True
+        if blockMaterials.max() > GenericBlockRenderer.materialIndex:
+            return False
+        return not any((faces & blockMaterials).any() for faces in facingBlockIndices)
 
     def computeCubeGeometry(self, y, blockRenderers, blocks, blockData, materials, blockMaterials, facingBlockIndices,
                             areaBlockLights, chunkRenderer):
         materialCounts = numpy.bincount(blockMaterials.ravel())
         
         append = blockRenderers.append
-        
-        def texMap(blocks, blockData=0, direction=slice(None)):
-            return materials.blockTextures[blocks, blockData, direction]  # xxx slow
+        texMap = SectionTextures(materials, blocks, blockData)
 
         for blockRendererClass in self.blockRendererClasses:
             mi = blockRendererClass.materialIndex
@@ -1144,9 +1351,11 @@ class ChunkCalculator(object):
             blockRenderer = blockRendererClass(self)
             blockRenderer.y = y
             blockRenderer.materials = materials
-            for _ in blockRenderer.makeVertices(facingBlockIndices, blocks, blockMaterials, blockData, areaBlockLights,
-                                                texMap):
+            vertices = blockRenderer.makeVertices(facingBlockIndices, blocks, blockMaterials, blockData,
+                                                  areaBlockLights, texMap)
+            for _ in instruments.iterate("vertices " + blockRendererClass.__name__, vertices):
                 yield
+            blockRenderer.quantize()
             append(blockRenderer)
 
             yield
@@ -1169,6 +1378,7 @@ class Layer:
 class BlockRenderer(object):
     detailLevels = (0,)
     layer = Layer.Blocks
+    usesWorldTiles = False  # built from the chunk's world map tile instead of the chunk, see makeTileVertices
     directionOffsets = {
         pymclevel.faces.FaceXDecreasing: numpy.s_[:-2, 1:-1, 1:-1],
         pymclevel.faces.FaceXIncreasing: numpy.s_[2:, 1:-1, 1:-1],
@@ -1193,10 +1403,18 @@ class BlockRenderer(object):
     def setAlpha(self, alpha):
         "alpha is an unsigned byte value"
         for a in self.vertexArrays:
-            a.view('uint8')[_RGBA][..., 3] = alpha
+            if vertex_format.isPacked(a):
+                a["rgba"][..., 3] = alpha
+            else:
+                a.view('uint8')[_RGBA][..., 3] = alpha
 
     def bufferSize(self):
-        return sum(a.size for a in self.vertexArrays) * 4
+        return sum(a.nbytes for a in self.vertexArrays)
+
+    def quantize(self):
+        """ Pack the vertex arrays built in the float layout into vertex_format.packedVertex. """
+        self.vertexArrays = [vertex_format.quantize(a) if vertex_format.isFloatLayout(a) else a
+                             for a in self.vertexArrays]
 
     def getMaterialIndices(self, blockMaterials):
         return blockMaterials == self.materialIndex
@@ -1246,6 +1464,9 @@ class BlockRenderer(object):
     def drawFaceVertices(self, buf):
         if not len(buf):
             return
+        if vertex_format.isPacked(buf):
+            self.drawPackedVertices(buf)
+            return
         stride = elementByteLength
         
         GL.glVertexPointer(3, GL.GL_FLOAT, stride, (buf.ravel()))
@@ -1254,6 +1475,23 @@ class BlockRenderer(object):
 
         GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
 
+    def drawPackedVertices(self, buf):
+        stride = vertex_format.packedVertexByteLength
+        shorts = buf.view(dtype=numpy.int16).ravel()
+
+        with gl.glPushMatrix(GL.GL_MODELVIEW):
+            positionScale = 1. / vertex_format.POSITION_SCALE
+            GL.glScale(positionScale, positionScale, positionScale)
+            with gl.glPushMatrix(GL.GL_TEXTURE):
+                texScale = 1. / vertex_format.TEXCOORD_SCALE
+                GL.glScale(texScale, texScale, 1.)
+
+                GL.glVertexPointer(3, GL.GL_SHORT, stride, shorts)
+                GL.glTexCoordPointer(2, GL.GL_SHORT, stride, shorts[4:])
+                GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, stride, (buf.view(dtype=numpy.uint8).ravel()[12:]))
+
+                GL.glDrawArrays(GL.GL_QUADS, 0, len(buf) * 4)
+
 
 class EntityRendererGeneric(BlockRenderer):
     renderstate = ChunkCalculator.renderstateEntity
@@ -1521,6 +1759,7 @@ class ChunkBorderRenderer(EntityRendererGeneric):
 class LowDetailBlockRenderer(BlockRenderer):
     renderstate = ChunkCalculator.renderstateLowDetail
     detailLevels = (1,)
+    usesWorldTiles = True
 
     def drawFaceVertices(self, buf):
         if not len(buf):
@@ -1539,47 +1778,32 @@ class LowDetailBlockRenderer(BlockRenderer):
             va.view('uint8')[..., -1] = alpha
 
     def makeChunkVertices(self, ch):
-        step = 1
-        level = ch.world
-        vertexArrays = []
-        blocks = ch.Blocks
-        heightMap = ch.HeightMap
-
-        heightMap = heightMap[::step, ::step]
-        blocks = blocks[::step, ::step]
-
-        if 0 in blocks.shape:
-            return
-
-        chunkWidth, chunkLength, chunkHeight = blocks.shape
-        blockIndices = numpy.zeros((chunkWidth, chunkLength, chunkHeight), bool)
+        for _ in self.makeTileVertices(world_tiles.chunkTile(ch), ch.world.Height):
+            yield
 
-        gridaxes = list(numpy.indices((chunkWidth, chunkLength)))
-        h = numpy.swapaxes(heightMap - 1, 0, 1)[:chunkWidth, :chunkLength]
-        numpy.clip(h, 0, chunkHeight - 1, out=h)
+    def makeTileVertices(self, tile, worldHeight, step=1, drawn=None):
+        """
+        Build the quads of a world map tile (see pymclevel.world_tiles): a top quad over each column, and at detail
+        level 1 two side quads reaching down to its lowest neighbour. Each sample of the tile covers step x step
+        columns. drawn, if given, is a mask of the samples to make quads for.
+        """
+        vertexArrays = []
+        heights, tops, sides = tile
 
-        gridaxes = [gridaxes[0], gridaxes[1], h]
+        chunkWidth, chunkLength = heights.shape
+        h = numpy.maximum(heights, 0)
 
         depths = numpy.zeros((chunkWidth, chunkLength), dtype='uint16')
         depths[1:-1, 1:-1] = reduce(numpy.minimum, (h[1:-1, :-2], h[1:-1, 2:], h[:-2, 1:-1]), h[2:, 1:-1])
         yield
 
-        try:
-            topBlocks = blocks[gridaxes]
-            nonAirBlocks = (topBlocks != 0)
-            blockIndices[gridaxes] = nonAirBlocks
-            h += 1
-            numpy.clip(h, 0, chunkHeight - 1, out=h)
-            overblocks = blocks[gridaxes][nonAirBlocks].ravel()
-
-        except ValueError, e:
-            raise ValueError(str(e.args) + "Chunk shape: {0}".format(blockIndices.shape), sys.exc_info()[-1])
-
+        nonAirBlocks = heights >= 0
+        if drawn is not None:
+            nonAirBlocks &= drawn
         if nonAirBlocks.any():
-            blockTypes = blocks[blockIndices]
-
-            flatcolors = level.materials.flatColors[blockTypes, ch.Data[blockIndices] & 0xf][:, numpy.newaxis, :]
-            x, z, y = blockIndices.nonzero()
+            x, z = nonAirBlocks.nonzero()
+            y = h[nonAirBlocks]
+            flatcolors = tops[nonAirBlocks][:, numpy.newaxis, :]
 
             yield
             vertexArray = numpy.zeros((len(x), 4, 4), dtype='float32')
@@ -1591,11 +1815,8 @@ class LowDetailBlockRenderer(BlockRenderer):
 
             va0[..., :3] += faceVertexTemplates[pymclevel.faces.FaceYIncreasing, ..., :3]
 
-            overmask = overblocks > 0
-            flatcolors[overmask] = level.materials.flatColors[:, 0][overblocks[overmask]][:, numpy.newaxis]
-
             if self.detailLevel == 2:
-                heightfactor = (y / float(2.0 * ch.world.Height)) + 0.5
+                heightfactor = (y / float(2.0 * worldHeight)) + 0.5
                 flatcolors[..., :3] = flatcolors[..., :3].astype(float) * heightfactor[:, numpy.newaxis, numpy.newaxis]
 
             _RGBA = numpy.s_[..., 12:16]
@@ -1605,6 +1826,12 @@ class LowDetailBlockRenderer(BlockRenderer):
             va0[_XYZ][:, :, 2] *= step
 
             yield
+            greedy = self.chunkCalculator.greedyMeshing
+            if greedy:
+                colors = va0.view('uint8')[:, 0, 12:16].copy().view('uint32')[:, 0].astype('int64')
+                keys = (y.astype('int64') << 32) | colors
+                va0 = greedy_mesh.mergeGridQuads(va0, x, z, keys, (chunkWidth, chunkLength))
+
             if self.detailLevel == 2:
                 self.vertexArrays = [va0]
                 return
@@ -1619,17 +1846,17 @@ class LowDetailBlockRenderer(BlockRenderer):
             va1[_XYZ][:, :, 0] *= step
             va1[_XYZ][:, :, 2] *= step
 
-            flatcolors = flatcolors.astype(float) * 0.8
-
-            va1.view('uint8')[_RGBA] = flatcolors
-            grassmask = topBlocks[nonAirBlocks] == 2
-            # color grass sides with dirt's color
-            va1.view('uint8')[_RGBA][grassmask] = level.materials.flatColors[:, 0][[3]][:, numpy.newaxis]
+            va1.view('uint8')[_RGBA] = sides[nonAirBlocks][:, numpy.newaxis, :]
 
             va2 = numpy.array(va1)
             va2[_XYZ][:, (1, 2), 0] += step
             va2[_XYZ][:, (0, 3), 0] -= step
 
+            if greedy:
+                exposed = greedy_mesh.exposedColumns(y, depths[nonAirBlocks].ravel())
+                va1 = va1[exposed]
+                va2 = va2[exposed]
+
             vertexArrays = [va1, va2, va0]
 
         self.vertexArrays = vertexArrays
@@ -1655,12 +1882,11 @@ class GenericBlockRenderer(BlockRenderer):
             blockIndices = materialIndices & exposedFaceIndices
 
             theseBlocks = blocks[blockIndices]
-            bdata = blockData[blockIndices]
             vertexArray = self.makeTemplate(direction, blockIndices)
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(theseBlocks, bdata, direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
 
             vertexArray.view('uint8')[_RGB] *= facingBlockLight[blockIndices][..., numpy.newaxis, numpy.newaxis]
             if self.materials.name in ("Alpha", "Pocket"):
@@ -1782,7 +2008,7 @@ class PlantBlockRenderer(BlockRenderer):
         theseBlocks = blocks[blockIndices]
 
         bdata = blockData[blockIndices]
-        texes = texMap(blocks[blockIndices], bdata, 0)
+        texes = texMap.at(blockIndices, 0)
 
         blockLight = areaBlockLights[1:-1, 1:-1, 1:-1]
         lights = blockLight[blockIndices][..., numpy.newaxis, numpy.newaxis]
@@ -1961,7 +2187,7 @@ class TorchBlockRenderer(BlockRenderer):
     def makeTorchVertices(self, facingBlockIndices, blocks, blockMaterials, blockData, areaBlockLights, texMap):
         blockIndices = self.getMaterialIndices(blockMaterials)
         torchOffsets = self.torchOffsets[blockData[blockIndices]]
-        texes = texMap(blocks[blockIndices], blockData[blockIndices])
+        texes = texMap.at(blockIndices)
         yield
         arrays = []
         append = arrays.append
@@ -2275,7 +2501,7 @@ class SnowBlockRenderer(BlockRenderer):
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], 0)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, 0)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
 
             if direction == pymclevel.faces.FaceYIncreasing:
@@ -2318,7 +2544,7 @@ class CarpetBlockRenderer(BlockRenderer):
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], 0)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, 0)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
 
             if direction == pymclevel.faces.FaceYIncreasing:
@@ -2356,7 +2582,7 @@ class CactusBlockRenderer(BlockRenderer):
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
 
             if direction == pymclevel.faces.FaceXIncreasing:
@@ -2395,7 +2621,7 @@ class PaneBlockRenderer(BlockRenderer):  #Basic no thickness panes, add more fac
             vertexArray = self.makeTemplate(direction, blockIndices)
             if not len(vertexArray):
                 continue
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
 
             if direction == pymclevel.faces.FaceXIncreasing:
@@ -2434,7 +2660,7 @@ class PlateBlockRenderer(BlockRenderer):  #suggestions to make this the proper s
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], 0)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, 0)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
             if direction == pymclevel.faces.FaceYIncreasing:
                 vertexArray[_XYZ][..., 1] -= 0.937
@@ -2473,7 +2699,7 @@ class EnchantingBlockRenderer(
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
             if direction == pymclevel.faces.FaceYIncreasing:
                 vertexArray[_XYZ][..., 1] -= 0.25
@@ -2508,7 +2734,7 @@ class DaylightBlockRenderer(BlockRenderer):
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
             if direction == pymclevel.faces.FaceYIncreasing:
                 vertexArray[_XYZ][..., 1] -= 0.625
@@ -2546,7 +2772,7 @@ class BedBlockRenderer(BlockRenderer):
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
             if direction == pymclevel.faces.FaceYIncreasing:
                 vertexArray[_XYZ][..., 1] -= 0.438
@@ -2579,7 +2805,7 @@ class CakeBlockRenderer(BlockRenderer):  #Only shows whole cakes
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
 
             if direction == pymclevel.faces.FaceYIncreasing:
@@ -2620,7 +2846,7 @@ class RepeaterBlockRenderer(BlockRenderer):  #Sticks would be nice
             if not len(vertexArray):
                 continue
 
-            vertexArray[_ST] += texMap(blocks[blockIndices], blockData[blockIndices], direction)[:, numpy.newaxis, 0:2]
+            vertexArray[_ST] += texMap.at(blockIndices, direction)[:, numpy.newaxis, 0:2]
             vertexArray.view('uint8')[_RGB] *= lights
             if direction == pymclevel.faces.FaceYIncreasing:
                 vertexArray[_XYZ][..., 1] -= 0.875
@@ -3190,6 +3416,173 @@ class IceBlockRenderer(BlockRenderer):
 from glutils import DisplayList
 
 
+class FarTile(object):
+    """ A world map tile drawn by FarTerrain. origin and size are in chunks, hidden is the part of the tile left out. """
+
+    def __init__(self, origin, size, hidden, generations, detailLevel, blockRenderer):
+        self.origin = origin
+        self.size = size
+        self.hidden = hidden
+        self.generations = generations
+        self.detailLevel = detailLevel
+        self.blockRenderer = blockRenderer
+        self.displayList = None
+
+
+class FarTerrain(object):
+    """
+    Terrain drawn past an MCRenderer's chunk renderers from the world map tiles of pymclevel.world_tiles, so a zoomed
+    out view does not read the chunks it shows. The regions within regionRange times the chunk renderers' distance
+    are drawn from their level 1 tiles. The blocks of regions within superRange times that distance are drawn from
+    level 2 tiles. The part of a tile that is drawn with more detail is left out.
+
+    Tiles are built by the renderer's work iterator once it has no chunk left to mesh. Their display lists are
+    compiled when they are first drawn.
+    """
+
+    regionRange = 4
+    superRange = 8
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.wanted = []  # (key, hidden) of the tiles to draw, closest first
+        self.tiles = {}  # (level, tx, tz) -> FarTile
+        self.needsWork = False
+
+    @property
+    def pyramid(self):
+        return self.renderer.chunkCalculator.tilePyramid
+
+    @staticmethod
+    def layout(key):
+        """ Return the origin and size, in chunks, and the columns per sample of the tile key. """
+        level, tx, tz = key
+        if level == 1:
+            return (tx << 5, tz << 5), 32, world_tiles.REGION_STEP
+        size = 32 * world_tiles.SUPER_REGIONS
+        return (tx * size, tz * size), size, world_tiles.SUPER_STEP
+
+    def regionsOf(self, key):
+        level, tx, tz = key
+        if level == 1:
+            return [(tx, tz)]
+        return self.pyramid.superRegions(tx, tz)
+
+    def generations(self, regions):
+        return tuple(self.pyramid.region(*rPos).generation for rPos in regions)
+
+    def update(self, cx, cz, d):
+        """ Choose the tiles to draw around the chunk cx, cz, when chunk renderers are loaded within d chunks. """
+        chunkArea = (cx - d, cz - d, cx + d + 1, cz + d + 1)
+        areas = []
+        for rng, size in ((self.regionRange, 32), (self.superRange, 32 * world_tiles.SUPER_REGIONS)):
+            r = d * rng
+            areas.append(((cx - r) // size * size, (cz - r) // size * size,
+                          ((cx + r) // size + 1) * size, ((cz + r) // size + 1) * size, size))
+
+        wanted = []
+        for level, area, covered in ((1, areas[0], chunkArea), (2, areas[1], areas[0][:4])):
+            x0, z0, x1, z1, size = area
+            for ox in xrange(x0, x1, size):
+                for oz in xrange(z0, z1, size):
+                    hidden = tuple(min(max(v - o, 0), size) for v, o in zip(covered, (ox, oz, ox, oz)))
+                    if hidden == (0, 0, size, size):
+                        continue
+                    distance = max(abs(ox + size / 2 - cx), abs(oz + size / 2 - cz))
+                    wanted.append((distance, (level, ox // size, oz // size), hidden))
+        wanted.sort()
+        self.wanted = [(key, hidden) for distance, key, hidden in wanted]
+
+        keys = set(key for key, hidden in self.wanted)
+        for key in self.tiles.keys():
+            if key not in keys:
+                self.forget(key)
+        self.needsWork = True
+
+        self.pyramid.trim(set((rx, rz) for rx in xrange((cx - d) >> 5, ((cx + d) >> 5) + 1)
+                              for rz in xrange((cz - d) >> 5, ((cz + d) >> 5) + 1)))
+
+    def invalidateChunk(self, cx, cz):
+        self.needsWork = True
+
+    def nextWork(self):
+        """ Return a generator that builds the closest tile that is missing or out of date, or None. """
+        if not self.needsWork:
+            return None
+        detailLevel = 2 if self.renderer.overheadMode else 1
+        pyramid = self.pyramid
+        for key, hidden in self.wanted:
+            regions = self.regionsOf(key)
+            tile = self.tiles.get(key)
+            if (tile is None or tile.hidden != hidden or tile.detailLevel != detailLevel
+                    or not all(pyramid.regionIsCurrent(*rPos) for rPos in regions)
+                    or tile.generations != self.generations(regions)):
+                return self.buildTile(key, hidden, detailLevel)
+        self.needsWork = False
+        return None
+
+    def buildTile(self, key, hidden, detailLevel):
+        pyramid = self.pyramid
+        regions = self.regionsOf(key)
+        for rPos in regions:
+            for _ in pyramid.updateRegionIter(*rPos):
+                yield
+
+        level, tx, tz = key
+        origin, size, step = self.layout(key)
+        tile = pyramid.regionTile(tx, tz) if level == 1 else pyramid.superTile(tx, tz)
+        drawn = numpy.ones(tile[0].shape, bool)
+        x0, z0, x1, z1 = [v * 16 // step for v in hidden]
+        drawn[x0:x1, z0:z1] = False
+
+        br = LowDetailBlockRenderer(self.renderer.chunkCalculator)
+        br.detailLevel = detailLevel
+        for _ in br.makeTileVertices(tile, self.renderer.level.Height, step, drawn):
+            yield
+
+        self.forget(key)
+        self.tiles[key] = FarTile(origin, size, hidden, self.generations(regions), detailLevel, br)
+        self.renderer.needsRedraw = True
+
+    def forget(self, key):
+        tile = self.tiles.pop(key, None)
+        if tile is not None and tile.displayList is not None:
+            gl.glDeleteLists(tile.displayList, 1)
+
+    def discard(self):
+        for key in self.tiles.keys():
+            self.forget(key)
+        self.needsWork = True
+
+    def draw(self):
+        if not self.tiles:
+            return
+        tiles = self.tiles.values()
+        uncompiled = [tile for tile in tiles if tile.displayList is None]
+        if uncompiled:
+            GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+            for tile in uncompiled:
+                tile.displayList = tile.blockRenderer.makeArrayList(tile.origin, False)
+            GL.glDisableClientState(GL.GL_COLOR_ARRAY)
+
+        frustum = self.renderer.viewingFrustum
+        if frustum is not None:
+            ox, oy, oz = self.renderer.origin
+            halfHeight = self.renderer.level.Height / 2
+            centres = numpy.array([(tile.origin[0] * 16 + tile.size * 8 + ox, halfHeight + oy,
+                                    tile.origin[1] * 16 + tile.size * 8 + oz, 1.0) for tile in tiles])
+            radii = numpy.array([numpy.sqrt(2 * (tile.size * 8) ** 2 + halfHeight ** 2) for tile in tiles])
+            visible = frustum.visible(centres, radii[:, numpy.newaxis])
+            tiles = [tile for tile, v in zip(tiles, visible) if v]
+        if not tiles:
+            return
+
+        renderstate = ChunkCalculator.renderstateLowDetail
+        renderstate.bind()
+        GL.glCallLists(numpy.array([tile.displayList for tile in tiles], dtype='uint32'))
+        renderstate.release()
+
+
 class MCRenderer(object):
     isPreviewer = False
 
@@ -3200,13 +3593,15 @@ class MCRenderer(object):
 
         self.bufferUsage = 0
 
-        self.invalidChunkQueue = deque()
+        self.scheduler = ChunkScheduler()
+        self.farTerrain = FarTerrain(self)
         self._chunkWorker = None
         self.chunkRenderers = {}
+        self.boxInvalidated = set()  # chunks invalidated by section since the last invalidateChangedChunks
         self.loadableChunkMarkers = DisplayList()
         self.visibleLayers = set(Layer.AllLayers)
 
-        self.masterLists = None
+        self.drawSet = None
 
         alpha *= 255
         self.alpha = (int(alpha) & 0xff)
@@ -3218,11 +3613,11 @@ class MCRenderer(object):
 
         self.chunkSamples = [timedelta(0, 0, 0)] * 15
 
-        self.chunkIterator = None
-
         config.settings.fastLeaves.addObserver(self)
 
         config.settings.roughGraphics.addObserver(self)
+        config.settings.greedyMeshing.addObserver(self)
+        config.settings.drawFarTerrain.addObserver(self)
         config.settings.showHiddenOres.addObserver(self)
         config.settings.vertexBufferLimit.addObserver(self)
 
@@ -3370,12 +3765,14 @@ class MCRenderer(object):
         """ this probably warrants creating a new renderer """
         self.stopWork()
 
+        if self.chunkCalculator:
+            self.chunkCalculator.tilePyramid.save()
         self._level = level
         self.oldPosition = None
         self.position = (0, 0, 0)
         self.chunkCalculator = None
 
-        self.invalidChunkQueue = deque()
+        self.scheduler = ChunkScheduler(level.Height if level else 256)
 
         self.discardAllChunks()
 
@@ -3400,33 +3797,30 @@ class MCRenderer(object):
             d = self.effectiveViewDistance
         else:
             d = distance
+        if self.overheadMode:
+            d *= 2 if self.farTerrainEnabled else 4
+        if self.farTerrainEnabled:
+            self.farTerrain.update(wx >> 4, wz >> 4, d)
 
-        self.chunkIterator = self.iterateChunks(wx, wz, d * 2)
+        self.loadChunks(self.iterateChunks(wx, wz, d))
+
+    def loadChunks(self, positions):
+        """ Queue positions to be meshed, or to have their detail level updated, in order of priority. """
+        self.updateSchedulerCamera()
+        self.scheduler.pending.reset(positions)
 
     def iterateChunks(self, x, z, d):
+        """ The chunk positions within d chunks of the world position x, z. """
         cx = x >> 4
         cz = z >> 4
+        for dx in xrange(-d, d + 1):
+            for dz in xrange(-d, d + 1):
+                yield cx + dx, cz + dz
 
-        yield (cx, cz)
-
-        step = dir = 1
-
-        while True:
-            for i in xrange(step):
-                cx += dir
-                yield (cx, cz)
-
-            for i in xrange(step):
-                cz += dir
-                yield (cx, cz)
-
-            step += 1
-            if step > d and not self.overheadMode:
-                raise StopIteration
-
-            dir = -dir
-
-    chunkIterator = None
+    def updateSchedulerCamera(self):
+        x, y, z = self.position
+        ox, oy, oz = self.origin
+        self.scheduler.setCamera((x - ox, z - oz), self.viewingFrustum)
 
     @property
     def chunkWorker(self):
@@ -3441,6 +3835,10 @@ class MCRenderer(object):
         self.bufferUsage = 0
         self.forgetAllDisplayLists()
         self.chunkRenderers = {}
+        self.scheduler.clearLoaded()
+        self.farTerrain.discard()
+        if self.chunkCalculator:
+            self.chunkCalculator.tilePyramid.invalidateUnsaved()
         self.oldPosition = None  # xxx force reload
 
     def discardChunksInBox(self, box):
@@ -3485,6 +3883,7 @@ class MCRenderer(object):
             self.bufferUsage -= self.chunkRenderers[cx, cz].bufferSize
             self.chunkRenderers[cx, cz].forgetDisplayLists()
             del self.chunkRenderers[cx, cz]
+            self.scheduler.forgetLoaded((cx, cz))
 
     _fastLeaves = False
 
@@ -3512,6 +3911,36 @@ class MCRenderer(object):
 
         self._roughGraphics = bool(val)
 
+    _greedyMeshing = False
+
+    @property
+    def greedyMeshing(self):
+        return self._greedyMeshing
+
+    @greedyMeshing.setter
+    def greedyMeshing(self, val):
+        if self._greedyMeshing != bool(val):
+            self.discardAllChunks()
+
+        self._greedyMeshing = bool(val)
+
+    _drawFarTerrain = False
+
+    @property
+    def drawFarTerrain(self):
+        return self._drawFarTerrain
+
+    @drawFarTerrain.setter
+    def drawFarTerrain(self, val):
+        if self._drawFarTerrain != bool(val):
+            self._drawFarTerrain = bool(val)
+            self.discardAllChunks()
+
+    @property
+    def farTerrainEnabled(self):
+        return (self.drawFarTerrain and not self.isPreviewer and self.chunkCalculator is not None
+                and self.chunkCalculator.tilePyramid.active)
+
     _showHiddenOres = False
 
     @property
@@ -3530,19 +3959,36 @@ class MCRenderer(object):
         if self.showHiddenOres:
             self.discardAllChunks()
 
-    def invalidateChunk(self, cx, cz, layers=None):
+    def invalidateChunk(self, cx, cz, layers=None, sections=None):
         " marks the chunk for regenerating vertex data and display lists "
+        if self.chunkCalculator and (layers is None or Layer.Blocks in layers):
+            self.chunkCalculator.tilePyramid.invalidateChunk(cx, cz)
+            self.farTerrain.invalidateChunk(cx, cz)
         if (cx, cz) in self.chunkRenderers:
 
-            self.chunkRenderers[(cx, cz)].invalidate(layers)
+            self.chunkRenderers[(cx, cz)].invalidate(layers, sections)
 
-            self.invalidChunkQueue.append((cx, cz))  # xxx encapsulate
+            self.scheduler.invalid.push((cx, cz))
 
     def invalidateChunksInBox(self, box, layers=None):
         # If the box is at the edge of any chunks, expanding by 1 makes sure the neighboring chunk gets redrawn.
+        # The same goes for the sections above and below it.
         box = box.expand(1)
-
-        self.invalidateChunks(box.chunkPositions, layers)
+        sections = range(max(box.miny, 0) & ~15, min(box.maxy, self.level.Height), 16)
+
+        positions = list(box.chunkPositions)
+        self.boxInvalidated.update(positions)
+        self.invalidateChunks(positions, layers, sections)
+
+    def invalidateChangedChunks(self, chunks):
+        """
+        Redraw the chunks listed by the level's change journal. The chunks invalidated by invalidateChunksInBox since
+        the last call are skipped: the edit that changed them already named the sections to mesh again.
+        """
+        chunks = [cPos for cPos in chunks if cPos not in self.boxInvalidated]
+        self.boxInvalidated.clear()
+        if chunks:
+            self.invalidateChunks(chunks)
 
     def invalidateEntitiesInBox(self, box):
         self.invalidateChunks(box.chunkPositions, [Layer.Entities])
@@ -3550,9 +3996,9 @@ class MCRenderer(object):
     def invalidateTileTicksInBox(self, box):
         self.invalidateChunks(box.chunkPositions, [Layer.TileTicks])
 
-    def invalidateChunks(self, chunks, layers=None):
+    def invalidateChunks(self, chunks, layers=None, sections=None):
         for (cx, cz) in chunks:
-            self.invalidateChunk(cx, cz, layers)
+            self.invalidateChunk(cx, cz, layers, sections)
 
         self.stopWork()
         self.discardMasterList()
@@ -3620,10 +4066,9 @@ class MCRenderer(object):
             self.loadChunksStartingFrom(int(cameraPos[0]) - self.origin[0], int(cameraPos[2]) - self.origin[2])
 
     def loadAllChunks(self):
-        box = self.level.bounds
-
-        self.loadChunksStartingFrom(box.origin[0] + box.width / 2, box.origin[2] + box.length / 2,
-                                    max(box.width, box.length))
+        if self.level.saving:
+            return
+        self.loadChunks(self.level.bounds.chunkPositions)
 
     _floorTexture = None
 
@@ -3704,41 +4149,35 @@ class MCRenderer(object):
     else:
         def createMasterLists(self):
             if self.shouldRecreateMasterList:
-                lists = {}
-                chunkLists = defaultdict(list)
                 chunksPerFrame = 80
                 shouldRecreateAgain = False
 
-                for ch in self.chunkRenderers.itervalues():
-                    if chunksPerFrame:
-                        if ch.needsRedisplay:
-                            chunksPerFrame -= 1
-                        ch.makeDisplayLists()
-                    else:
-                        shouldRecreateAgain = True
-
-                    if ch.renderstateLists:
-                        for rs in ch.renderstateLists:
-                            chunkLists[rs] += ch.renderstateLists[rs]
-
-                for rs in chunkLists:
-                    if len(chunkLists[rs]):
-                        lists[rs] = numpy.array(chunkLists[rs], dtype='uint32').ravel()
+                with instruments.stage("display lists"):
+                    for ch in self.chunkRenderers.itervalues():
+                        if chunksPerFrame:
+                            if ch.needsRedisplay:
+                                chunksPerFrame -= 1
+                            ch.makeDisplayLists()
+                        else:
+                            shouldRecreateAgain = True
 
-                self.masterLists = lists
+                    self.drawSet = ChunkDrawSet(self.chunkRenderers, self.origin)
                 self.shouldRecreateMasterList = shouldRecreateAgain
                 self.needsImmediateRedraw = shouldRecreateAgain
 
         def callMasterLists(self):
+            # A translucent renderer shows what is under the surface, so the occlusion hint only applies when opaque.
+            cameraY = self.position[1] - self.origin[1] if self.alpha == 0xff else float('-inf')
+            masterLists = self.drawSet.visibleLists(self.viewingFrustum, cameraY)
             for renderstate in self.chunkCalculator.renderstates:
-                if renderstate not in self.masterLists:
+                if renderstate not in masterLists:
                     continue
 
                 if self.alpha != 0xff and renderstate is not ChunkCalculator.renderstateLowDetail:
                     GL.glEnable(GL.GL_BLEND)
                 renderstate.bind()
 
-                GL.glCallLists(self.masterLists[renderstate])
+                GL.glCallLists(masterLists[renderstate])
 
                 renderstate.release()
                 if self.alpha != 0xff and renderstate is not ChunkCalculator.renderstateLowDetail:
@@ -3776,7 +4215,10 @@ class MCRenderer(object):
 
             self.createMasterLists()
             try:
-                self.callMasterLists()
+                with instruments.stage("draw"):
+                    self.callMasterLists()
+                    if self.farTerrainEnabled:
+                        self.farTerrain.draw()
 
             except GL.GLError, e:
                 if self.errorLimit:
@@ -3804,8 +4246,8 @@ class MCRenderer(object):
             self.bufferUsage / 1000000,
         ))
 
-        addDebugString("WQ: {0}, ".format(len(self.invalidChunkQueue)))
-        if self.chunkIterator:
+        addDebugString("WQ: {0}, ".format(len(self.scheduler.invalid)))
+        if len(self.scheduler.pending):
             addDebugString("[LR], ")
 
         addDebugString("CR: {0}, ".format(len(self.chunkRenderers), ))
@@ -3822,50 +4264,49 @@ class MCRenderer(object):
                 if self.level is None:
                     raise StopIteration
 
-                if len(self.invalidChunkQueue) > 1024:
-                    self.invalidChunkQueue.clear()
-
-                if len(self.invalidChunkQueue):
-                    c = self.invalidChunkQueue[0]
+                self.updateSchedulerCamera()
+                c = self.scheduler.invalid.pop()
+                if c is None:
+                    c = self.scheduler.pending.pop()
+                    if c is None:
+                        work = self.farTerrain.nextWork() if self.farTerrainEnabled else None
+                        if work is None:
+                            raise StopIteration
+                        try:
+                            for _ in work:
+                                yield
+                        except Exception as e:
+                            traceback.print_exc()
+                            logging.info(u"Stopped building far terrain: {0!r}".format(e))
+                            self.farTerrain.needsWork = False
+                        continue
+                    if self.vertexBufferLimit and not self.makeBufferRoom(c):
+                        c = None
+
+                if c is not None:
                     for _ in self.workOnChunk(c):
                         yield
-                    self.invalidChunkQueue.popleft()
-
-                elif self.chunkIterator is None:
-                    raise StopIteration
-
-                else:
-                    c = self.chunkIterator.next()
-                    if self.vertexBufferLimit:
-                        while self.bufferUsage > (0.9 * (self.vertexBufferLimit << 20)):
-                            deadChunk = None
-                            deadDistance = self.chunkDistance(c)
-                            for cr in self.chunkRenderers.itervalues():
-                                dist = self.chunkDistance(cr.chunkPosition)
-                                if dist > deadDistance:
-                                    deadChunk = cr
-                                    deadDistance = dist
-
-                            if deadChunk is not None:
-                                self.discardChunk(*deadChunk.chunkPosition)
-
-                            else:
-                                break
-
-                        else:
-                            for _ in self.workOnChunk(c):
-                                yield
-
-                    else:
-                        for _ in self.workOnChunk(c):
-                            yield
 
                 yield
 
         finally:
             self._chunkWorker = None
-            if self.chunkIterator:
-                self.chunkIterator = None
+
+    def makeBufferRoom(self, c):
+        """
+        Discard the chunk renderers farthest from the camera until the buffers are within the limit. Returns False
+        if none of them is farther than the chunk c, which should then not be loaded.
+        """
+        limit = 0.9 * (self.vertexBufferLimit << 20)
+        distance = None
+        while self.bufferUsage > limit:
+            farthest = self.scheduler.farthestLoaded()
+            if distance is None:
+                distance = self.scheduler.distance(c)
+            if farthest is None or farthest[1] <= distance:
+                return False
+            self.discardChunk(*farthest[0])
+        return True
 
     vertexBufferLimit = 384
 
@@ -3893,11 +4334,6 @@ class MCRenderer(object):
 
         if self.level.containsChunk(*c):
             cr = self.getChunkRenderer(c)
-            if self.viewingFrustum:
-                if not self.viewingFrustum.visible1([c[0] * 16 + 8, self.level.Height / 2, c[1] * 16 + 8, 1.0],
-                                                    self.level.Height / 2):
-                    raise StopIteration
-
             faceInfoCalculator = self.calcFacesForChunkRenderer(cr)
             try:
                 for _ in faceInfoCalculator:
@@ -3917,6 +4353,7 @@ class MCRenderer(object):
 
     def chunkDone(self, chunkRenderer, work):
         self.chunkRenderers[chunkRenderer.chunkPosition] = chunkRenderer
+        self.scheduler.addLoaded(chunkRenderer.chunkPosition)
         self.bufferUsage += chunkRenderer.bufferSize
         # print "Chunk {0} used {1} work units".format(chunkRenderer.chunkPosition, work)
         if not self.needsRedraw:
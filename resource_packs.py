@@ -7,13 +7,19 @@ from PIL import Image
 import zipfile
 import directories
 import os
-import shutil
+import hashlib
+import json
+import threading
+import functools
+import Queue
+from contextlib import closing
 from config import config
 from cStringIO import StringIO
 
 import locale
 import traceback
 from utilities.misc import Singleton
+from albow.root import schedule
 
 DEF_ENC = locale.getdefaultlocale()[1]
 if DEF_ENC is None:
@@ -567,6 +573,76 @@ textureSlots = {
     # Start Comparator Block
     }
 
+# Bump this when the way atlases are composited changes, so cached atlases are rebuilt.
+ATLAS_CACHE_VERSION = 1
+ATLAS_CACHE_DIR = "terrain-textures"
+BLOCK_TEXTURES_DIR = "assets/minecraft/textures/blocks"
+
+_texture_slots_version = None
+
+
+def texture_slots_version():
+    '''
+    Hash of the texture slot table, the default terrain.png and ATLAS_CACHE_VERSION.
+    It is part of every cached atlas key, so changing any of them invalidates the cached atlases.
+    '''
+    global _texture_slots_version
+    if _texture_slots_version is None:
+        h = hashlib.sha1("%d;" % ATLAS_CACHE_VERSION)
+        h.update(repr(sorted(textureSlots.items())))
+        with open(os.path.join(directories.getDataDir(), 'terrain.png'), 'rb') as f:
+            h.update(f.read())
+        _texture_slots_version = h.hexdigest()
+    return _texture_slots_version
+
+
+class AtlasCache(object):
+    '''
+    Remembers which cached atlas keys belong to packs that turned out to be empty or too big, so those packs are not
+    parsed again on every launch. Parsed atlases themselves are stored as <key>.png next to the index.
+    '''
+    EMPTY = "empty"
+    TOO_BIG = "tooBig"
+
+    def __init__(self, folder=ATLAS_CACHE_DIR):
+        self.folder = folder
+        self.index_path = os.path.join(folder, "atlas-cache.json")
+        self._lock = threading.Lock()
+        self._status = None
+
+    def atlas_path(self, key):
+        return os.path.join(self.folder, key + ".png")
+
+    def _load(self):
+        if self._status is None:
+            try:
+                with open(self.index_path, 'rb') as f:
+                    self._status = json.load(f)
+            except (IOError, ValueError):
+                self._status = {}
+        return self._status
+
+    def status(self, key):
+        with self._lock:
+            return self._load().get(key)
+
+    def set_status(self, key, status):
+        with self._lock:
+            statuses = self._load()
+            if status is None:
+                statuses.pop(key, None)
+            else:
+                statuses[key] = status
+            try:
+                with open(self.index_path, 'wb') as f:
+                    json.dump(statuses, f)
+            except IOError as e:
+                log.debug("Could not save the atlas cache index: %s" % e)
+
+
+atlas_cache = AtlasCache()
+
+
 class MultipartTexture(object):
 
     def __init__(self, texture_objects):
@@ -633,21 +709,18 @@ class IResourcePack(object):
 
     def __init__(self):
         self.__stop = False
-        texture_path = os.path.join(directories.parentDir, "textures", self._pack_name)
-        self.texture_path = texture_path
         self._isEmpty = False
         self._too_big = False
+        self._cache_key = None
         self.big_textures_counted = 0
         self.big_textures_max = 10
         self.block_image = {}
         self.propogated_textures = []
         self.all_texture_slots = []
-        self.old_terrain = Image.open(os.path.join(directories.getDataDir(), 'terrain.png'))
         for texx in xrange(0,33):
             for texy in xrange(0,33):
                 self.all_texture_slots.append((step(texx),step(texy)))
         self._terrain_name = self._pack_name.replace(" ", "_")+".png"
-        self._terrain_path = os.path.join("terrain-textures", self._terrain_name.replace(" ", "_"))
 
     @property
     def pack_name(self):
@@ -665,9 +738,64 @@ class IResourcePack(object):
 
     def terrain_path(self):
         '''
-        Path to the parsed PNG file
+        Path to the parsed PNG file, or to the default terrain.png while the pack has not been parsed yet
+        '''
+        if self.parsed:
+            return self._terrain_path
+        return os.path.join(directories.getDataDir(), "terrain.png")
+
+    @property
+    def _terrain_path(self):
+        return atlas_cache.atlas_path(self.cache_key)
+
+    def content_hash(self):
+        '''
+        Hash of the block textures this pack provides. Packs that can not tell when their textures change are keyed on
+        their name only, so they keep a single atlas that is rebuilt with reparse_resource_pack
+        '''
+        return hashlib.sha1(self.pack_name.encode("utf-8")).hexdigest()
+
+    @property
+    def cache_key(self):
+        '''
+        Key of this pack's atlas in the atlas cache: a hash of the pack's textures and of the texture slot table
+        '''
+        if self._cache_key is None:
+            self._cache_key = hashlib.sha1(texture_slots_version() + self.content_hash()).hexdigest()
+        return self._cache_key
+
+    @property
+    def parsed(self):
+        '''
+        Returns true if the atlas for this pack is in the cache
+        '''
+        return os.path.exists(self._terrain_path)
+
+    def check_cache(self):
+        '''
+        Picks up the results of an earlier parse of the same pack contents
+        '''
+        status = atlas_cache.status(self.cache_key)
+        self._isEmpty = status == AtlasCache.EMPTY
+        self._too_big = status == AtlasCache.TOO_BIG
+
+    def parse(self):
+        '''
+        Reads the pack's textures and stores the resulting terrain atlas in the atlas cache.
+        Runs on the resource pack worker thread.
         '''
-        return self._terrain_path
+        self.__stop = False
+        self._isEmpty = False
+        self._too_big = False
+        self.block_image = {}
+        self.propogated_textures = []
+        self.big_textures_counted = 0
+        try:
+            self.read_textures()
+        except Exception as e:
+            print "Error while trying to load one of the resource packs: {}".format(e)
+            self._isEmpty = True
+            atlas_cache.set_status(self.cache_key, AtlasCache.EMPTY)
 
     @property
     def isEmpty(self):
@@ -739,7 +867,7 @@ class IResourcePack(object):
             if parsed_texture is not None:
                 new_terrain.paste(parsed_texture, runAnyway.position, parsed_texture)
                 self.propogated_textures.append(runAnyway.position)
-        copy = self.old_terrain.copy()
+        copy = Image.open(os.path.join(directories.getDataDir(), 'terrain.png'))
 
         log.debug("Correcting textures...")
         for t in self.all_texture_slots:
@@ -748,16 +876,18 @@ class IResourcePack(object):
                 new_terrain.paste(old_tex, t, old_tex)
         log.debug("    Done.")
 
-        log.debug("Saving %s."%self._terrain_path)
-        new_terrain.save(self._terrain_path)
-        log.debug("    Done.")
-        try:
-            os.remove(self._pack_name.replace(" ", "_")+".png")
-        except:
-            pass
-        if not self.propogated_textures:
-            os.remove(self._terrain_path)
+        if self.propogated_textures:
+            log.debug("Saving %s."%self._terrain_path)
+            # Write under a temporary name first: the atlas path existing is what marks the pack as parsed.
+            temp_path = self._terrain_path + ".tmp"
+            new_terrain.save(temp_path, "PNG")
+            if os.path.exists(self._terrain_path):
+                os.remove(self._terrain_path)
+            os.rename(temp_path, self._terrain_path)
+            log.debug("    Done.")
+        else:
             self._isEmpty = True
+            atlas_cache.set_status(self.cache_key, AtlasCache.EMPTY)
             log.debug("No propagated textures.\nTexture pack considered as empty.")
             #print u"{} did not replace any textures".format(self._pack_name)
 
@@ -775,6 +905,7 @@ class IResourcePack(object):
         '''
         self._too_big = True
         log.debug("Resource pack is too big.")
+        atlas_cache.set_status(self.cache_key, AtlasCache.TOO_BIG)
         try:
             os.remove(self._terrain_path)
         except:
@@ -796,12 +927,17 @@ class ZipResourcePack(IResourcePack):
         self.fps = []
         IResourcePack.__init__(self)
 
-        if not os.path.exists(self._terrain_path):
-            try:
-                self.open_pack()
-            except Exception as e:
-                if 'seek' not in e:
-                    print "Error while trying to load one of the resource packs: {}".format(e)
+    def content_hash(self):
+        '''
+        Hashes the names, CRCs and sizes of the block textures from the zip directory, without decompressing them
+        '''
+        h = hashlib.sha1()
+        with closing(zipfile.ZipFile(self.zipfile)) as zfile:
+            for info in sorted(zfile.infolist(), key=lambda i: i.filename):
+                if info.filename.startswith(BLOCK_TEXTURES_DIR) and info.filename.endswith(".png"):
+                    h.update(info.filename.encode("utf-8"))
+                    h.update(":%d:%d;" % (info.CRC, info.file_size))
+        return h.hexdigest()
 
     def open_pack(self):
         '''
@@ -883,6 +1019,8 @@ class ZipResourcePack(IResourcePack):
         else:
             self.parse_terrain_png()
 
+    read_textures = open_pack
+
 
 class FolderResourcePack(IResourcePack):
 
@@ -891,9 +1029,20 @@ class FolderResourcePack(IResourcePack):
         self._pack_name = self._folder.replace(" ", "_")
         IResourcePack.__init__(self)
         self._full_path = os.path.join(directories.getMinecraftProfileDirectory(directories.getSelectedProfile()), "resourcepacks", self._folder)
-        self.texture_path = os.path.join(directories.parentDir, "textures", self._pack_name)
-        if not os.path.exists(self._terrain_path):
-            self.add_textures()
+
+    def content_hash(self):
+        '''
+        Hashes the names, sizes and modification times of the block texture files of the folder, without reading them
+        '''
+        h = hashlib.sha1()
+        base_path = os.path.join(self._full_path, "assets", "minecraft", "textures", "blocks")
+        if os.path.exists(base_path):
+            for tex_file in sorted(os.listdir(base_path)):
+                if tex_file.endswith(".png"):
+                    st = os.stat(os.path.join(base_path, tex_file))
+                    h.update(tex_file.encode("utf-8"))
+                    h.update(":%d:%r;" % (st.st_size, st.st_mtime))
+        return h.hexdigest()
 
     def add_textures(self):
         '''
@@ -947,20 +1096,34 @@ class FolderResourcePack(IResourcePack):
         else:
             self.parse_terrain_png()
 
+    read_textures = add_textures
+
 
 class DefaultResourcePack(IResourcePack):
     '''
     Represents the default Resource Pack that is always present
     '''
 
+    parsed = True
+
     def __init__(self):
         self._isEmpty = False
         self._too_big = False
-        self._terrain_path = os.path.join(directories.getDataDir(), "terrain.png")
+        self._cache_key = None
         self._pack_name = "Default"
 
     def terrain_path(self):
-        return self._terrain_path
+        return os.path.join(directories.getDataDir(), "terrain.png")
+
+    def content_hash(self):
+        '''
+        Hashes the size and modification time of the bundled terrain.png
+        '''
+        st = os.stat(self.terrain_path())
+        return hashlib.sha1("terrain.png:%d:%r" % (st.st_size, st.st_mtime)).hexdigest()
+
+    def check_cache(self):
+        pass
 
     @property
     def isEmpty(self):
@@ -979,12 +1142,13 @@ class ResourcePackHandler:
     
     def setup_reource_packs(self):
         '''
-        Handles parsing of Resource Packs and removing ones that are either have to0 high of a resolution, or don't replace any textures
+        Finds the installed Resource Packs, leaving out the ones an earlier parse found to have too high of a resolution or
+        to not replace any textures. Packs are only parsed once they are selected, see parse_in_background
         '''
         log.debug("Setting up the resource packs.")
         self._resource_packs = {}
         try:
-            os.mkdir("terrain-textures")
+            os.mkdir(ATLAS_CACHE_DIR)
         except OSError:
             pass
         self._resource_packs["Default Resource Pack"] = DefaultResourcePack()
@@ -997,6 +1161,11 @@ class ResourcePackHandler:
             log.debug("Processing zipped packs...")
             for zip_tex_pack in zipResourcePacks:
                 zrp = ZipResourcePack(zip_tex_pack)
+                try:
+                    zrp.check_cache()
+                except Exception as e:
+                    print "Error while trying to load one of the resource packs: {}".format(e)
+                    continue
                 if not zrp.isEmpty:
                     if not zrp.tooBig:
                         self._resource_packs[zrp.pack_name] = zrp
@@ -1004,24 +1173,20 @@ class ResourcePackHandler:
             for folder_tex_pack in folderResourcePacks:
                 if os.path.isdir(os.path.join(directories.getMinecraftProfileDirectory(directories.getSelectedProfile()), "resourcepacks", folder_tex_pack)):
                     frp = FolderResourcePack(folder_tex_pack)
+                    try:
+                        frp.check_cache()
+                    except Exception as e:
+                        print "Error while trying to load one of the resource packs: {}".format(e)
+                        continue
                     if not frp.isEmpty:
                         if not frp.tooBig:
                             self._resource_packs[frp.pack_name] = frp
-        for tex in self._resource_packs.keys():
-            pack = self._resource_packs[tex]
-            if not os.path.exists(pack.terrain_path()):
-                del self._resource_packs[tex]
-        try:
-            shutil.rmtree(os.path.join(directories.parentDir, "textures"))
-        except:
-            print "Could not remove \"textures\" directory"
-            pass
 
     def __init__(self):
-        try:
-            os.mkdir(os.path.join(directories.parentDir, "textures"))
-        except OSError:
-            pass
+        self._parse_queue = Queue.Queue()
+        self._parse_worker = None
+        self._parse_listeners = []
+        self._queued = set()
         self.setup_reource_packs()
         self._selected_resource_pack = config.settings.resourcePack.get()
         if self._selected_resource_pack not in self._resource_packs.keys():
@@ -1049,10 +1214,54 @@ class ResourcePackHandler:
     def reparse_resource_pack(self, packName):
         if packName in self._resource_packs:
             pack = self._resource_packs[packName]
-            if isinstance(pack, FolderResourcePack):
-                pack.add_textures()
-            elif isinstance(pack, ZipResourcePack):
-                pack.open_pack()
+            if isinstance(pack, (FolderResourcePack, ZipResourcePack)):
+                pack.parse()
+
+    def add_parse_listener(self, func):
+        '''
+        Registers func(packName) to be called once a pack parsed by the worker affects the selected pack.
+        It is called from the event loop.
+        '''
+        self._parse_listeners.append(func)
+
+    def parse_in_background(self, pack):
+        '''
+        Queues a pack for parsing on the resource pack worker thread. Until it is done, the pack's terrain_path() is the
+        default terrain.png
+        '''
+        if pack.parsed or pack.pack_name in self._queued:
+            return
+        self._queued.add(pack.pack_name)
+        self._parse_queue.put(pack)
+        if self._parse_worker is None:
+            self._parse_worker = threading.Thread(target=self._parse_packs, name="ResourcePackParser")
+            self._parse_worker.daemon = True
+            self._parse_worker.start()
+
+    def _parse_packs(self):
+        while True:
+            pack = self._parse_queue.get()
+            log.debug("Parsing %s in the background." % pack.pack_name)
+            try:
+                pack.parse()
+            except Exception as e:
+                log.warning("Could not parse resource pack %s: %r" % (pack.pack_name, e))
+            # The pack list, the selected pack and the listeners belong to the event loop.
+            schedule(0, functools.partial(self._pack_parsed, pack))
+
+    def _pack_parsed(self, pack):
+        self._queued.discard(pack.pack_name)
+        selected = self._resource_packs.get(self._selected_resource_pack) is pack
+        if pack.isEmpty or pack.tooBig or not pack.parsed:
+            print u"{} can't be used as a resource pack".format(pack.pack_name)
+            for name, p in self._resource_packs.items():
+                if p is pack:
+                    del self._resource_packs[name]
+            if selected:
+                self.set_selected_resource_pack_name("Default Resource Pack")
+        if selected:
+            for func in self._parse_listeners:
+                func(pack.pack_name)
 
     def get_selected_resource_pack_name(self):
         '''
@@ -1072,5 +1281,8 @@ class ResourcePackHandler:
     def get_selected_resource_pack(self):
         '''
         Returns the selected Resource Pack instance. Can be an instance of either DefaultResourcePack, ZipResourcePack or FolderResourcePack
+        If the pack has not been parsed yet, parsing starts in the background
         '''
-        return self._resource_packs[self._selected_resource_pack]
+        pack = self._resource_packs[self._selected_resource_pack]
+        self.parse_in_background(pack)
+        return pack
@@ -6,6 +6,8 @@
 from pymclevel import TAG_Byte, TAG_Short, TAG_Int, TAG_Compound, TAG_List, TAG_String, TAG_Double, TAG_Float, TAG_Long, \
     TAG_Byte_Array, TAG_Int_Array
 from pymclevel.box import BoundingBox
+from pymclevel import level_search
+from pymclevel.infiniteworld import MCInfdevOldLevel
 from albow import alert, ask
 import ast
 # Let import the stuff to save files.
@@ -33,6 +35,7 @@ inputs = [(("Match by:", ("TileEntity", "Entity", "Block")),
            ("Match Tag Value:", ("string", "value=None")),
            ("Case insensitive:", True),
            ("Match Tag Type:", tuple(("Any",)) + tuple(tagtypes.keys())),
+           ("Use search index:", True),
            ("Operation:", ("Start New Search", "Dump Found Coordinates")),
            ("Options", "title")),
 
@@ -49,7 +52,9 @@ inputs = [(("Match by:", ("TileEntity", "Entity", "Block")),
             "checked.\nIt is faster to match TileEntity searches with a Block Type than vice versa.\nBlock "
             "matching can also optionally match block data, e.g. matching all torches, or only torches facing "
             "a specific direction.\n\"Start New Search\" will re-search through the selected volume, while \"Find Next\" "
-            "will iterate through the search results of the previous search.", "label"))
+            "will iterate through the search results of the previous search.\n\"Use search index\" keeps a record of "
+            "which chunks hold which Entity and TileEntity tags in the world folder, so that repeated searches only "
+            "load the chunks that can match.", "label"))
 ]
 
 tree = None # the tree widget
@@ -111,80 +116,10 @@ except NameError:
     search = None
 
 
-def FindTagS(nbtData, name, value, tagtype):
-    if type(nbtData) is TAG_List or type(nbtData) is TAG_Compound:
-        if name in nbtData.name or name == "":
-            if value == "":
-                if type(nbtData) is tagtype or tagtype == 11:
-                    print "found in pre-area"
-                    return True
-        if type(nbtData) is TAG_List:
-            list = True
-        else:
-            list = False
-
-        for tag in range(0, len(nbtData)) if list else nbtData.keys():
-            if type(nbtData[tag]) is TAG_Compound:
-                if FindTagS(nbtData[tag], name, value, tagtype):
-                    return True
-            elif type(nbtData[tag]) is TAG_List:
-                if FindTagS(nbtData[tag], name, value, tagtype):
-                    return True
-            else:
-                if name in nbtData[tag].name or name == "":
-                    if value in unicode(nbtData[tag].value):
-                        if type(nbtData[tag]) is tagtype or tagtype == 11:
-                            print "found in list/compound"
-                            return True
-        else:
-            return False
-    else:
-        if name in nbtData.name or name == "":
-            if value in unicode(nbtData.value):
-                if type(nbtData[tag]) is tagtype or tagtype == 11:
-                    print "found outside"
-                    return True
-    return False
-
-
-def FindTagI(nbtData, name, value, tagtype):
-    if type(nbtData) is TAG_List or type(nbtData) is TAG_Compound:
-        if name in (u"%s"%nbtData.name).upper() or name == "":
-            if value == "":
-                if type(nbtData) is tagtype or tagtype == 11:
-                    return True
-        if type(nbtData) is TAG_List:
-            list = True
-        else:
-            list = False
-
-        for tag in range(0, len(nbtData)) if list else nbtData.keys():
-            if type(nbtData[tag]) is TAG_Compound:
-                if FindTagI(nbtData[tag], name, value, tagtype):
-                    return True
-            elif type(nbtData[tag]) is TAG_List:
-                if FindTagI(nbtData[tag], name, value, tagtype):
-                    return True
-            else:
-                if name in (u"%s"%nbtData[tag].name).upper() or name == "":
-                    if value in unicode(nbtData[tag].value).upper():
-                        if type(nbtData[tag]) is tagtype or tagtype == 11:
-                            return True
-        else:
-            return False
-    else:
-        if name in (u"%s"%nbtData.name).upper() or name == "":
-            if value in unicode(nbtData.value).upper():
-                if type(nbtData[tag]) is tagtype or tagtype == 11:
-                    return True
-    return False
-
-
 def FindTag(nbtData, name, value, tagtype, caseSensitive):
-    if caseSensitive:
-        return FindTagS(nbtData, name, value, tagtype)
-    else:
-        return FindTagI(nbtData, name, value, tagtype)
+    if tagtype == 11:
+        tagtype = None
+    return level_search.tagMatches(nbtData, name, value, tagtype, caseSensitive)
 
 
 def perform(level, box, options):
@@ -205,6 +140,7 @@ def perform(level, box, options):
     matchval = u"" if options["Match Tag Value:"] == "None" else unicode(options["Match Tag Value:"])
     caseSensitive = not options["Case insensitive:"]
     matchtagtype = tagtypes.get(options["Match Tag Type:"], "Any")
+    useIndex = options["Use search index:"]
     op = options["Operation:"]
 
     datas = []
@@ -221,57 +157,40 @@ def perform(level, box, options):
 
     if not search:
         if by == trn._("Block"):
-            for x in xrange(box.minx, box.maxx):
-                for z in xrange(box.minz, box.maxz):
-                    for y in xrange(box.miny, box.maxy):
-                        block = level.blockAt(x, y, z)
-                        data = level.blockDataAt(x, y, z)
-                        if block == matchblock.ID and (not matchdata or data == matchblock.blockData):
-                            pass
-                        else:
-                            continue
-                        if matchtile:
-                            tile = level.tileEntityAt(x, y, z)
-                            if tile is not None:
-                                if not FindTag(tile, matchname, matchval, tagses[matchtagtype], caseSensitive):
-                                    continue
-                            else:
-                                continue
-                        search.append((x, y, z))
-                        datas.append(data)
-        elif by == trn._("TileEntity"):
-            chunks = []
-            for (chunk, slices, point) in level.getChunkSlices(box):
-                for e in chunk.TileEntities:
-                    x = e["x"].value
-                    y = e["y"].value
-                    z = e["z"].value
-                    if (x, y, z) in box:
-                        if matchtype:
-                            block = level.blockAt(x, y, z)
-                            data = level.blockDataAt(x, y, z)
-                            if block == matchblock.ID and (not matchdata or data == matchblock.blockData):
-                                pass
-                            else:
-                                continue
-                        if not FindTag(e, matchname, matchval, tagses[matchtagtype], caseSensitive):
-                            continue
-
-                        search.append((x, y, z))
-                        datas.append(e)
-                        chunks.append([chunk, slices, point])
+            blockData = matchblock.blockData if matchdata else None
+            for pos, data in level_search.findBlocks(level, box, matchblock.ID, blockData):
+                if matchtile:
+                    tile = level.tileEntityAt(*pos)
+                    if tile is None or not FindTag(tile, matchname, matchval, tagses[matchtagtype], caseSensitive):
+                        continue
+                search.append(pos)
+                datas.append(int(data))
         else:
+            if by == trn._("TileEntity"):
+                kind = level_search.KIND_TILE_ENTITIES
+            else:
+                kind = level_search.KIND_ENTITIES
+
+            index = None
+            if useIndex and isinstance(level, MCInfdevOldLevel):
+                index = level_search.ChunkTagIndex(level)
+                index.update()
+
+            tagType = tagses[matchtagtype]
+            if tagType == 11:
+                tagType = None
+
             chunks = []
-            for (chunk, slices, point) in level.getChunkSlices(box):
-                for e in chunk.Entities:
-                    x = e["Pos"][0].value
-                    y = e["Pos"][1].value
-                    z = e["Pos"][2].value
-                    if (x, y, z) in box:
-                        if FindTag(e, matchname, matchval, tagses[matchtagtype], caseSensitive):
-                            search.append((x, y, z))
-                            datas.append(e)
-                            chunks.append([chunk, slices, point])
+            for chunk, pos, e in level_search.findTags(level, box, kind, matchname, matchval, tagType,
+                                                       caseSensitive, index):
+                if kind == level_search.KIND_TILE_ENTITIES and matchtype:
+                    block = level.blockAt(*pos)
+                    data = level.blockDataAt(*pos)
+                    if block != matchblock.ID or (matchdata and data != matchblock.blockData):
+                        continue
+                search.append(pos)
+                datas.append(e)
+                chunks.append([chunk, None, None])
     if not search:
         alert("\nNo matching blocks/tile entities found")
     else:
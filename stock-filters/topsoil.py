@@ -1,8 +1,7 @@
 #!/usr/bin/env python2.7
 # -*- coding: utf-8 -*-
 
-from numpy import zeros
-import itertools
+from numpy import arange, newaxis, zeros
 from pymclevel import alphaMaterials
 from pymclevel.level import extractHeights
 
@@ -37,6 +36,24 @@ def naturalBlockmask():
     return blockmask
 
 
+# blockmasks by the ID of the chosen blocktype, so they are built once per filter run rather than once per chunk
+_blockmasks = {}
+
+
+def blockmaskFor(blocktype):
+    blockmask = _blockmasks.get(blocktype.ID)
+    if blockmask is None:
+        #compute a truth table that we can index to find out whether a block
+        # is naturally occuring and should be considered in a heightmap
+        blockmask = naturalBlockmask()
+
+        # always consider the chosen blocktype to be "naturally occuring" to stop
+        # it from adding extra layers
+        blockmask[blocktype.ID] = True
+        _blockmasks[blocktype.ID] = blockmask
+    return blockmask
+
+
 inputs = (
     ("Depth", (4, -128, 128)),
     ("Pick a block:", alphaMaterials.Grass),
@@ -45,56 +62,45 @@ inputs = (
 )
 
 
-def perform(level, box, options):
+def performChunk(level, chunk, slices, point, options):
     depth = options["Depth"]
     blocktype = options["Pick a block:"]
     replace = options["Replace Only:"]
     replaceType = options[""]
-    
 
-    #compute a truth table that we can index to find out whether a block
-    # is naturally occuring and should be considered in a heightmap
-    blockmask = naturalBlockmask()
+    blockmask = blockmaskFor(blocktype)
 
-    # always consider the chosen blocktype to be "naturally occuring" to stop
-    # it from adding extra layers
-    blockmask[blocktype.ID] = True
+    # slicing the block array is straightforward. blocks will contain only
+    # the area of interest in this chunk.
+    blocks = chunk.Blocks[slices]
+    data = chunk.Data[slices]
 
-    #iterate through the slices of each chunk in the selection box
+    # use indexing to look up whether or not each block in blocks is
+    # naturally-occuring. these blocks will "count" for column height.
+    maskedBlocks = blockmask[blocks]
+
+    heightmap = extractHeights(maskedBlocks)[..., newaxis]
+
+    # mark the layer in every column at once by comparing each block's y with its column's height
+    y = arange(blocks.shape[2])
+    if depth > 0:
+        layer = (y >= heightmap - depth) & (y < heightmap)
+        if replace:
+            layer &= (blocks == replaceType.ID) & (data == replaceType.blockData)
+    else:
+        #negative depth values mean to put a layer above the surface.
+        # the whole layer is filled even with "Replace Only", as it always was
+        layer = (y >= heightmap) & (y < heightmap - depth)
+
+    blocks[layer] = blocktype.ID
+    data[layer] = blocktype.blockData
+
+
+def perform(level, box, options):
+    # the filter tool calls performChunk directly, spreading chunks over several threads.
+    # this is the serial path for scripts that call perform() themselves.
     for chunk, slices, point in level.getChunkSlices(box):
-        # slicing the block array is straightforward. blocks will contain only
-        # the area of interest in this chunk.
-        blocks = chunk.Blocks[slices]
-        data = chunk.Data[slices]
-
-        # use indexing to look up whether or not each block in blocks is
-        # naturally-occuring. these blocks will "count" for column height.
-        maskedBlocks = blockmask[blocks]
-
-        heightmap = extractHeights(maskedBlocks)
-
-        for x, z in itertools.product(*map(xrange, heightmap.shape)):
-            h = heightmap[x, z]
-            if depth > 0:
-                if replace:
-                    for y in range(max(0, h-depth), h):
-                        b, d = blocks[x, z, y], data[x, z, y]
-                        if (b == replaceType.ID and d == replaceType.blockData):
-                            blocks[x, z, y] = blocktype.ID
-                            data[x, z, y] = blocktype.blockData
-                    continue
-                blocks[x, z, max(0, h - depth):h] = blocktype.ID
-                data[x, z, max(0, h - depth):h] = blocktype.blockData
-            else:
-                #negative depth values mean to put a layer above the surface
-                if replace:
-                    for y in range(h, min(blocks.shape[2], h-depth)):
-                        b, d = blocks[x, z, y], data[x, z, y]
-                        if (b == replaceType.ID and d == replaceType.blockData):
-                            blocks[x, z, y] = blocktype.ID
-                            data[x, z, y] = blocktype.blockData
-                blocks[x, z, h:min(blocks.shape[2], h - depth)] = blocktype.ID
-                data[x, z, h:min(blocks.shape[2], h - depth)] = blocktype.blockData
+        performChunk(level, chunk, slices, point, options)
 
         #remember to do this to make sure the chunk is saved
         chunk.chunkChanged()
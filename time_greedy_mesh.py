@@ -0,0 +1,49 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Compare the low detail terrain built with and without greedy meshing: vertices and build time per chunk.
+
+Usage: python time_greedy_mesh.py <world folder> [chunk limit]
+"""
+
+import itertools
+import sys
+from timeit import default_timer
+
+from pymclevel import mclevel
+from renderer import ChunkCalculator, LowDetailBlockRenderer
+
+
+def buildLowDetail(calculator, chunks, greedy, detailLevel):
+    calculator.greedyMeshing = greedy
+    quads = 0
+    start = default_timer()
+    for chunk in chunks:
+        br = LowDetailBlockRenderer(calculator)
+        br.detailLevel = detailLevel
+        for _ in br.makeChunkVertices(chunk):
+            pass
+        quads += sum(len(a) for a in br.vertexArrays)
+    return quads * 4, default_timer() - start
+
+
+def main(filename, limit=1024):
+    world = mclevel.fromFile(filename, readonly=True)
+    chunks = [world.getChunk(*cPos) for cPos in itertools.islice(world.allChunks, int(limit))]
+    calculator = ChunkCalculator(world)
+    print "%d chunks from %s" % (len(chunks), filename)
+
+    for detailLevel in (1, 2):
+        for greedy in (False, True):
+            vertices, t = buildLowDetail(calculator, chunks, greedy, detailLevel)
+            print "LOD %d, %s: %.01f vertices, %.03fms per chunk" % (
+                detailLevel, "greedy" if greedy else "one quad per face", float(vertices) / len(chunks),
+                t / len(chunks) * 1000)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+    else:
+        main(*sys.argv[1:])
@@ -0,0 +1,106 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Time the per-chunk passes of high detail meshing against the code they replaced: finding slabs and doors with one
+block ID table lookup instead of one comparison per slab or door ID, and reading the block renderers' texture
+coordinates from one table per section instead of looking them up for each renderer.
+
+Usage: python time_mesh_prepass.py <world folder> [chunk limit]
+
+testfiles/AnvilWorld covers natural terrain; a world with buildings has more slabs and doors.
+"""
+
+import itertools
+import sys
+from timeit import default_timer
+
+from pymclevel import mclevel
+from pymclevel.materials import alphaMaterials
+import renderer
+from renderer import ChunkCalculator, DoorRenderer
+
+
+class BlockTextures(renderer.SectionTextures):
+    """ Looks the blocks of each request up in blockTextures, as every renderer did before the section table. """
+
+    def at(self, blockIndices, direction=slice(None)):
+        return self(self.blocks[blockIndices], self.blockData[blockIndices] & 0xf, direction)
+
+
+class ChunkRendererStandIn(object):
+    def __init__(self):
+        self.sectionCache = {}
+
+
+def prepare(calculator, chunk):
+    neighboringChunks = calculator.getNeighboringChunks(chunk)
+    areaBlocks = calculator.getAreaBlocks(chunk, neighboringChunks)
+    areaBlockLights = calculator.getAreaBlockLights(chunk, neighboringChunks)
+    facingBlockIndices = calculator.getFacingBlockIndices(areaBlocks, calculator.exposedMaterialMap[areaBlocks])
+    return chunk, areaBlocks, areaBlockLights, calculator.materialMap[areaBlocks], facingBlockIndices
+
+
+def slabsByID(calculator, chunk, areaBlocks, areaBlockLights, *args):
+    for slab in set(b.ID for b in alphaMaterials.allBlocks if "Slab" in b.name):
+        slabs = areaBlocks == slab
+        if slabs.any():
+            areaBlockLights[slabs] = areaBlockLights[:, :, 1:][slabs[:, :, :-1]]
+
+
+def slabsByTable(calculator, chunk, areaBlocks, areaBlockLights, *args):
+    slabs = calculator.slabTable[areaBlocks]
+    if slabs.any():
+        areaBlockLights[slabs] = areaBlockLights[:, :, 1:][slabs[:, :, :-1]]
+
+
+def doorsByID(calculator, chunk, *args):
+    for door in DoorRenderer.blocktypes:
+        (chunk.Blocks == door).any()
+
+
+def doorsByTable(calculator, chunk, *args):
+    calculator.doorTable[chunk.Blocks].any()
+
+
+def meshSections(calculator, chunk, areaBlocks, areaBlockLights, areaBlockMats, facingBlockIndices):
+    for _ in calculator.computeGeometry(chunk, areaBlockMats, facingBlockIndices, areaBlockLights,
+                                       ChunkRendererStandIn(), []):
+        pass
+
+
+def timePerChunk(calculator, inputs, function):
+    start = default_timer()
+    for args in inputs:
+        function(calculator, *args)
+    return (default_timer() - start) / len(inputs) * 1000
+
+
+def main(filename, limit=256):
+    world = mclevel.fromFile(filename, readonly=True)
+    calculator = ChunkCalculator(world)
+    chunks = [world.getChunk(*cPos) for cPos in itertools.islice(world.allChunks, int(limit))]
+    inputs = [prepare(calculator, chunk) for chunk in chunks]
+    print "%d chunks from %s" % (len(chunks), filename)
+
+    for name, before, after in (("slab lighting", slabsByID, slabsByTable),
+                                ("door search", doorsByID, doorsByTable)):
+        print "%s: %.03fms per chunk by ID, %.03fms by table" % (
+            name, timePerChunk(calculator, inputs, before), timePerChunk(calculator, inputs, after))
+
+    sectionTextures = renderer.SectionTextures
+    try:
+        renderer.SectionTextures = BlockTextures
+        before = timePerChunk(calculator, inputs, meshSections)
+    finally:
+        renderer.SectionTextures = sectionTextures
+    after = timePerChunk(calculator, inputs, meshSections)
+    print "section meshing: %.03fms per chunk with lookups per renderer, %.03fms with a table per section" % (
+        before, after)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print __doc__
+    else:
+        main(*sys.argv[1:])
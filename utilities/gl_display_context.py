@@ -24,8 +24,12 @@ USE_WM = mcplatform.USE_WM
 class GLDisplayContext(object):
     def __init__(self, splash=None, caption=("", "")):
         self.win = None
+        ResourcePackHandler.Instance().add_parse_listener(self._resourcePackParsed)
         self.reset(splash, caption=caption)
 
+    def _resourcePackParsed(self, packName):
+        self.loadTextures()
+
     @staticmethod
     def getWindowSize():
         w, h = (config.settings.windowWidth.get(), config.settings.windowHeight.get())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+Compact vertex layout for the chunk geometry kept by the high detail block renderers.
+
+Block renderers build their quads in the float layout described in renderer.py: six float32 values per vertex, x, y,
+z, s, t and the colour bytes, 24 bytes in all. Once a chunk section is meshed, quantize() packs each array into
+packedVertex, 16 bytes per vertex:
+
+- xyz: int16 fixed point, POSITION_SCALE units per block. Vertices are relative to their section, so they stay well
+  within the int16 range, and 1/256 of a block is finer than any offset the renderers use.
+- w: unused, keeps the texture coordinates and colour 4-byte aligned.
+- st: int16 fixed point, TEXCOORD_SCALE units per texture pixel.
+- rgba: the colour bytes, unchanged.
+
+Packed arrays keep the (quads, 4) shape of the float arrays, so len() is still the number of quads. They are drawn
+with GL_SHORT pointers under a modelview and texture scale that undoes the fixed point.
+"""
+
+import numpy
+
+POSITION_SCALE = 256
+TEXCOORD_SCALE = 16
+
+packedVertex = numpy.dtype([("xyz", "<i2", (3,)), ("w", "<i2"), ("st", "<i2", (2,)), ("rgba", "u1", (4,))])
+packedVertexByteLength = packedVertex.itemsize
+
+_limits = numpy.iinfo(numpy.int16)
+
+
+def isFloatLayout(vertexArray):
+    """ True if vertexArray uses the float layout built by the block renderers. """
+    return vertexArray.dtype == numpy.float32 and vertexArray.shape[-1] == 6
+
+
+def isPacked(vertexArray):
+    return vertexArray.dtype == packedVertex
+
+
+def _fixed(values, scale):
+    fixed = numpy.rint(values * scale)
+    fixed.clip(_limits.min, _limits.max, fixed)
+    return fixed
+
+
+def quantize(vertexArray):
+    """ Pack a float layout array of shape (..., 6) into a packedVertex array of shape (...). """
+    packed = numpy.zeros(vertexArray.shape[:-1], packedVertex)
+    packed["xyz"] = _fixed(vertexArray[..., 0:3], POSITION_SCALE)
+    packed["st"] = _fixed(vertexArray[..., 3:5], TEXCOORD_SCALE)
+    packed["rgba"] = numpy.ascontiguousarray(vertexArray).view('uint8')[..., 20:24]
+    return packed
+
+
+def expand(packed):
+    """ Convert a packedVertex array back to the float layout. """
+    vertexArray = numpy.zeros(packed.shape + (6,), numpy.float32)
+    vertexArray[..., 0:3] = packed["xyz"]
+    vertexArray[..., 0:3] /= POSITION_SCALE
+    vertexArray[..., 3:5] = packed["st"]
+    vertexArray[..., 3:5] /= TEXCOORD_SCALE
+    vertexArray.view('uint8')[..., 20:24] = packed["rgba"]
+    return vertexArray